@@ -1,7 +1,20 @@
+import argparse
+import hashlib
+import json
 import os
-import shutil
-from ultralytics import YOLO
-from PIL import Image
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from crop_manifest import CropManifest, hash_model_file
+from crop_shards import CropShardWriter, sample_key
+from image_store import link_or_copy
+from metrics import METRICS, timed_iter
 
 # ============ PARAMETERS ============
 MODEL_PATH = "model.pt"
@@ -10,6 +23,21 @@ OUTPUT_FOLDER = "crop"
 CONFIDENCE_THRESHOLD = 0.5  # Prediction threshold (0.0 - 1.0)
 BBOX_EXPANSION = 0.1  # Percentage to expand bbox (0.1 = 10%)
 SHOW_BBOX = False  # True = show bounding box, False = hide bbox
+PIPELINE_MODE = True  # True = decode, predict and write crops in parallel stages, False = one image at a time
+BATCH_SIZE = 8  # Images per model.predict call
+DECODE_WORKERS = 4  # Threads decoding images ahead of the model
+WRITER_WORKERS = 4  # Threads writing crops to disk
+QUEUE_SIZE = 32  # Max decoded images / pending writes between stages
+JPEG_QUALITY = 75  # Quality of the saved crops (75 = PIL's default)
+PRINT_EACH_CROP = True  # False = one summary line per image, faster on crowded frames
+INCREMENTAL = True  # Skip images already processed with the same model (False = redo everything)
+MANIFEST_PATH = os.path.join(OUTPUT_FOLDER, "manifest.sqlite")  # Index of processed images and their crops
+STATS_FOLDER = os.path.join(OUTPUT_FOLDER, "stats")  # Partial statistics per shard, merged into the summary
+METRICS_CSV_FILE = None  # CSV log of per-stage timings, e.g. os.path.join(OUTPUT_FOLDER, "metrics.csv") (None disables)
+METRICS_PROM_FILE = None  # Prometheus textfile-collector output (None disables)
+OUTPUT_FORMAT = "folders"  # "folders" = one JPEG per crop in per-confidence folders, "tar" = WebDataset tar shards per confidence range
+TAR_FOLDER = os.path.join(OUTPUT_FOLDER, "shards")  # Tar shards and their crop index (OUTPUT_FORMAT = "tar")
+TAR_SHARD_MB = 1024  # Size at which a tar shard is closed and the next one started
 # ====================================
 
 # Define confidence ranges and corresponding subfolder names
@@ -45,41 +73,395 @@ def expand_bbox(x1, y1, x2, y2, expansion, img_width, img_height):
     
     return int(new_x1), int(new_y1), int(new_x2), int(new_y2)
 
-def main():
+# Folder names indexed by the bin numbers from get_confidence_bins, 'other' last
+CONFIDENCE_FOLDER_NAMES = [folder_name for _, _, folder_name in CONFIDENCE_RANGES] + ["other"]
+
+def get_confidence_bins(confidences):
+    """Array version of get_confidence_folder: index into CONFIDENCE_FOLDER_NAMES per confidence"""
+    order = np.argsort([min_conf for min_conf, _, _ in CONFIDENCE_RANGES])
+    mins = np.array([CONFIDENCE_RANGES[i][0] for i in order])
+    maxs = np.array([CONFIDENCE_RANGES[i][1] for i in order])
+    
+    # Range whose lower bound is the closest one below each confidence
+    candidate = np.digitize(confidences, mins) - 1
+    inside = (candidate >= 0) & (confidences < maxs[np.maximum(candidate, 0)])
+    
+    bins = np.full(len(confidences), len(CONFIDENCE_RANGES))
+    bins[inside] = order[candidate[inside]]
+    return bins
+
+def expand_bboxes(xyxy, expansion, img_width, img_height):
+    """Array version of expand_bbox for an (N, 4) array of boxes, returns int coordinates"""
+    size = xyxy[:, 2:4] - xyxy[:, 0:2]
+    half_expand = np.tile(size * expansion / 2, 2)
+    
+    expanded = xyxy + half_expand * np.array([-1, -1, 1, 1])
+    expanded = np.clip(expanded, 0, [img_width, img_height, img_width, img_height])
+    return expanded.astype(int)
+
+def draw_bbox(img, bbox):
+    """Copy of a crop with the original bbox drawn on it (bbox=None returns the crop itself)"""
+    if bbox is None:
+        return img
+    img = img.copy()
+    cv2.rectangle(img, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 0, 255), 3)
+    return img
+
+def write_jpeg(path, img, bbox=None):
+    """Encode a BGR array as JPEG, optionally drawing the original bbox on it first"""
+    img = draw_bbox(img, bbox)
+    with METRICS.timer("crop_write"):
+        ok = cv2.imwrite(path, img, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise IOError(f"could not write {path}")
+
+def write_crop_sample(shards, group, crop_id, key, img, bbox, metadata):
+    """Encode a crop as JPEG and append it with its metadata to the tar shards of its group"""
+    img = draw_bbox(img, bbox)
+    with METRICS.timer("crop_write"):
+        ok, jpeg = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not ok:
+            raise IOError(f"could not encode crop {key}")
+        shards.add(group, crop_id, key, jpeg.tobytes(), "jpg", metadata)
+
+def write_file_sample(shards, group, crop_id, key, source_path, metadata):
+    """Append an image file unchanged (a null image) to the tar shards of a group"""
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    extension = os.path.splitext(source_path)[1].lstrip('.').lower()
+    shards.add(group, crop_id, key, data, extension, metadata)
+
+def read_image(img_path):
+    with METRICS.timer("decode"):
+        return cv2.imread(img_path)
+
+def iter_decoded(img_paths, workers, queue_size):
+    """Yield (img_path, BGR array) in input order while a thread pool decodes ahead"""
+    if workers <= 0:
+        for img_path in img_paths:
+            yield img_path, read_image(img_path)
+        return
+    
+    # Bounded queue of futures: decoding stays at most queue_size images ahead
+    decoded = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    
+    def produce(pool):
+        for img_path in img_paths:
+            if stop.is_set():
+                break
+            decoded.put((img_path, pool.submit(read_image, img_path)))
+        decoded.put(None)
+    
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as pool:
+        producer = threading.Thread(target=produce, args=(pool,), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = decoded.get()
+                if item is None:
+                    break
+                img_path, future = item
+                yield img_path, future.result()
+        finally:
+            # Unblock the producer if the consumer stopped early
+            stop.set()
+            while producer.is_alive():
+                try:
+                    decoded.get_nowait()
+                except queue.Empty:
+                    producer.join(0.05)
+
+def iter_batches(items, batch_size):
+    """Group an iterable into lists of at most batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class CropWriter:
+    """Writes crops and copies files on a pool of threads fed by a bounded queue.
+    
+    Writes can be grouped per image with begin_image/finish_image; once all
+    writes of an image are done it shows up in take_completed().
+    """
+    
+    def __init__(self, workers, queue_size):
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.outstanding = {}  # image key -> writes not done yet (+1 until finish_image)
+        self.failed = set()
+        self.completed = queue.Queue()  # (image key, all writes succeeded)
+        self.threads = [threading.Thread(target=self._run, name=f"writer-{i}", daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+    
+    def begin_image(self, image_key):
+        with self.lock:
+            self.outstanding[image_key] = 1
+    
+    def finish_image(self, image_key):
+        """Mark that all writes for the image have been submitted"""
+        self._write_done(image_key, True)
+    
+    def save_crop(self, crop_path, crop, bbox=None, image_key=None):
+        self._submit(image_key, write_jpeg, crop_path, crop, bbox)
+    
+    def copy_file(self, source_path, dest_path, image_key=None):
+        # Null images are linked rather than copied when the filesystem allows it
+        self._submit(image_key, link_or_copy, source_path, dest_path)
+    
+    def save_crop_sample(self, shards, group, crop_id, key, crop, metadata, bbox=None, image_key=None):
+        # Encoding runs on the writer threads, only the append to the tar is serialized
+        self._submit(image_key, write_crop_sample, shards, group, crop_id, key, crop, bbox, metadata)
+    
+    def copy_file_sample(self, shards, group, crop_id, key, source_path, metadata, image_key=None):
+        self._submit(image_key, write_file_sample, shards, group, crop_id, key, source_path, metadata)
+    
+    def take_completed(self):
+        """Return [(image_key, ok)] for the images whose writes all finished since the last call"""
+        completed = []
+        while True:
+            try:
+                completed.append(self.completed.get_nowait())
+            except queue.Empty:
+                return completed
+    
+    def _submit(self, image_key, func, *args):
+        if image_key is not None:
+            with self.lock:
+                self.outstanding[image_key] += 1
+        if self.threads:
+            self.jobs.put((image_key, func, args))
+        else:
+            self._execute(image_key, func, args)
+    
+    def _execute(self, image_key, func, args):
+        ok = True
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"  └─ Error writing output: {e}")
+            ok = False
+            with self.lock:
+                self.errors += 1
+        if image_key is not None:
+            self._write_done(image_key, ok)
+    
+    def _write_done(self, image_key, ok):
+        with self.lock:
+            if not ok:
+                self.failed.add(image_key)
+            self.outstanding[image_key] -= 1
+            if self.outstanding[image_key] == 0:
+                del self.outstanding[image_key]
+                self.completed.put((image_key, image_key not in self.failed))
+                self.failed.discard(image_key)
+    
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            self._execute(*job)
+    
+    def close(self):
+        """Wait until every queued write is on disk"""
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+def get_shard(img_file, shard_count):
+    """Deterministic shard of a file name, identical on every machine and Python run"""
+    digest = hashlib.sha1(img_file.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+def shard_suffix(shard_index, shard_count):
+    return f"shard{shard_index}of{shard_count}"
+
+def recorded_shard_count():
+    """Shard count of the manifests already in the output folder, or None before the first run"""
+    folder, manifest_name = os.path.split(MANIFEST_PATH)
+    pattern = re.escape(os.path.splitext(manifest_name)[0]) + r"\.shard\d+of(\d+)\.sqlite"
+    counts = set()
+    if os.path.isdir(folder or "."):
+        for name in os.listdir(folder or "."):
+            if name == manifest_name:
+                counts.add(1)
+            match = re.fullmatch(pattern, name)
+            if match:
+                counts.add(int(match.group(1)))
+    if len(counts) > 1:
+        raise ValueError(f"{folder} has manifests for {sorted(counts)} shards; keep one set and remove the others")
+    return counts.pop() if counts else None
+
+def check_shard_count(shard_count):
+    """Refuse a shard count other than the one the output folder was processed with"""
+    # Manifest names and crop ids both depend on the shard count: another count would start empty
+    # manifests, process every image again and hand out crop ids that are already taken
+    recorded = recorded_shard_count()
+    if recorded is not None and recorded != shard_count:
+        raise ValueError(f"{OUTPUT_FOLDER} was processed with {recorded} shard(s), not {shard_count}; "
+                         f"run with --shard-count {recorded} (or --workers {recorded}), or use a new OUTPUT_FOLDER")
+
+def print_summary(stats):
+    """Print the statistics of a run (or of all shards merged)"""
+    print("-" * 50)
+    print(f"Complete!")
+    print(f"  • Total crops: {stats['crop_counter']}")
+    print(f"\nCrops per confidence range:")
+    for _, _, folder_name in CONFIDENCE_RANGES:
+        count = stats["range_counters"][folder_name]
+        if count > 0:
+            print(f"  • {folder_name}: {count} crops")
+    if stats["range_counters"]["other"] > 0:
+        print(f"  • other: {stats['range_counters']['other']} crops")
+    print(f"\n  • Images without detections (null): {stats['null_counter']}")
+    print(f"  • Unchanged images skipped: {stats['skipped_counter']}")
+    if stats["failed_writes"]:
+        print(f"  • Failed writes: {stats['failed_writes']}")
+    seconds = max(stats["seconds"], 1e-9)
+    print(f"  • Throughput: {stats['images'] / seconds:.2f} images/sec, {stats['crop_counter'] / seconds:.2f} crops/sec")
+
+def merge_shard_stats(shard_count):
+    """Combine the partial statistics of all shards into one summary and save it"""
+    merged = {"crop_counter": 0, "null_counter": 0, "skipped_counter": 0, "images": 0,
+              "failed_writes": 0, "seconds": 0.0, "range_counters": {name: 0 for name in CONFIDENCE_FOLDER_NAMES}}
+    missing = []
+    for shard_index in range(shard_count):
+        stats_path = os.path.join(STATS_FOLDER, f"{shard_suffix(shard_index, shard_count)}.json")
+        if not os.path.exists(stats_path):
+            missing.append(shard_index)
+            continue
+        with open(stats_path, 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+        for key in ("crop_counter", "null_counter", "skipped_counter", "images", "failed_writes"):
+            merged[key] += stats[key]
+        for name, count in stats["range_counters"].items():
+            merged["range_counters"][name] = merged["range_counters"].get(name, 0) + count
+        # Shards run in parallel, so the wall time is the slowest one
+        merged["seconds"] = max(merged["seconds"], stats["seconds"])
+    
+    if missing:
+        print(f"Warning: no statistics for shard(s) {missing}, the summary is incomplete")
+    
+    with open(os.path.join(STATS_FOLDER, f"summary_{shard_count}shards.json"), 'w', encoding='utf-8') as f:
+        json.dump(merged, f, indent=2)
+    return merged
+
+def launch_local_shards(workers):
+    """Run one shard per worker as separate processes on this machine, then merge the results"""
+    check_shard_count(workers)
+    os.makedirs(os.path.join(STATS_FOLDER, "logs"), exist_ok=True)
+    
+    # Split the cores between the processes instead of every process using all of them
+    env = dict(os.environ)
+    env["OMP_NUM_THREADS"] = str(max(1, (os.cpu_count() or 1) // workers))
+    
+    processes = []
+    for shard_index in range(workers):
+        log_path = os.path.join(STATS_FOLDER, "logs", f"{shard_suffix(shard_index, workers)}.log")
+        log_file = open(log_path, 'w', encoding='utf-8')
+        command = [sys.executable, os.path.abspath(__file__),
+                   "--shard-index", str(shard_index), "--shard-count", str(workers)]
+        processes.append((shard_index, subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, env=env), log_file))
+        print(f"Started shard {shard_index + 1}/{workers} (log: {log_path})")
+    
+    for shard_index, process, log_file in processes:
+        process.wait()
+        log_file.close()
+        status = "done" if process.returncode == 0 else f"failed with exit code {process.returncode}"
+        print(f"Shard {shard_index + 1}/{workers} {status}")
+    
+    print_summary(merge_shard_stats(workers))
+
+def main(shard_index=0, shard_count=1, model=None):
     # Create main output folder
     os.makedirs(OUTPUT_FOLDER, exist_ok=True)
     
-    # Create null subfolder
+    # Null subfolder
     null_folder = os.path.join(OUTPUT_FOLDER, "null")
-    os.makedirs(null_folder, exist_ok=True)
     
-    # Create confidence range subfolders
+    # Confidence range subfolders
     confidence_folders = {}
     for min_conf, max_conf, folder_name in CONFIDENCE_RANGES:
-        folder_path = os.path.join(OUTPUT_FOLDER, folder_name)
-        os.makedirs(folder_path, exist_ok=True)
-        confidence_folders[folder_name] = folder_path
+        confidence_folders[folder_name] = os.path.join(OUTPUT_FOLDER, folder_name)
     
-    # Create 'other' folder for confidence values outside the ranges
-    other_folder = os.path.join(OUTPUT_FOLDER, "other")
-    os.makedirs(other_folder, exist_ok=True)
-    confidence_folders["other"] = other_folder
+    # 'other' folder for confidence values outside the ranges
+    confidence_folders["other"] = os.path.join(OUTPUT_FOLDER, "other")
     
-    # Load YOLO model
-    print(f"Loading model: {MODEL_PATH}")
-    model = YOLO(MODEL_PATH)
+    # In tar mode the same groups become shard folders instead
+    shards = None
+    if OUTPUT_FORMAT == "tar":
+        prefix = f"crops-{shard_suffix(shard_index, shard_count)}" if shard_count > 1 else "crops"
+        shards = CropShardWriter(TAR_FOLDER, TAR_SHARD_MB * 1024 * 1024, prefix)
+    else:
+        # Create the subfolders
+        for folder_path in [null_folder] + list(confidence_folders.values()):
+            os.makedirs(folder_path, exist_ok=True)
+    
+    # Per-stage timings; shards write their own files
+    if METRICS_CSV_FILE or METRICS_PROM_FILE:
+        suffix = f".{shard_suffix(shard_index, shard_count)}" if shard_count > 1 else ""
+        METRICS.configure(METRICS_CSV_FILE and METRICS_CSV_FILE + suffix,
+                          METRICS_PROM_FILE and METRICS_PROM_FILE + suffix, app="crop_prediction")
+    
+    # Load YOLO model (the benchmark passes its own stub instead)
+    if model is None:
+        from ultralytics import YOLO
+        
+        print(f"Loading model: {MODEL_PATH}")
+        model = YOLO(MODEL_PATH)
     
     # Supported image formats
     image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif')
     
-    # Get all images in the input folder
-    image_files = [f for f in os.listdir(INPUT_FOLDER) 
-                   if f.lower().endswith(image_extensions)]
+    # Manifest of processed images, so re-runs only handle new or changed files.
+    # Shards get their own manifest, so machines never share one SQLite file
+    check_shard_count(shard_count)
+    manifest_path = MANIFEST_PATH
+    if shard_count > 1:
+        manifest_path = f"{os.path.splitext(MANIFEST_PATH)[0]}.{shard_suffix(shard_index, shard_count)}.sqlite"
+    manifest = CropManifest(manifest_path)
+    try:
+        model_hash = hash_model_file(MODEL_PATH)
+    except OSError:
+        # Model fetched by name rather than from a local file
+        model_hash = MODEL_PATH
+    processed = manifest.processed_images(model_hash) if INCREMENTAL else {}
     
-    print(f"Found images: {len(image_files)}")
+    # Get all new or changed images in the input folder
+    image_files = []
+    file_stats = {}
+    skipped_counter = 0
+    with os.scandir(INPUT_FOLDER) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(image_extensions):
+                continue
+            if shard_count > 1 and get_shard(entry.name, shard_count) != shard_index:
+                continue
+            stat = entry.stat()
+            file_stats[entry.name] = (stat.st_size, stat.st_mtime_ns)
+            if processed.get(os.path.abspath(entry.path)) == file_stats[entry.name]:
+                skipped_counter += 1
+            else:
+                image_files.append(entry.name)
+    
+    print(f"Found images: {len(image_files) + skipped_counter} ({skipped_counter} unchanged since the last run)")
     print(f"Confidence threshold: {CONFIDENCE_THRESHOLD}")
     print(f"Bounding box expansion: {BBOX_EXPANSION * 100}%")
     print(f"Show bounding box: {SHOW_BBOX}")
+    print(f"Pipeline mode: {PIPELINE_MODE} (batch size {BATCH_SIZE})")
+    print(f"Output format: {OUTPUT_FORMAT}")
+    if shard_count > 1:
+        print(f"Shard: {shard_index + 1} of {shard_count}")
     print("-" * 50)
     
     # Counters for statistics
@@ -88,86 +470,184 @@ def main():
     range_counters = {folder_name: 0 for _, _, folder_name in CONFIDENCE_RANGES}
     range_counters["other"] = 0
     
-    for img_file in image_files:
-        img_path = os.path.join(INPUT_FOLDER, img_file)
-        print(f"Processing: {img_file}")
+    # Stage 1: decoding threads, stage 3: writer threads (both inline without pipeline mode)
+    img_paths = [os.path.join(INPUT_FOLDER, f) for f in image_files]
+    decoded = iter_decoded(img_paths, DECODE_WORKERS if PIPELINE_MODE else 0, QUEUE_SIZE)
+    writer = CropWriter(WRITER_WORKERS if PIPELINE_MODE else 0, QUEUE_SIZE)
+    start_time = time.perf_counter()
+    
+    # Manifest records of images whose writes are still in flight
+    pending_records = {}
+    
+    def checkpoint():
+        """Record the images whose outputs are fully on disk in the manifest"""
+        finished = []
+        for img_path, ok in writer.take_completed():
+            record = pending_records.pop(img_path)
+            if ok:
+                finished.append(record)
+        if finished:
+            # Samples reach the tar files before the manifest says their image is done
+            if shards is not None:
+                shards.flush()
+            manifest.record_images(finished)
+    
+    # Stage 2: batched prediction on the already-decoded arrays
+    for batch in iter_batches(decoded, BATCH_SIZE if PIPELINE_MODE else 1):
+        readable = []
+        for img_path, img in batch:
+            if img is None:
+                print(f"Could not read: {os.path.basename(img_path)}")
+            else:
+                readable.append((img_path, img))
+        if not readable:
+            continue
         
         # Make prediction
-        results = model.predict(img_path, conf=CONFIDENCE_THRESHOLD, verbose=False)
+        # The results are streamed, so the inference time is measured while iterating
+        results = list(timed_iter("predict", model.predict([img for _, img in readable], conf=CONFIDENCE_THRESHOLD,
+                                                           verbose=False, stream=True)))
         
-        # Open original image
-        img = Image.open(img_path)
-        img_width, img_height = img.size
+        # All detections of each image in one device-to-host transfer: x1, y1, x2, y2, conf, cls
+        batch_boxes = [result.boxes.data.cpu().numpy() for result in results]
         
-        # Counter for detections in this image
-        detections_in_image = 0
+        # Crop ids come from the manifest, so names never collide with earlier runs. The ids of the whole
+        # batch are reserved in one transaction and handed out here (a null image needs an id too)
+        id_count = sum(len(boxes) or 1 for boxes in batch_boxes)
+        next_crop_id = manifest.reserve_crop_ids(id_count) if id_count else 0
         
-        # Process each detection
-        for result in results:
-            boxes = result.boxes
+        for (img_path, _), result, boxes in zip(readable, results, batch_boxes):
+            img_file = os.path.basename(img_path)
+            print(f"Processing: {img_file}")
             
-            for idx, box in enumerate(boxes):
-                # Get bounding box coordinates
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                confidence = float(box.conf[0].cpu().numpy())
-                class_id = int(box.cls[0].cpu().numpy())
-                
-                # Expand bounding box
-                x1_exp, y1_exp, x2_exp, y2_exp = expand_bbox(
-                    x1, y1, x2, y2, BBOX_EXPANSION, img_width, img_height
-                )
-                
-                # Crop image
-                cropped_img = img.crop((x1_exp, y1_exp, x2_exp, y2_exp))
-                
-                # Optional: draw bounding box on the crop
-                if SHOW_BBOX:
-                    from PIL import ImageDraw
-                    draw = ImageDraw.Draw(cropped_img)
-                    
-                    # Calculate relative position of original bbox in crop
-                    rel_x1 = x1 - x1_exp
-                    rel_y1 = y1 - y1_exp
-                    rel_x2 = x2 - x1_exp
-                    rel_y2 = y2 - y1_exp
-                    
-                    draw.rectangle([rel_x1, rel_y1, rel_x2, rel_y2], 
-                                   outline="red", width=3)
-                
-                # Determine which subfolder the crop should go to
-                conf_folder_name = get_confidence_folder(confidence)
-                conf_folder_path = confidence_folders[conf_folder_name]
-                
-                # Save crop in correct subfolder
-                base_name = os.path.splitext(img_file)[0]
-                crop_filename = f"{base_name}_crop_{crop_counter}_conf{confidence:.2f}.jpg"
-                crop_path = os.path.join(conf_folder_path, crop_filename)
+            # Crops are cut from the decoded array, the file is not read again
+            img = result.orig_img
+            img_height, img_width = img.shape[:2]
+            
+            xyxy = boxes[:, :4]
+            confidences = boxes[:, -2]
+            class_ids = boxes[:, -1].astype(int)
+            
+            # Expand, clip and bin every box at once
+            expanded = expand_bboxes(xyxy, BBOX_EXPANSION, img_width, img_height)
+            bins = get_confidence_bins(confidences)
+            
+            # Position of the original bbox inside each crop, for SHOW_BBOX
+            relative = (xyxy - np.tile(expanded[:, :2], 2)).astype(int)
+            
+            first_crop_id = next_crop_id
+            next_crop_id += len(boxes)
+            size, mtime_ns = file_stats[img_file]
+            record = {"path": os.path.abspath(img_path), "size": size, "mtime_ns": mtime_ns,
+                      "model_hash": model_hash, "status": "cropped", "crops": []}
+            pending_records[img_path] = record
+            writer.begin_image(img_path)
+            
+            base_name = os.path.splitext(img_file)[0]
+            for i in range(len(boxes)):
+                x1_exp, y1_exp, x2_exp, y2_exp = expanded[i]
+                confidence = confidences[i]
+                conf_folder_name = CONFIDENCE_FOLDER_NAMES[bins[i]]
                 
-                cropped_img.save(crop_path)
+                # Save crop in correct subfolder, the JPEG encoding happens on the writer threads.
+                # Shards interleave their ids so names stay unique across all shards
+                crop_id = (first_crop_id + i) * shard_count + shard_index
+                crop = img[y1_exp:y2_exp, x1_exp:x2_exp]
+                bbox = relative[i] if SHOW_BBOX else None
+                if shards is not None:
+                    # One sample per crop: the JPEG plus its metadata as a JSON sidecar
+                    crop_filename = sample_key(base_name, crop_id)
+                    crop_path = f"{os.path.join(TAR_FOLDER, conf_folder_name)}#{crop_filename}"
+                    metadata = {"crop_id": crop_id, "source_image": os.path.abspath(img_path),
+                                "box": [float(v) for v in xyxy[i]], "crop_box": [int(v) for v in expanded[i]],
+                                "confidence": float(confidence), "class_id": int(class_ids[i]),
+                                "expansion": BBOX_EXPANSION, "confidence_range": conf_folder_name}
+                    writer.save_crop_sample(shards, conf_folder_name, crop_id, crop_filename, crop, metadata,
+                                            bbox, image_key=img_path)
+                else:
+                    crop_filename = f"{base_name}_crop_{crop_id}_conf{confidence:.2f}.jpg"
+                    crop_path = os.path.join(confidence_folders[conf_folder_name], crop_filename)
+                    writer.save_crop(crop_path, crop, bbox, image_key=img_path)
+                record["crops"].append((crop_id, crop_path, conf_folder_name, float(confidence),
+                                        int(class_ids[i]), int(x1_exp), int(y1_exp), int(x2_exp), int(y2_exp)))
                 crop_counter += 1
-                detections_in_image += 1
-                range_counters[conf_folder_name] += 1
                 
-                print(f"  └─ Crop saved in '{conf_folder_name}': {crop_filename} (conf: {confidence:.2f})")
+                if PRINT_EACH_CROP:
+                    print(f"  └─ Crop saved in '{conf_folder_name}': {crop_filename} (conf: {confidence:.2f})")
+            
+            # Statistics per confidence range
+            for bin_index, count in zip(*np.unique(bins, return_counts=True)):
+                range_counters[CONFIDENCE_FOLDER_NAMES[bin_index]] += int(count)
+            detections_in_image = len(boxes)
+            if detections_in_image and not PRINT_EACH_CROP:
+                print(f"  └─ {detections_in_image} crops saved")
+            
+            # If no detections were found, move original image to null folder
+            if detections_in_image == 0:
+                null_id = next_crop_id * shard_count + shard_index
+                next_crop_id += 1
+                if shards is not None:
+                    # The whole image goes into the 'null' shards, under an id of its own
+                    metadata = {"crop_id": null_id, "source_image": os.path.abspath(img_path), "null": True}
+                    null_key = sample_key(base_name, null_id)
+                    writer.copy_file_sample(shards, "null", null_id, null_key, img_path, metadata, image_key=img_path)
+                    null_path = f"{os.path.join(TAR_FOLDER, 'null')}#{null_key}"
+                else:
+                    null_path = os.path.join(null_folder, img_file)
+                    writer.copy_file(img_path, null_path, image_key=img_path)
+                # Listed with the crops, so the copy is removed when the image is processed again
+                record["crops"].append((null_id, null_path, "null", 0.0, -1, 0, 0, img_width, img_height))
+                record["status"] = "null"
+                null_counter += 1
+                print(f"  └─ No detections - moved to 'null'")
+            
+            writer.finish_image(img_path)
         
-        # If no detections were found, move original image to null folder
-        if detections_in_image == 0:
-            null_path = os.path.join(null_folder, img_file)
-            shutil.copy2(img_path, null_path)
-            null_counter += 1
-            print(f"  └─ No detections - moved to 'null'")
+        checkpoint()
     
-    print("-" * 50)
-    print(f"Complete!")
-    print(f"  • Total crops: {crop_counter}")
-    print(f"\nCrops per confidence range:")
-    for _, _, folder_name in CONFIDENCE_RANGES:
-        count = range_counters[folder_name]
-        if count > 0:
-            print(f"  • {folder_name}: {count} crops")
-    if range_counters["other"] > 0:
-        print(f"  • other: {range_counters['other']} crops")
-    print(f"\n  • Images without detections (null): {null_counter}")
+    # Wait for the writers to finish before reporting
+    writer.close()
+    checkpoint()
+    manifest.close()
+    if shards is not None:
+        shards.close()
+        print(shards.stats())
+    
+    stats = {
+        "crop_counter": crop_counter,
+        "null_counter": null_counter,
+        "range_counters": range_counters,
+        "skipped_counter": skipped_counter,
+        "images": len(image_files),
+        "failed_writes": writer.errors,
+        "seconds": time.perf_counter() - start_time
+    }
+    
+    # Partial statistics of this shard, combined later by merge_shard_stats
+    if shard_count > 1:
+        os.makedirs(STATS_FOLDER, exist_ok=True)
+        with open(os.path.join(STATS_FOLDER, f"{shard_suffix(shard_index, shard_count)}.json"), 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2)
+    
+    print_summary(stats)
+    print(f"\nStage timings:\n{METRICS.summary()}")
+    METRICS.export()
+    return stats
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Crop YOLO detections into folders per confidence range")
+    parser.add_argument("--shard-index", type=int, default=0, help="which part of the input this process handles")
+    parser.add_argument("--shard-count", type=int, default=1, help="number of parts the input is split into")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run this many local shard processes and merge them "
+                             "(-1 = as many as the output folder was processed with, else one per CPU core)")
+    parser.add_argument("--merge", action="store_true", help="only merge the statistics of --shard-count shards")
+    args = parser.parse_args()
+    
+    if args.merge:
+        print_summary(merge_shard_stats(args.shard_count))
+    elif args.workers:
+        workers = args.workers if args.workers > 0 else (recorded_shard_count() or os.cpu_count() or 1)
+        launch_local_shards(workers)
+    else:
+        main(args.shard_index, args.shard_count)
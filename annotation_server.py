@@ -0,0 +1,506 @@
+import argparse
+import getpass
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from annotation_state import AnnotationState, PENDING, SAVED, SKIPPED
+from dataset_store import DatasetStore
+from folder_scanner import FolderScanner, IMAGE_EXTENSIONS
+from image_store import ImageStore
+
+DEFAULT_PORT = 8765
+LEASE_SECONDS = 300  # Leased images go back to the queue when not renewed for this long
+CONTENT_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+
+class LeaseError(Exception):
+    """The image is not (or no longer) leased to the caller"""
+
+
+def default_annotator():
+    return f"{getpass.getuser()}@{socket.gethostname()}"
+
+
+class AnnotationQueue:
+    """Hands out the images of an input folder to several annotators in leased batches.
+
+    A lease gives one annotator a batch of pending images for lease_seconds;
+    renewing extends it. Images of an expired or released lease go back to the
+    queue, and a save is only accepted from the annotator holding the image (or
+    from its last holder while nobody else took it), so no image is labeled
+    twice. Saved records are merged into one dataset in the generate_json_data
+    format, with "image" pointing into the annotated images store.
+    """
+
+    def __init__(self, input_folder, output_folder_labels, output_folder_images, state_db,
+                 lease_seconds=LEASE_SECONDS, label_format="jsonl", content_addressed=False, watch_interval=5.0):
+        self.input_folder = input_folder
+        self.output_folder_labels = output_folder_labels
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+
+        os.makedirs(self.output_folder_labels, exist_ok=True)
+        self.state = AnnotationState(state_db, input_folder)
+        self.label_store = DatasetStore(output_folder_labels) if label_format == "jsonl" else None
+        self.image_store = ImageStore(output_folder_images, content_addressed)
+
+        self.scanner = FolderScanner(input_folder, IMAGE_EXTENSIONS, watch_interval)
+        self.scanner.start()
+
+        self.leases = {}  # lease id -> {"annotator", "names", "expires_at"}
+        self.leased = {}  # image name -> lease id
+        self.expired = {}  # image name -> lease id it was last held under, while nobody else holds it
+        self.counts = {"leased": 0, "expired": 0, SAVED: 0, SKIPPED: 0}
+
+    def _refresh(self):
+        """Queue newly found images and put the images of expired leases back"""
+        found = self.scanner.take_new()
+        if found:
+            self.state.add_images(found)
+        listing = self.scanner.take_listing()
+        if listing is not None:
+            self.state.sync(listing)
+
+        now = time.time()
+        for lease_id, lease in list(self.leases.items()):
+            if lease["expires_at"] <= now:
+                self._end_lease(lease_id)
+                for name in lease["names"]:
+                    self.expired[name] = lease_id
+                self.counts["expired"] += len(lease["names"])
+                print(f"Lease of {lease['annotator']} expired, {len(lease['names'])} images back in the queue")
+
+    def _end_lease(self, lease_id):
+        lease = self.leases.pop(lease_id)
+        for name in lease["names"]:
+            self.leased.pop(name, None)
+        return lease
+
+    def lease(self, annotator, count):
+        """Lease up to count pending images that nobody else holds"""
+        with self.lock:
+            self._refresh()
+            # Every leased image is still pending, so this many rows always leave count free ones
+            candidates = self.state.pending_batch(count + len(self.leased))
+            names = [name for name in candidates if name not in self.leased][:count]
+            if not names:
+                return {"lease_id": None, "images": [], "expires_in": 0, "scanning": self.scanner.scanning}
+
+            lease_id = uuid.uuid4().hex
+            self.leases[lease_id] = {"annotator": annotator, "names": set(names),
+                                     "expires_at": time.time() + self.lease_seconds}
+            for name in names:
+                self.leased[name] = lease_id
+                self.expired.pop(name, None)
+            self.counts["leased"] += len(names)
+        print(f"Leased {len(names)} images to {annotator}")
+        return {"lease_id": lease_id, "images": names, "expires_in": self.lease_seconds,
+                "scanning": self.scanner.scanning}
+
+    def renew(self, lease_id):
+        with self.lock:
+            self._refresh()
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                raise LeaseError("Lease expired")
+            lease["expires_at"] = time.time() + self.lease_seconds
+        return {"expires_in": self.lease_seconds}
+
+    def release(self, lease_id, names=None):
+        """Give the unfinished images of a lease (or only the named ones) back to the queue"""
+        with self.lock:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return {"released": 0}
+            if names is None:
+                released = self._end_lease(lease_id)["names"]
+            else:
+                released = lease["names"] & set(names)
+                lease["names"] -= released
+                for name in released:
+                    self.leased.pop(name, None)
+                if not lease["names"]:
+                    self._end_lease(lease_id)
+        print(f"{lease['annotator']} released {len(released)} images")
+        return {"released": len(released)}
+
+    def image_path(self, lease_id, name):
+        """Path of a leased image; only the holder of the lease may read it"""
+        with self.lock:
+            if self.leased.get(name) != lease_id:
+                raise LeaseError(f"{name} is not leased to you")
+        return os.path.join(self.input_folder, name)
+
+    def finish(self, lease_id, name, status, record=None):
+        """Store the annotation of a leased image (or that it was skipped) and take it out of its lease"""
+        if status not in (SAVED, SKIPPED):
+            raise ValueError(f"Unknown status: {status}")
+        if status == SAVED and not (isinstance(record, dict) and len(record.get("conversations", [])) >= 2):
+            raise ValueError("The record needs a conversation with a question and an answer")
+
+        with self.lock:
+            self._refresh()
+            holder = self.leased.get(name)
+            # After an expired lease the save still counts as long as nobody else took the image
+            allowed = holder == lease_id or (holder is None and self.expired.get(name) == lease_id)
+            if not allowed or self.state.get_status(name) != PENDING:
+                raise LeaseError(f"{name} was leased to another annotator or is already done")
+
+            if status == SAVED:
+                image_path = self.image_store.add(os.path.join(self.input_folder, name), name)
+                base_name = os.path.splitext(name)[0]
+                record = dict(record, id=base_name, image=image_path)
+                self.write_record(record, os.path.join(self.output_folder_labels, f"{base_name}.json"))
+                question = record["conversations"][0]["value"].replace("<image>\n", "", 1)
+                self.state.set_status(name, SAVED, question, record["conversations"][1]["value"])
+            else:
+                self.state.set_status(name, SKIPPED)
+
+            self.expired.pop(name, None)
+            if holder is not None:
+                lease = self.leases[holder]
+                lease["names"].discard(name)
+                del self.leased[name]
+                if not lease["names"]:
+                    del self.leases[holder]
+            self.counts[status] += 1
+        return {"status": status}
+
+    def write_record(self, json_data, json_path):
+        """Save a record to the label store, or as a JSON file in the labels folder"""
+        if self.label_store is not None:
+            self.label_store.put(json_data)
+            self.label_store.flush()
+        else:
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(json_data, f, indent=2, ensure_ascii=False)
+
+    def status(self):
+        """Images per status plus the active leases per annotator"""
+        with self.lock:
+            self._refresh()
+            annotators = {}
+            for lease in self.leases.values():
+                annotators[lease["annotator"]] = annotators.get(lease["annotator"], 0) + len(lease["names"])
+            return {"images": self.state.counts(), "leased": len(self.leased), "annotators": annotators,
+                    "totals": dict(self.counts), "scanning": self.scanner.scanning}
+
+    def close(self):
+        self.scanner.stop()
+        with self.lock:
+            if self.label_store is not None:
+                self.label_store.close()
+            self.state.close()
+
+
+class AnnotationRequestHandler(BaseHTTPRequestHandler):
+    """JSON API of the annotation server; self.server.queue is the AnnotationQueue"""
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/status":
+            self.respond(self.server.queue.status)
+        elif url.path.startswith("/images/"):
+            name = urllib.parse.unquote(url.path[len("/images/"):])
+            lease_id = urllib.parse.parse_qs(url.query).get("lease", [""])[0]
+            self.respond(lambda: self.send_image(self.server.queue.image_path(lease_id, name)))
+        else:
+            self.send_json(404, {"error": f"Unknown endpoint: {url.path}"})
+
+    def do_POST(self):
+        queue = self.server.queue
+        routes = {
+            "/lease": lambda body: queue.lease(body.get("annotator", "unknown"), int(body.get("count", 1))),
+            "/renew": lambda body: queue.renew(body["lease_id"]),
+            "/release": lambda body: queue.release(body["lease_id"], body.get("names")),
+            "/finish": lambda body: queue.finish(body.get("lease_id"), body["name"], body["status"],
+                                                 body.get("record"))
+        }
+        route = routes.get(urllib.parse.urlsplit(self.path).path)
+        if route is None:
+            self.send_json(404, {"error": f"Unknown endpoint: {self.path}"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        self.respond(lambda: route(json.loads(self.rfile.read(length) or b"{}")))
+
+    def respond(self, handler):
+        """Run a request handler and send its result as JSON, or the error it raised"""
+        try:
+            result = handler()
+        except LeaseError as e:
+            self.send_json(409, {"error": str(e)})
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": f"Bad request: {e}"})
+        except OSError as e:
+            self.send_json(500, {"error": str(e)})
+        else:
+            if result is not None:
+                self.send_json(200, result)
+
+    def send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_image(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream"))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Leases are logged by the queue, one line per request would drown them
+        pass
+
+
+def make_server(queue, host="127.0.0.1", port=DEFAULT_PORT):
+    """HTTP server for a queue, one thread per connection; port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), AnnotationRequestHandler)
+    server.daemon_threads = True
+    server.queue = queue
+    return server
+
+
+class LeaseClient:
+    """Annotator side of the server: leases batches and downloads them ahead of the annotator.
+
+    Has the take_new/take_listing/scanning/error interface of FolderScanner,
+    so the app queues leased images like images found in a folder. A new batch is leased
+    and downloaded as soon as fewer than batch_size images are left to
+    annotate, so the next images are on disk before they are needed. Leases
+    are renewed in the background while their images are held, and released
+    on stop.
+    """
+
+    def __init__(self, server_url, annotator=None, cache_folder="cache/leased", batch_size=8, poll_interval=5.0,
+                 timeout=30):
+        self.server_url = server_url.rstrip("/")
+        self.annotator = annotator or default_annotator()
+        self.cache_folder = cache_folder
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.pending = []
+        self.held = {}  # image name -> lease id, for images not saved or skipped yet
+        self.renewals = {}  # lease id -> [next renewal (monotonic), seconds between renewals]
+        self.unreleased = {}  # lease id -> images that failed to download, to give back to the server
+        self.scanning = True
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+        # The leases of an earlier session are gone, and so is the use of its downloads
+        os.makedirs(self.cache_folder, exist_ok=True)
+        for name in os.listdir(self.cache_folder):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                os.remove(os.path.join(self.cache_folder, name))
+
+    def start(self):
+        self.thread.start()
+
+    def take_new(self):
+        """Return the images downloaded since the last call"""
+        with self.lock:
+            new_files, self.pending = self.pending, []
+        return new_files
+
+    def take_listing(self):
+        """Never a listing: the server reconciles its own folder"""
+        return None
+
+    def request(self, path, payload=None):
+        """POST payload (GET without one) to the server and return its JSON answer"""
+        data = None if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(self.server_url + path, data=data,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            # The server explains refusals (e.g. an image leased to someone else) in the body
+            try:
+                message = json.loads(e.read())["error"]
+            except (ValueError, KeyError):
+                message = e.reason
+            raise RuntimeError(f"Server refused {path}: {message}") from None
+
+    def _download(self, lease_id, name):
+        query = urllib.parse.urlencode({"lease": lease_id})
+        url = f"{self.server_url}/images/{urllib.parse.quote(name)}?{query}"
+        path = os.path.join(self.cache_folder, name)
+        with urllib.request.urlopen(url, timeout=self.timeout) as response, open(path + ".tmp", 'wb') as f:
+            shutil.copyfileobj(response, f)
+        os.replace(path + ".tmp", path)
+
+    def _lease_batch(self):
+        """Lease the next batch and download its images; False when the queue is empty"""
+        answer = self.request("/lease", {"annotator": self.annotator, "count": self.batch_size})
+        if not answer["images"]:
+            return False
+
+        lease_id = answer["lease_id"]
+        interval = answer["expires_in"] / 3
+        with self.lock:
+            self.renewals[lease_id] = [time.monotonic() + interval, interval]
+        failed = []
+        for name in answer["images"]:
+            if self.stop_event.is_set():
+                break
+            try:
+                self._download(lease_id, name)
+            except OSError as e:
+                # Nobody would ever annotate it under this lease, so it goes back to the queue
+                print(f"Could not download {name}: {e}")
+                failed.append(name)
+                continue
+            with self.lock:
+                self.held[name] = lease_id
+                self.pending.append(name)
+
+        if failed:
+            with self.lock:
+                if lease_id not in self.held.values():
+                    self.renewals.pop(lease_id, None)
+                self.unreleased[lease_id] = failed
+        return True
+
+    def _release_failed(self):
+        with self.lock:
+            unreleased = list(self.unreleased.items())
+        for lease_id, names in unreleased:
+            try:
+                self.request("/release", {"lease_id": lease_id, "names": names})
+            except RuntimeError:
+                # Refused: the lease is gone, and the images with it
+                pass
+            with self.lock:
+                self.unreleased.pop(lease_id, None)
+
+    def _renew_due(self):
+        now = time.monotonic()
+        with self.lock:
+            due = [lease_id for lease_id, (next_renewal, _) in self.renewals.items() if next_renewal <= now]
+        for lease_id in due:
+            try:
+                self.request("/renew", {"lease_id": lease_id})
+            except RuntimeError:
+                # Expired already; the images can still be saved while nobody else took them
+                with self.lock:
+                    self.renewals.pop(lease_id, None)
+                continue
+            with self.lock:
+                if lease_id in self.renewals:
+                    self.renewals[lease_id][0] = now + self.renewals[lease_id][1]
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.wake.clear()
+            leased = False
+            try:
+                with self.lock:
+                    to_do = len(self.held)
+                if to_do < self.batch_size:
+                    leased = self._lease_batch()
+                self._release_failed()
+                self._renew_due()
+                self.error = None
+            except (OSError, RuntimeError, ValueError, KeyError) as e:
+                # Server down or unreachable: report it and keep trying
+                self.error = e
+            self.scanning = False
+
+            if leased:
+                continue
+            with self.lock:
+                wait = min([self.poll_interval] + [interval for _, interval in self.renewals.values()])
+            self.wake.wait(wait)
+
+    def finish(self, name, status, record=None):
+        """Send a save or skip to the server; raises RuntimeError when the server refuses it"""
+        with self.lock:
+            lease_id = self.held.get(name)
+        if lease_id is None:
+            raise RuntimeError(f"{name} was already saved or skipped")
+        self.request("/finish", {"lease_id": lease_id, "name": name, "status": status, "record": record})
+
+        with self.lock:
+            del self.held[name]
+            if lease_id not in self.held.values():
+                self.renewals.pop(lease_id, None)
+        # Fewer images left: lease the next batch now
+        self.wake.set()
+
+    def is_held(self, name):
+        """Whether an image is leased to this client and not saved or skipped yet"""
+        with self.lock:
+            return name in self.held
+
+    def save(self, name, record):
+        self.finish(name, SAVED, record)
+
+    def skip(self, name):
+        self.finish(name, SKIPPED)
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake.set()
+        if self.thread.is_alive():
+            self.thread.join(self.timeout)
+
+        # Give the unfinished images back now instead of when their leases expire
+        with self.lock:
+            lease_ids = set(self.held.values()) | set(self.renewals)
+        for lease_id in lease_ids:
+            try:
+                self.request("/release", {"lease_id": lease_id})
+            except (OSError, RuntimeError, ValueError):
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an image folder to several annotators in leased batches")
+    parser.add_argument("--input", default="annotate", help="folder with the images to annotate")
+    parser.add_argument("--labels", default="annotated_labels", help="folder for the merged annotations")
+    parser.add_argument("--images", default="annotated_images", help="folder for the annotated images")
+    parser.add_argument("--state", default="cache/server_state.sqlite", help="status database of the queue")
+    parser.add_argument("--label-format", choices=("jsonl", "files"), default="jsonl")
+    parser.add_argument("--content-addressed", action="store_true", help="name stored images by content hash")
+    parser.add_argument("--lease-seconds", type=float, default=LEASE_SECONDS)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    queue = AnnotationQueue(args.input, args.labels, args.images, args.state, args.lease_seconds,
+                            args.label_format, args.content_addressed)
+    server = make_server(queue, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"Serving {args.input} on http://{host}:{port} (leases of {args.lease_seconds:.0f}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(queue.status(), indent=2))
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
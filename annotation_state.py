@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+SAVED = "saved"
+SKIPPED = "skipped"
+
+
+class AnnotationState:
+    """Persistent annotation progress of every image in an input folder.
+
+    Each image has a status (pending, saved or skipped), the question and
+    answer it was saved with, and timestamps. Images keep the order in which
+    they were first seen, and the (folder, status, seq) index makes "first
+    pending", "next pending after X" and "all skipped" direct lookups instead
+    of directory walks. One database can hold several input folders. sync()
+    reconciles the rows with a complete listing of the folder, using the file
+    size and mtime to notice a name that now holds another image.
+    """
+
+    def __init__(self, db_path, input_folder):
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self.folder = os.path.abspath(input_folder)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        # WAL keeps the commit on every navigation step cheap
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                folder TEXT NOT NULL,
+                name TEXT NOT NULL,
+                status TEXT NOT NULL,
+                in_input INTEGER NOT NULL DEFAULT 1,
+                question TEXT,
+                answer TEXT,
+                added_at REAL NOT NULL,
+                updated_at REAL,
+                viewed_at REAL,
+                size INTEGER,
+                mtime_ns INTEGER,
+                UNIQUE (folder, name)
+            );
+            CREATE INDEX IF NOT EXISTS images_by_status ON images (folder, status, seq);
+        """)
+        # Databases from before sync() have no file stamps yet; the first sync fills them in
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(images)")}
+        for column in ("size", "mtime_ns"):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE images ADD COLUMN {column} INTEGER")
+        self.conn.commit()
+
+    def queue(self):
+        """Names still in the input folder, in the order they were first seen"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name FROM images WHERE folder = ? AND in_input = 1 ORDER BY seq", (self.folder,)
+            ).fetchall()
+        return [name for (name,) in rows]
+
+    def add_images(self, names):
+        """Register newly found images as pending; known images keep their status"""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO images (folder, name, status, added_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (folder, name) DO UPDATE SET in_input = 1",
+                [(self.folder, name, PENDING, now) for name in names]
+            )
+            self.conn.commit()
+
+    def sync(self, listing):
+        """Reconcile with a complete listing {name: (size, mtime_ns)} of the input folder.
+
+        Listed images that are new are added as pending, images whose size or
+        mtime changed are reset to pending, and images that are no longer
+        listed leave the queue. Returns the names that left it.
+        """
+        now = time.time()
+        with self.lock:
+            known = {name: (size, mtime_ns, in_input) for name, size, mtime_ns, in_input in self.conn.execute(
+                "SELECT name, size, mtime_ns, in_input FROM images WHERE folder = ?", (self.folder,))}
+
+            added, changed, stamped, gone = [], [], [], []
+            for name, stamp in listing.items():
+                row = known.get(name)
+                if row is None:
+                    added.append((self.folder, name, PENDING, now, *stamp))
+                elif row[0] is None:
+                    stamped.append((*stamp, self.folder, name))
+                elif row[:2] != tuple(stamp):
+                    changed.append((PENDING, now, *stamp, self.folder, name))
+                elif not row[2]:
+                    stamped.append((*stamp, self.folder, name))
+            for name, (_, _, in_input) in known.items():
+                if in_input and name not in listing:
+                    gone.append((self.folder, name))
+
+            self.conn.executemany(
+                "INSERT INTO images (folder, name, status, added_at, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?)", added)
+            self.conn.executemany(
+                "UPDATE images SET size = ?, mtime_ns = ?, in_input = 1 WHERE folder = ? AND name = ?", stamped)
+            # Another image under a known name: its old status and answer do not apply
+            self.conn.executemany(
+                "UPDATE images SET status = ?, question = NULL, answer = NULL, updated_at = ?, size = ?, "
+                "mtime_ns = ?, in_input = 1 WHERE folder = ? AND name = ?", changed)
+            self.conn.executemany("UPDATE images SET in_input = 0 WHERE folder = ? AND name = ?", gone)
+            self.conn.commit()
+        return [name for _, name in gone]
+
+    def set_status(self, name, status, question=None, answer=None):
+        """Record that an image was saved or skipped (or reset to pending)"""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE images SET status = ?, question = ?, answer = ?, updated_at = ? WHERE folder = ? AND name = ?",
+                (status, question, answer, time.time(), self.folder, name)
+            )
+            self.conn.commit()
+
+    def mark_viewed(self, name):
+        with self.lock:
+            self.conn.execute("UPDATE images SET viewed_at = ? WHERE folder = ? AND name = ?",
+                              (time.time(), self.folder, name))
+            self.conn.commit()
+
+    def mark_moved(self, name):
+        """The image left the input folder (delete mode), so it is no longer queued"""
+        with self.lock:
+            self.conn.execute("UPDATE images SET in_input = 0 WHERE folder = ? AND name = ?", (self.folder, name))
+            self.conn.commit()
+
+    def get_status(self, name):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status FROM images WHERE folder = ? AND name = ?", (self.folder, name)
+            ).fetchone()
+        return row[0] if row else None
+
+    def first_pending(self):
+        """Name of the earliest image that was neither saved nor skipped, or None"""
+        return self.next_pending(None)
+
+    def next_pending(self, after_name):
+        """Name of the first pending image after after_name, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT name FROM images WHERE folder = ? AND status = ? AND in_input = 1 "
+                "AND seq > COALESCE((SELECT seq FROM images WHERE folder = ? AND name = ?), 0) "
+                "ORDER BY seq LIMIT 1",
+                (self.folder, PENDING, self.folder, after_name)
+            ).fetchone()
+        return row[0] if row else None
+
+    def pending_batch(self, limit):
+        """Up to limit pending images, earliest first"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name FROM images WHERE folder = ? AND status = ? AND in_input = 1 ORDER BY seq LIMIT ?",
+                (self.folder, PENDING, limit)
+            ).fetchall()
+        return [name for (name,) in rows]
+
+    def names_with_status(self, status):
+        """All images in the input folder with this status, in queue order"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name FROM images WHERE folder = ? AND status = ? AND in_input = 1 ORDER BY seq",
+                (self.folder, status)
+            ).fetchall()
+        return [name for (name,) in rows]
+
+    def counts(self):
+        """Number of images per status"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM images WHERE folder = ? AND in_input = 1 GROUP BY status",
+                (self.folder,)
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
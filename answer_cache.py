@@ -0,0 +1,86 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+def hash_file_contents(path, chunk_size=1024 * 1024):
+    """Return the sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AnswerCache:
+    """Persistent cache of model answers keyed by image content hash, question and model id.
+
+    Safe to use from the Tk thread and the inference worker at the same time.
+    Content hashes are memoized per (path, size, mtime) so an unchanged file is
+    only read once per session.
+    """
+
+    def __init__(self, db_path):
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                content_hash TEXT NOT NULL,
+                question TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                confidence REAL NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, question, model_id)
+            )
+        """)
+        self.conn.commit()
+        self.hashes = {}  # (path, size, mtime_ns) -> content hash
+
+    def hash_file(self, path):
+        """Return the content hash of an image, reading the file only when it changed"""
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            content_hash = self.hashes.get(key)
+        if content_hash is None:
+            content_hash = hash_file_contents(path)
+            with self.lock:
+                self.hashes[key] = content_hash
+        return content_hash
+
+    def get(self, content_hash, question, model_id):
+        """Return (answer, confidence) or None if this question was never answered for the image"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT answer, confidence FROM answers WHERE content_hash = ? AND question = ? AND model_id = ?",
+                (content_hash, question, model_id)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put(self, content_hash, question, model_id, answer, confidence):
+        """Store an answer, replacing any previous one for the same key"""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, question, model_id, answer, confidence, time.time())
+            )
+            self.conn.commit()
+
+    def lookup(self, image_path, question, model_id):
+        """Convenience wrapper: cached (answer, confidence) for an image file, or None"""
+        try:
+            content_hash = self.hash_file(image_path)
+        except OSError:
+            return None
+        return self.get(content_hash, question, model_id)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
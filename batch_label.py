@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import time
+
+from answer_cache import AnswerCache
+from dataset_store import DatasetStore
+from image_store import ImageStore
+from encoding_cache import EncodingCache
+from moondream_backends import BACKENDS
+from moondream_model import MoondreamPredictor, build_json_data
+
+# ============ PARAMETERS ============
+MODEL_ID = "vikhyatk/moondream2"
+BACKEND = "hf"  # "hf" (transformers), "cpu-int8" (int8-quantized for CPU-only machines) or "stub" (no model)
+THREADS = None  # CPU threads for inference (None: torch default for "hf", every available CPU for "cpu-int8")
+INPUT_FOLDER = "annotate"  # Folder containing images to be labeled
+OUTPUT_FOLDER_LABELS = "annotated_labels"  # Folder for auto-saved JSON files
+OUTPUT_FOLDER_IMAGES = "annotated_images"  # Folder for auto-saved images
+REVIEW_FILE = "review_queue.jsonl"  # Low-confidence records waiting for a human
+STATE_FILE = "cache/batch_label_state.jsonl"  # Finished images, used to resume after a crash
+QUESTION = "What do you see in this image?"
+BATCH_SIZE = 8  # Images per vision-encoder batch
+AUTO_SAVE_CONFIDENCE_THRESHOLD = 0.9  # Answers at or above this are saved directly (0 = review everything)
+ANSWER_CACHE_FILE = "cache/moondream_answers.sqlite"
+ENCODING_CACHE_MB = 512
+LABEL_FORMAT = "jsonl"  # "jsonl" appends records to shards in the labels folder, "files" writes one JSON per image
+CONTENT_ADDRESSED_IMAGES = False  # Name saved images by content hash, so duplicate frames are stored once
+# ====================================
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def load_finished(state_file, question):
+    """Return the image filenames already labeled for this question in earlier runs"""
+    finished = set()
+    if not os.path.exists(state_file):
+        return finished
+
+    with open(state_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a half-written last line
+                continue
+            if entry.get("question") == question:
+                finished.add(entry["image"])
+    return finished
+
+
+def load_reviewed(review_file, question):
+    """Return the image filenames that already have a review record for this question"""
+    reviewed = set()
+    if not os.path.exists(review_file):
+        return reviewed
+
+    with open(review_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("metadata", {}).get("question") == question:
+                reviewed.add(os.path.basename(record["image"]))
+    return reviewed
+
+
+def run_batch(predictor, input_folder, output_folder_labels, output_folder_images, review_file,
+              state_file, question, batch_size=BATCH_SIZE, threshold=AUTO_SAVE_CONFIDENCE_THRESHOLD,
+              label_store=None):
+    """Label every unfinished image in input_folder and return the run statistics.
+
+    Answers with confidence >= threshold are written to output_folder_labels
+    (and the image linked into output_folder_images), the rest are appended to
+    review_file. Finished images are journaled to state_file after every batch,
+    so an interrupted run picks up where it stopped. With a label_store the
+    saved records are appended to it instead of written as separate files.
+    """
+    os.makedirs(output_folder_labels, exist_ok=True)
+    image_store = ImageStore(output_folder_images, CONTENT_ADDRESSED_IMAGES, hash_file=predictor.hash_file)
+    for path in (review_file, state_file):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    image_files = sorted(f for f in os.listdir(input_folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    finished = load_finished(state_file, question)
+    # A crash between the review write and the journal leaves review records for unjournaled images
+    reviewed = load_reviewed(review_file, question)
+    pending = [f for f in image_files if f not in finished]
+
+    print(f"Found images: {len(image_files)} ({len(image_files) - len(pending)} already done)")
+    print(f"Question: {question}")
+    print(f"Batch size: {batch_size}, auto-save threshold: {threshold}")
+    print("-" * 50)
+
+    stats = {"saved": 0, "review": 0, "failed": 0, "skipped": len(image_files) - len(pending)}
+    start_time = time.perf_counter()
+
+    with open(review_file, 'a', encoding='utf-8') as review_out, open(state_file, 'a', encoding='utf-8') as state_out:
+        for batch_start in range(0, len(pending), batch_size):
+            batch = pending[batch_start:batch_start + batch_size]
+            image_paths = [os.path.join(input_folder, f) for f in batch]
+            results = predictor.describe_batch(image_paths, question)
+
+            for img_filename, image_path, (answer, confidence) in zip(batch, image_paths, results):
+                if answer.startswith("Error: "):
+                    # Not journaled, so the next run retries it
+                    print(f"  └─ {img_filename}: {answer}")
+                    stats["failed"] += 1
+                    continue
+
+                if threshold > 0 and confidence >= threshold:
+                    stored_path = image_store.add(image_path, img_filename)
+                    json_data = build_json_data(img_filename, output_folder_images, question, answer, confidence,
+                                                image_path=stored_path)
+                    if label_store is not None:
+                        label_store.put(json_data)
+                    else:
+                        json_path = os.path.join(output_folder_labels, f"{os.path.splitext(img_filename)[0]}.json")
+                        with open(json_path, 'w', encoding='utf-8') as f:
+                            json.dump(json_data, f, indent=2, ensure_ascii=False)
+                    status = "saved"
+                else:
+                    # The reviewer works from the input folder, so point the record there
+                    if img_filename not in reviewed:
+                        json_data = build_json_data(img_filename, input_folder, question, answer, confidence)
+                        review_out.write(json.dumps(json_data, ensure_ascii=False) + "\n")
+                        reviewed.add(img_filename)
+                    status = "review"
+
+                stats[status] += 1
+                state_out.write(json.dumps({"image": img_filename, "question": question,
+                                            "status": status, "confidence": confidence}) + "\n")
+
+            # Checkpoint: everything journaled so far survives a crash.
+            # Labels are made durable before the journal says they are done
+            if label_store is not None:
+                label_store.checkpoint()
+            review_out.flush()
+            os.fsync(review_out.fileno())
+            state_out.flush()
+            os.fsync(state_out.fileno())
+
+            done = min(batch_start + batch_size, len(pending))
+            elapsed = time.perf_counter() - start_time
+            print(f"[{done}/{len(pending)}] {done / max(elapsed, 1e-9):.2f} images/sec | "
+                  f"saved {stats['saved']}, review {stats['review']}, failed {stats['failed']}")
+
+    stats["seconds"] = time.perf_counter() - start_time
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-label a folder of images with Moondream, without the GUI")
+    parser.add_argument("--input", default=INPUT_FOLDER, help="folder with images to label")
+    parser.add_argument("--labels", default=OUTPUT_FOLDER_LABELS, help="folder for auto-saved JSON labels")
+    parser.add_argument("--images", default=OUTPUT_FOLDER_IMAGES, help="folder for auto-saved images")
+    parser.add_argument("--review", default=REVIEW_FILE, help="JSONL file for answers that need review")
+    parser.add_argument("--state", default=STATE_FILE, help="journal of finished images for resuming")
+    parser.add_argument("--question", default=QUESTION)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--threshold", type=float, default=AUTO_SAVE_CONFIDENCE_THRESHOLD)
+    parser.add_argument("--model", default=MODEL_ID)
+    parser.add_argument("--backend", choices=list(BACKENDS), default=BACKEND, help="inference backend")
+    parser.add_argument("--threads", type=int, default=THREADS, help="CPU threads for inference")
+    args = parser.parse_args(argv)
+
+    print(f"Loading model: {args.model} ({args.backend} backend)")
+    predictor = MoondreamPredictor.load(
+        args.backend,
+        args.model,
+        args.threads,
+        answer_cache=AnswerCache(ANSWER_CACHE_FILE),
+        encoding_cache=EncodingCache(ENCODING_CACHE_MB * 1024 * 1024)
+    )
+
+    label_store = DatasetStore(args.labels) if LABEL_FORMAT == "jsonl" else None
+    stats = run_batch(predictor, args.input, args.labels, args.images, args.review, args.state,
+                      args.question, args.batch_size, args.threshold, label_store)
+    if label_store is not None:
+        label_store.close()
+
+    print("-" * 50)
+    print("Complete!")
+    print(f"  • Auto-saved: {stats['saved']}")
+    print(f"  • Queued for review: {stats['review']}")
+    print(f"  • Failed (will be retried): {stats['failed']}")
+    print(f"  • Already done before this run: {stats['skipped']}")
+    print(f"  • Time: {stats['seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,500 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+# ============ PARAMETERS ============
+IMAGE_COUNT = 40  # Images in the synthetic corpus
+IMAGE_WIDTH = 4000  # Size of the synthetic camera frames
+IMAGE_HEIGHT = 3000
+CANVAS_SIZE = (1000, 750)  # Display canvas used for the headless display benchmark
+DWELL_MS = 200  # Time spent on each image before going to the next (lets the prefetcher work)
+STUB_BOXES = 6  # Detections the stub YOLO returns per image
+ENCODE_DELAY_MS = 40  # Stub Moondream vision encoder time per call
+ANSWER_DELAY_MS = 20  # Stub Moondream text decoder time per answer
+MOONDREAM_MODEL = "vikhyatk/moondream2"  # Model of the backend comparison (not downloaded for the stub backend)
+BACKEND_IMAGES = 8  # Images answered per backend in the backend comparison
+SERVER_CLIENTS = (1, 2, 4)  # Simulated annotators per annotation server run
+SERVER_LEASE_S = 2  # Lease time of the server runs, short so the abandoned lease expires quickly
+OUTPUT_FILE = "benchmark_results.json"
+# ====================================
+
+BENCHMARKS = ("display", "save", "crop", "moondream", "backends", "server")
+
+
+def make_corpus(folder, count, width, height, seed=0):
+    """Write count deterministic JPEG frames that look like smooth camera images"""
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    names = []
+    for i in range(count):
+        # Upscaled low-resolution noise plus some edges: compresses like a photo, not like noise
+        base = rng.integers(0, 255, (height // 100 + 1, width // 100 + 1, 3), dtype=np.uint8)
+        img = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+        for _ in range(8):
+            x, y = rng.integers(0, width), rng.integers(0, height)
+            cv2.rectangle(img, (int(x), int(y)), (int(x) + width // 10, int(y) + height // 10),
+                          tuple(int(c) for c in rng.integers(0, 255, 3)), thickness=20)
+        name = f"frame_{i:05d}.jpg"
+        cv2.imwrite(os.path.join(folder, name), img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        names.append(name)
+    return names
+
+
+def summarize(seconds):
+    """Latency statistics in milliseconds"""
+    samples = np.array(seconds) * 1000
+    if len(samples) == 0:
+        return {"count": 0}
+    return {
+        "count": int(len(samples)),
+        "mean_ms": round(float(samples.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "max_ms": round(float(samples.max()), 3)
+    }
+
+
+def tk_root():
+    """Return a hidden Tk root, or None when there is no display"""
+    try:
+        import tkinter as tk
+
+        root = tk.Tk()
+        root.withdraw()
+        return root
+    except Exception:
+        return None
+
+
+# ---------- Stub models ----------
+
+class StubTensor:
+    """Just enough of a torch tensor for Crop_prediction (.cpu().numpy())"""
+
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class StubResult:
+    def __init__(self, orig_img, boxes):
+        self.orig_img = orig_img
+        self.boxes = type("StubBoxes", (), {"data": StubTensor(boxes)})()
+
+
+class StubYOLO:
+    """Returns the same boxes for every image of the same size, spread over all confidence ranges"""
+
+    def __init__(self, box_count=STUB_BOXES):
+        self.box_count = box_count
+
+    def boxes_for(self, width, height):
+        boxes = np.zeros((self.box_count, 6), dtype=np.float32)
+        for i in range(self.box_count):
+            x1 = (i * width / (self.box_count + 1)) % (width - width // 8)
+            y1 = (i * height / (self.box_count + 1)) % (height - height // 8)
+            boxes[i, :4] = (x1, y1, x1 + width // 8, y1 + height // 8)
+        boxes[:, 4] = np.linspace(0.5, 0.99, self.box_count) if self.box_count else []
+        return boxes
+
+    def predict(self, source, conf=0.25, verbose=False, stream=False):
+        results = (StubResult(img, self.boxes_for(img.shape[1], img.shape[0])) for img in source)
+        return results if stream else list(results)
+
+
+# ---------- Benchmarks ----------
+
+def bench_display(folder, image_files, work_dir):
+    """Latency of getting the next frame on screen: cold decode, reduced decode and prefetched"""
+    from frame_pipeline import ImagePrefetcher, load_display_frame
+
+    paths = [os.path.join(folder, name) for name in image_files]
+    results = {}
+    results["cold_full_decode"] = summarize([timed(load_display_frame, path, CANVAS_SIZE, False) for path in paths])
+    results["cold_reduced_decode"] = summarize([timed(load_display_frame, path, CANVAS_SIZE, True) for path in paths])
+
+    # Navigate like a user: look at each image for DWELL_MS while the next ones are decoded
+    prefetcher = ImagePrefetcher(3, lookbehind=1, max_workers=2)
+    samples = []
+    for i, path in enumerate(paths):
+        samples.append(timed(prefetcher.get, path, CANVAS_SIZE))
+        prefetcher.schedule(folder, image_files, i, CANVAS_SIZE)
+        time.sleep(DWELL_MS / 1000)
+    prefetcher.shutdown()
+    results["prefetched"] = summarize(samples)
+
+    # The full load_current_image (Tk photo, canvas, status bar) when a display is available
+    root = tk_root()
+    results["tk"] = root is not None
+    if root is not None:
+        app = make_app(root, folder, os.path.join(work_dir, "display_app"), len(image_files))
+        samples = []
+        for i in range(len(image_files)):
+            app.current_index = i
+            start = time.perf_counter()
+            app.load_current_image()
+            root.update()
+            samples.append(time.perf_counter() - start)
+            time.sleep(DWELL_MS / 1000)
+        results["load_current_image"] = summarize(samples)
+        close_app(app)
+        root.destroy()
+    return results
+
+
+def make_app(root, folder, work_dir, expected_count):
+    """The annotation app with all of its state files inside work_dir"""
+    import main as annotation_app
+
+    annotation_app.STATE_DB_FILE = os.path.join(work_dir, "state.sqlite")
+    annotation_app.PHASH_INDEX_FILE = os.path.join(work_dir, "phash.npz")
+    annotation_app.WATCH_INTERVAL_S = 0
+    annotation_app.DUPLICATE_MAX_DISTANCE = 0
+    app = annotation_app.VLMAnnotationApp(root, folder, os.path.join(work_dir, "labels"),
+                                          os.path.join(work_dir, "images"), os.path.join(work_dir, "delete"), False)
+
+    # Let the folder scan finish, so every image is queued before timing starts
+    while app.scanner.scanning or len(app.image_files) < expected_count:
+        root.update()
+        time.sleep(0.01)
+    return app
+
+
+def close_app(app):
+    app.scanner.stop()
+    app.prefetcher.shutdown()
+    app.phash_executor.shutdown(wait=True)
+    if app.label_store is not None:
+        app.label_store.close()
+    app.annotation_state.close()
+
+
+def bench_save(folder, image_files, work_dir):
+    """Saves per second: the storage layer behind save_annotation, and the old per-file layout"""
+    from annotation_state import AnnotationState, SAVED
+    from dataset_store import DatasetStore
+    from image_store import ImageStore
+
+    def record(name, image_path):
+        return {"id": os.path.splitext(name)[0], "image": image_path,
+                "conversations": [{"from": "human", "value": "<image>\nWhat do you see in this image?"},
+                                  {"from": "gpt", "value": "I see the side view, the cow is standing upright."}]}
+
+    results = {}
+
+    # What save_annotation does with LABEL_FORMAT = "jsonl"
+    store = DatasetStore(os.path.join(work_dir, "save_jsonl", "labels"))
+    images = ImageStore(os.path.join(work_dir, "save_jsonl", "images"))
+    state = AnnotationState(os.path.join(work_dir, "save_jsonl", "state.sqlite"), folder)
+    state.add_images(image_files)
+    samples = []
+    for name in image_files:
+        start = time.perf_counter()
+        image_path = images.add(os.path.join(folder, name), name)
+        store.put(record(name, image_path))
+        store.flush()
+        state.set_status(name, SAVED)
+        samples.append(time.perf_counter() - start)
+    store.close()
+    state.close()
+    results["jsonl_store"] = dict(summarize(samples), saves_per_sec=round(len(samples) / max(sum(samples), 1e-9), 1),
+                                  image_store=images.stats())
+
+    # The original layout: one indented JSON file and a full image copy per save
+    labels = os.path.join(work_dir, "save_files", "labels")
+    copies = os.path.join(work_dir, "save_files", "images")
+    os.makedirs(labels, exist_ok=True)
+    os.makedirs(copies, exist_ok=True)
+    samples = []
+    for name in image_files:
+        start = time.perf_counter()
+        image_path = os.path.join(copies, name)
+        shutil.copy2(os.path.join(folder, name), image_path)
+        with open(os.path.join(labels, f"{os.path.splitext(name)[0]}.json"), 'w', encoding='utf-8') as f:
+            json.dump(record(name, image_path), f, indent=2, ensure_ascii=False)
+        samples.append(time.perf_counter() - start)
+    results["per_file_copy"] = dict(summarize(samples), saves_per_sec=round(len(samples) / max(sum(samples), 1e-9), 1))
+
+    # save_annotation itself, including loading the next image, when a display is available
+    root = tk_root()
+    if root is not None:
+        app = make_app(root, folder, os.path.join(work_dir, "save_app"), len(image_files))
+        app.current_index = 0
+        app.load_current_image()
+        samples = []
+        for _ in range(len(image_files) - 1):
+            # Loading the next image clears the selection, so pick a viewpoint before every save
+            app.select_viewpoint_by_key("1")
+            start = time.perf_counter()
+            app.save_annotation()
+            root.update()
+            samples.append(time.perf_counter() - start)
+        results["save_annotation"] = dict(summarize(samples),
+                                          saves_per_sec=round(len(samples) / max(sum(samples), 1e-9), 1))
+        close_app(app)
+        root.destroy()
+    return results
+
+
+def bench_crop(folder, work_dir):
+    """Crop_prediction.main throughput with a stub YOLO, writing folders of JPEGs and tar shards"""
+    import Crop_prediction
+    from crop_shards import iter_samples
+
+    results = {}
+    for output_format in ("folders", "tar"):
+        output_folder = os.path.join(work_dir, f"crop_{output_format}")
+        Crop_prediction.INPUT_FOLDER = folder
+        Crop_prediction.OUTPUT_FOLDER = output_folder
+        Crop_prediction.MANIFEST_PATH = os.path.join(output_folder, "manifest.sqlite")
+        Crop_prediction.STATS_FOLDER = os.path.join(output_folder, "stats")
+        Crop_prediction.TAR_FOLDER = os.path.join(output_folder, "shards")
+        Crop_prediction.OUTPUT_FORMAT = output_format
+        Crop_prediction.PRINT_EACH_CROP = False
+
+        # The per-image progress lines would drown the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = Crop_prediction.main(model=StubYOLO(STUB_BOXES))
+        seconds = max(stats["seconds"], 1e-9)
+        results[output_format] = {
+            "images": stats["images"],
+            "crops": stats["crop_counter"],
+            "seconds": round(stats["seconds"], 3),
+            "images_per_sec": round(stats["images"] / seconds, 2),
+            "crops_per_sec": round(stats["crop_counter"] / seconds, 2),
+            "failed_writes": stats["failed_writes"]
+        }
+
+    # Sequential read of everything that was written to the shards
+    start = time.perf_counter()
+    samples = sum(1 for _ in iter_samples(os.path.join(work_dir, "crop_tar", "shards")))
+    results["tar"]["read_samples_per_sec"] = round(samples / max(time.perf_counter() - start, 1e-9), 2)
+    return results
+
+
+def bench_moondream(folder, image_files, work_dir):
+    """Per-image answer latency with a stub Moondream: uncached, new question, repeated question, all questions, batched"""
+    from answer_cache import AnswerCache
+    from encoding_cache import EncodingCache
+    from moondream_backends import StubBackend
+    from moondream_model import MoondreamPredictor
+
+    paths = [os.path.join(folder, name) for name in image_files]
+    predictor = MoondreamPredictor(StubBackend(encode_delay_ms=ENCODE_DELAY_MS, answer_delay_ms=ANSWER_DELAY_MS),
+                                   answer_cache=AnswerCache(os.path.join(work_dir, "answers.sqlite")),
+                                   encoding_cache=EncodingCache(512 * 1024 * 1024))
+    results = {}
+    results["first_question"] = summarize(
+        [timed(predictor.generate_ai_description, path, "What do you see?") for path in paths])
+    results["second_question"] = summarize(
+        [timed(predictor.generate_ai_description, path, "Is the cow lying down?") for path in paths])
+    results["repeated_question"] = summarize(
+        [timed(predictor.generate_ai_description, path, "What do you see?") for path in paths])
+
+    # Four questions per image from one encoding, as in the app's multi-question mode
+    predictor = MoondreamPredictor(StubBackend(encode_delay_ms=ENCODE_DELAY_MS, answer_delay_ms=ANSWER_DELAY_MS))
+    questions = ("What do you see?", "Where is the cow?", "What is the posture of the animal?",
+                 "Is the cow standing or lying down?")
+    results["all_questions_4"] = summarize([timed(predictor.describe_questions, path, questions) for path in paths])
+
+    # Batched encoding as used by batch_label.py
+    predictor = MoondreamPredictor(StubBackend(encode_delay_ms=ENCODE_DELAY_MS, answer_delay_ms=ANSWER_DELAY_MS))
+    start = time.perf_counter()
+    for batch_start in range(0, len(paths), 8):
+        predictor.describe_batch(paths[batch_start:batch_start + 8], "What do you see?")
+    seconds = time.perf_counter() - start
+    results["batch_8_images_per_sec"] = round(len(paths) / max(seconds, 1e-9), 2)
+    return results
+
+
+def bench_backends(folder, image_files, backend_names):
+    """Model load and per-answer latency of each backend on the same encoder inputs and questions"""
+    from moondream_backends import create_backend
+    from moondream_model import load_encoder_input
+
+    # Decoding is not part of the comparison: every backend gets the same prepared inputs
+    images = [load_encoder_input(os.path.join(folder, name)) for name in image_files[:BACKEND_IMAGES]]
+    questions = ("What do you see?", "Is the cow standing or lying down?")
+
+    results = {}
+    reference = None
+    for name in backend_names:
+        backend = create_backend(name, MOONDREAM_MODEL)
+        try:
+            load_seconds = timed(backend.load)
+        except Exception as e:
+            # torch/transformers missing or the model cannot be downloaded
+            results[name] = {"error": str(e)}
+            continue
+
+        encode_samples, answer_samples, answers = [], [], []
+        for image in images:
+            start = time.perf_counter()
+            encoding = backend.encode_image(image)
+            encode_samples.append(time.perf_counter() - start)
+            for question in questions:
+                start = time.perf_counter()
+                answers.append(backend.answer_question(encoding, question).strip())
+                answer_samples.append(time.perf_counter() - start)
+
+        results[name] = {"load_seconds": round(load_seconds, 3), "encode": summarize(encode_samples),
+                         "answer": summarize(answer_samples)}
+        # How often a backend agrees with the first one, e.g. the int8 model with the float model
+        if reference is None:
+            reference = (name, answers)
+        else:
+            matching = sum(a == b for a, b in zip(answers, reference[1]))
+            results[name][f"same_answers_as_{reference[0]}"] = round(matching / max(len(answers), 1), 3)
+    return results
+
+
+def simulate_annotator(client, queue, finished):
+    """Save every leased image after DWELL_MS, until the server has no pending images left"""
+    from annotation_state import PENDING
+
+    client.start()
+    while True:
+        names = client.take_new()
+        for name in names:
+            time.sleep(DWELL_MS / 1000)
+            record = {"id": name, "image": name, "conversations": [
+                {"from": "human", "value": "<image>\nWhat do you see?"},
+                {"from": "gpt", "value": f"Annotated by {client.annotator}"}
+            ]}
+            client.save(name, record)
+            finished.append(name)
+        if not names:
+            if queue.status()["images"].get(PENDING, 0) == 0:
+                break
+            time.sleep(0.02)
+    client.stop()
+
+
+def bench_server(folder, image_files, work_dir):
+    """Annotation server throughput with several local annotator clients, plus one that abandons its lease"""
+    import threading
+    from annotation_server import AnnotationQueue, LeaseClient, make_server
+
+    results = {}
+    for clients in SERVER_CLIENTS:
+        run_dir = os.path.join(work_dir, f"server_{clients}")
+        queue = AnnotationQueue(folder, os.path.join(run_dir, "labels"), os.path.join(run_dir, "images"),
+                                os.path.join(run_dir, "state.sqlite"), SERVER_LEASE_S)
+        server = make_server(queue, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        # An annotator that leases a batch and disappears; its images must come back after the lease expires
+        while queue.scanner.scanning:
+            time.sleep(0.01)
+        abandoned = LeaseClient(url, "abandoned", os.path.join(run_dir, "abandoned"), batch_size=4)
+        abandoned_images = abandoned.request("/lease", {"annotator": "abandoned", "count": 4})["images"]
+
+        finished = []
+        threads = [threading.Thread(target=simulate_annotator, args=(
+            LeaseClient(url, f"annotator{i}", os.path.join(run_dir, f"client{i}"), batch_size=4, poll_interval=0.2),
+            queue, finished)) for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+        server.shutdown()
+        server.server_close()
+        status = queue.status()
+        records = len(queue.label_store)
+        queue.close()
+        results[f"clients_{clients}"] = {
+            "images": len(finished),
+            "seconds": round(seconds, 3),
+            "images_per_sec": round(len(finished) / max(seconds, 1e-9), 2),
+            "double_labeled": len(finished) - len(set(finished)),
+            "records": records,
+            "abandoned_recovered": all(name in finished for name in abandoned_images),
+            "expired": status["totals"]["expired"]
+        }
+    return results
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths on a synthetic corpus, CPU only")
+    parser.add_argument("--images", type=int, default=IMAGE_COUNT, help="number of synthetic images")
+    parser.add_argument("--width", type=int, default=IMAGE_WIDTH)
+    parser.add_argument("--height", type=int, default=IMAGE_HEIGHT)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS),
+                        help="benchmarks to run")
+    parser.add_argument("--backends", nargs="+", default=["stub"],
+                        help="Moondream backends to compare, e.g. stub hf cpu-int8 (hf and cpu-int8 download the model)")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="JSON file for the results")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic corpus and outputs")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="vlm_benchmark_")
+    folder = os.path.join(work_dir, "corpus")
+    print(f"Generating {args.images} images of {args.width}x{args.height} in {folder}")
+    image_files = make_corpus(folder, args.images, args.width, args.height)
+
+    results = {}
+    try:
+        for name in args.only:
+            print(f"Running {name} benchmark...")
+            start = time.perf_counter()
+            if name == "display":
+                results[name] = bench_display(folder, image_files, work_dir)
+            elif name == "save":
+                results[name] = bench_save(folder, image_files, work_dir)
+            elif name == "crop":
+                results[name] = bench_crop(folder, work_dir)
+            elif name == "moondream":
+                results[name] = bench_moondream(folder, image_files, work_dir)
+            elif name == "backends":
+                results[name] = bench_backends(folder, image_files, args.backends)
+            elif name == "server":
+                results[name] = bench_server(folder, image_files, work_dir)
+            print(f"  └─ done in {time.perf_counter() - start:.1f}s")
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {
+            "images": args.images, "width": args.width, "height": args.height, "canvas": list(CANVAS_SIZE),
+            "dwell_ms": DWELL_MS, "stub_boxes": STUB_BOXES,
+            "encode_delay_ms": ENCODE_DELAY_MS, "answer_delay_ms": ANSWER_DELAY_MS
+        },
+        "results": results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
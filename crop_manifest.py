@@ -0,0 +1,126 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+from crop_shards import add_tombstones
+
+
+def hash_model_file(model_path, chunk_size=1024 * 1024):
+    """Return the sha256 of the model weights, so a new model re-processes every image"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CropManifest:
+    """SQLite index of processed images and the crops they produced.
+
+    An image is up to date when its size, mtime and the model hash all match
+    the recorded values. Crop ids come from a counter stored in the manifest,
+    so crop names stay unique across runs.
+    """
+
+    def __init__(self, db_path):
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        # One process writes each manifest (shards get their own); a reader holding a lock is waited for
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                model_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                crop_count INTEGER NOT NULL,
+                processed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS crops (
+                crop_id INTEGER PRIMARY KEY,
+                image_path TEXT NOT NULL,
+                crop_path TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                confidence REAL NOT NULL,
+                class_id INTEGER NOT NULL,
+                x1 INTEGER NOT NULL,
+                y1 INTEGER NOT NULL,
+                x2 INTEGER NOT NULL,
+                y2 INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS crops_by_image ON crops (image_path);
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def processed_images(self, model_hash):
+        """Return {path: (size, mtime_ns)} of the images processed with this model"""
+        rows = self.conn.execute(
+            "SELECT path, size, mtime_ns FROM images WHERE model_hash = ?", (model_hash,)
+        )
+        return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def reserve_crop_ids(self, count):
+        """Reserve count consecutive crop ids and return the first one"""
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT value FROM counters WHERE name = 'next_crop_id'").fetchone()
+            first_id = row[0] if row else 0
+            self.conn.execute("INSERT OR REPLACE INTO counters VALUES ('next_crop_id', ?)", (first_id + count,))
+        return first_id
+
+    def record_images(self, records):
+        """Checkpoint finished images in one transaction.
+
+        Each record is a dict with path, size, mtime_ns, model_hash, status and
+        a list of crops (crop_id, crop_path, folder, confidence, class_id, x1, y1, x2, y2).
+        Crops left over from an earlier version of the image are deleted from disk;
+        tar samples ("<group folder>#<key>") are tombstoned, since tar members stay in place.
+        """
+        stale_paths = []
+        stale_samples = {}  # group folder -> keys
+        now = time.time()
+        with self.conn:
+            for record in records:
+                new_paths = {crop[1] for crop in record["crops"]}
+                for (crop_path,) in self.conn.execute(
+                        "SELECT crop_path FROM crops WHERE image_path = ?", (record["path"],)):
+                    if crop_path in new_paths:
+                        continue
+                    if "#" in crop_path:
+                        group_folder, key = crop_path.rsplit("#", 1)
+                        stale_samples.setdefault(group_folder, []).append(key)
+                    else:
+                        stale_paths.append(crop_path)
+
+                self.conn.execute("DELETE FROM crops WHERE image_path = ?", (record["path"],))
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO crops VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(crop[0], record["path"]) + tuple(crop[1:]) for crop in record["crops"]]
+                )
+                crop_count = sum(1 for crop in record["crops"] if crop[2] != "null")
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (record["path"], record["size"], record["mtime_ns"], record["model_hash"],
+                     record["status"], crop_count, now)
+                )
+
+            # Tombstones are written before the commit: after a crash the image is simply processed again
+            for group_folder, keys in stale_samples.items():
+                add_tombstones(group_folder, keys)
+
+        for crop_path in stale_paths:
+            try:
+                os.remove(crop_path)
+            except OSError:
+                pass
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,273 @@
+import argparse
+import glob
+import io
+import json
+import os
+import re
+import struct
+import tarfile
+import threading
+import time
+
+import numpy as np
+
+# One index record per sample: crop id, shard number, offset and size of the image data in the tar
+INDEX_RECORD = struct.Struct("<qIQI")
+INDEX_DTYPE = np.dtype([("crop_id", "<i8"), ("shard", "<u4"), ("offset", "<u8"), ("size", "<u4")])
+
+TAR_BLOCK = 512
+TOMBSTONE_FILE = "tombstones.txt"
+
+
+def sample_key(base_name, crop_id):
+    """WebDataset key of a sample; keys may not contain dots, the first dot starts the extension"""
+    return f"{base_name.replace('.', '_')}_crop_{crop_id}"
+
+
+class ShardSequence:
+    """Size-rotated tar shards of one group (e.g. a confidence range), plus their index.
+
+    Shards are named <prefix>-000000.tar, <prefix>-000001.tar, ...; a new
+    run starts a new shard instead of appending to one that may have been cut
+    short by a crash. index-<prefix>.bin gets one INDEX_RECORD per sample,
+    pointing at the image data, so a crop can be read without unpacking.
+    """
+
+    def __init__(self, folder, prefix, max_shard_bytes):
+        self.folder = folder
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        self.lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+        pattern = re.compile(re.escape(prefix) + r"-(\d+)\.tar$")
+        numbers = [int(m.group(1)) for m in map(pattern.match, os.listdir(self.folder)) if m]
+        self.shard_number = max(numbers) + 1 if numbers else 0
+        self.tar = None
+        self.index_file = open(os.path.join(self.folder, f"index-{prefix}.bin"), 'ab')
+        self.samples = 0
+
+    def shard_path(self, shard_number):
+        return os.path.join(self.folder, f"{self.prefix}-{shard_number:06d}.tar")
+
+    def add(self, crop_id, key, image_bytes, image_ext, metadata):
+        """Append one sample (image + JSON sidecar) and index its image"""
+        metadata_bytes = json.dumps(metadata, ensure_ascii=False).encode('utf-8')
+        with self.lock:
+            if self.tar is not None and self.tar.offset >= self.max_shard_bytes:
+                self.tar.close()
+                self.tar = None
+                self.shard_number += 1
+            if self.tar is None:
+                self.tar = tarfile.open(self.shard_path(self.shard_number), 'w')
+
+            now = int(time.time())
+            self._add_member(f"{key}.{image_ext}", image_bytes, now)
+            # The data of the member just written ends at the padded end of the archive
+            data_offset = self.tar.offset - (-(-len(image_bytes) // TAR_BLOCK) * TAR_BLOCK)
+            self._add_member(f"{key}.json", metadata_bytes, now)
+
+            self.index_file.write(INDEX_RECORD.pack(crop_id, self.shard_number, data_offset, len(image_bytes)))
+            self.samples += 1
+
+    def _add_member(self, name, data, mtime):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = mtime
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def flush(self):
+        """Push the written samples and their index records to the OS"""
+        with self.lock:
+            if self.tar is not None:
+                self.tar.fileobj.flush()
+            self.index_file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.tar is not None:
+                self.tar.close()
+                self.tar = None
+            self.index_file.close()
+
+
+class CropShardWriter:
+    """Streams crops into WebDataset-style tar shards, one shard sequence per group.
+
+    Safe to call from several writer threads; each group is written under
+    its own lock. Processes that write into the same folder need distinct
+    prefixes (e.g. one per input shard).
+    """
+
+    def __init__(self, folder, max_shard_bytes, prefix="crops"):
+        self.folder = folder
+        self.max_shard_bytes = max_shard_bytes
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.groups = {}  # group name -> ShardSequence
+
+    def group(self, name):
+        with self.lock:
+            sequence = self.groups.get(name)
+            if sequence is None:
+                sequence = self.groups[name] = ShardSequence(os.path.join(self.folder, name), self.prefix,
+                                                             self.max_shard_bytes)
+            return sequence
+
+    def add(self, group, crop_id, key, image_bytes, image_ext, metadata):
+        self.group(group).add(crop_id, key, image_bytes, image_ext, metadata)
+
+    def flush(self):
+        for sequence in list(self.groups.values()):
+            sequence.flush()
+
+    def close(self):
+        for sequence in list(self.groups.values()):
+            sequence.close()
+
+    def stats(self):
+        return "Shards: " + ", ".join(f"{name}: {sequence.samples} samples"
+                                      for name, sequence in sorted(self.groups.items()))
+
+
+def add_tombstones(group_folder, keys):
+    """Mark samples as removed; tar members cannot be deleted in place, so readers skip these keys"""
+    os.makedirs(group_folder, exist_ok=True)
+    with open(os.path.join(group_folder, TOMBSTONE_FILE), 'a', encoding='utf-8') as f:
+        f.writelines(key + "\n" for key in keys)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_tombstones(group_folder):
+    """Keys of the removed samples of a group folder"""
+    path = os.path.join(group_folder, TOMBSTONE_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def crop_id_of(key):
+    return int(key.rsplit("_", 1)[1])
+
+
+def shard_paths(folder, group=None):
+    """All tar shards in a shard folder (or one group of it), in write order per group"""
+    pattern = os.path.join(folder, group or "*", "*.tar")
+    return sorted(glob.glob(pattern))
+
+
+def iter_shard(path, buffer_size=4 * 1024 * 1024, removed=()):
+    """Yield (key, {extension: bytes}) for every sample of a tar shard, reading it front to back.
+
+    Samples whose key is in removed (see load_tombstones) are skipped.
+    """
+    with open(path, 'rb', buffering=buffer_size) as f:
+        # Stream mode never seeks, so the shard is read at sequential disk speed
+        with tarfile.open(fileobj=f, mode='r|') as tar:
+            key, sample = None, {}
+            try:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    member_key, _, extension = member.name.partition(".")
+                    if member_key != key and sample:
+                        yield key, sample
+                        sample = {}
+                    key = member_key
+                    if key not in removed:
+                        sample[extension] = tar.extractfile(member).read()
+            except (tarfile.ReadError, EOFError):
+                # The writer was interrupted in the middle of a sample
+                print(f"{path} is cut short, skipping its incomplete last sample")
+                return
+            if sample:
+                yield key, sample
+
+
+def iter_samples(folder, group=None):
+    """Yield (key, {extension: bytes}) for every current sample of every shard in the folder"""
+    tombstones = {}
+    for path in shard_paths(folder, group):
+        group_folder = os.path.dirname(path)
+        if group_folder not in tombstones:
+            tombstones[group_folder] = load_tombstones(group_folder)
+        yield from iter_shard(path, removed=tombstones[group_folder])
+
+
+class CropShardIndex:
+    """Random access to crops by id, through the index files of a shard folder"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.locations = {}  # crop_id -> (shard path, offset, size)
+        for index_path in glob.glob(os.path.join(folder, "*", "index-*.bin")):
+            group_folder = os.path.dirname(index_path)
+            prefix = os.path.basename(index_path)[len("index-"):-len(".bin")]
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            # A crash can leave a partial last record
+            usable = len(data) - len(data) % INDEX_DTYPE.itemsize
+            records = np.frombuffer(data[:usable], dtype=INDEX_DTYPE)
+            for crop_id, shard, offset, size in records.tolist():
+                shard_path = os.path.join(group_folder, f"{prefix}-{shard:06d}.tar")
+                self.locations[crop_id] = (shard_path, offset, size)
+
+        # Samples of images that were processed again are no longer part of the dataset
+        for group_folder in {os.path.dirname(path) for path, _, _ in self.locations.values()}:
+            for key in load_tombstones(group_folder):
+                self.locations.pop(crop_id_of(key), None)
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, crop_id):
+        return crop_id in self.locations
+
+    def get(self, crop_id):
+        """Return (image_bytes, metadata) of a crop, reading only that sample"""
+        shard_path, offset, size = self.locations[crop_id]
+        with open(shard_path, 'rb') as f:
+            f.seek(offset)
+            image_bytes = f.read(size)
+
+            # The JSON sidecar is the next member; tarfile starts reading at the current position
+            f.seek(offset + -(-size // TAR_BLOCK) * TAR_BLOCK)
+            with tarfile.open(fileobj=f, mode='r:') as tar:
+                metadata = json.loads(tar.extractfile(tar.next()).read())
+        return image_bytes, metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read crop shards written by Crop_prediction.py")
+    parser.add_argument("folder", help="shard folder, e.g. crop/shards")
+    parser.add_argument("--group", help="only read this confidence range (or 'null')")
+    parser.add_argument("--get", type=int, metavar="CROP_ID", help="extract one crop through the index")
+    parser.add_argument("--output", help="file to write the extracted crop to")
+    args = parser.parse_args()
+
+    if args.get is not None:
+        index = CropShardIndex(args.folder)
+        image_bytes, metadata = index.get(args.get)
+        print(json.dumps(metadata, indent=2))
+        if args.output:
+            with open(args.output, 'wb') as f:
+                f.write(image_bytes)
+            print(f"Crop written to {args.output}")
+        return
+
+    # Read every sample sequentially and report the throughput
+    start_time = time.perf_counter()
+    samples = 0
+    total_bytes = 0
+    for _, sample in iter_samples(args.folder, args.group):
+        samples += 1
+        total_bytes += sum(len(data) for data in sample.values())
+    seconds = max(time.perf_counter() - start_time, 1e-9)
+    print(f"{samples} samples, {total_bytes / 1e6:.1f} MB in {seconds:.2f}s "
+          f"({samples / seconds:.0f} samples/sec, {total_bytes / 1e6 / seconds:.0f} MB/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+SHARD_PREFIX = "shard-"
+INDEX_FILE = "index.json"
+LOCK_FILE = "store.lock"
+
+
+class StoreLockedError(RuntimeError):
+    """Another process has the store open"""
+
+
+def lock_file(f):
+    """Take an exclusive lock on an open file without waiting; raises OSError when it is held"""
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+class DatasetStore:
+    """Append-only store of annotation records in size-rotated JSONL shards.
+
+    Records use the generate_json_data schema and are keyed by their "id".
+    Writes go through a buffered file and are made durable in groups: a
+    checkpoint (flush + fsync) runs every commit_every
+    records or commit_interval seconds. Saving an id again appends a new
+    line and moves the offset index to it; readers only see the latest one.
+
+    The offset index is saved on close and on shard rotation, together with
+    how far each shard was indexed, so opening a store only parses the lines
+    written after the last snapshot.
+
+    Only one process may have a store open: opening a store that another
+    process holds raises StoreLockedError instead of interleaving appends.
+    """
+
+    def __init__(self, folder, max_shard_bytes=256 * 1024 * 1024, commit_every=64, commit_interval=5.0):
+        self.folder = folder
+        self.max_shard_bytes = max_shard_bytes
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.lock = threading.Lock()
+
+        self.index = {}  # id -> (shard number, offset, length)
+        self.indexed_sizes = {}  # shard number -> bytes covered by the index
+        self.readers = {}  # shard number -> open file for lookups
+        self.pending = 0
+        self.last_checkpoint = time.monotonic()
+
+        os.makedirs(self.folder, exist_ok=True)
+        self.lock_file = open(os.path.join(self.folder, LOCK_FILE), 'a+b')
+        try:
+            lock_file(self.lock_file)
+        except OSError:
+            self.lock_file.close()
+            raise StoreLockedError(f"{self.folder} is in use by another process (close it, or use another folder)")
+        self._load_index()
+
+        # Continue in the last shard, the writer always appends
+        self.shard = max(self.indexed_sizes, default=0)
+        self.writer = open(self._shard_path(self.shard), 'ab', buffering=1024 * 1024)
+        self.shard_bytes = self.writer.tell()
+
+    def _shard_path(self, shard):
+        return os.path.join(self.folder, f"{SHARD_PREFIX}{shard:05d}.jsonl")
+
+    def _shard_numbers(self):
+        shards = []
+        for name in os.listdir(self.folder):
+            if name.startswith(SHARD_PREFIX) and name.endswith(".jsonl"):
+                try:
+                    shards.append(int(name[len(SHARD_PREFIX):-len(".jsonl")]))
+                except ValueError:
+                    continue
+        return sorted(shards)
+
+    def _load_index(self):
+        index_path = os.path.join(self.folder, INDEX_FILE)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+                self.index = {record_id: tuple(entry) for record_id, entry in snapshot["records"].items()}
+                self.indexed_sizes = {int(shard): size for shard, size in snapshot["shards"].items()}
+            except (OSError, ValueError, KeyError):
+                print("Dataset index is unreadable, rebuilding it from the shards")
+                self.index = {}
+                self.indexed_sizes = {}
+
+        # Index whatever was appended after the last snapshot (or everything, without one)
+        for shard in self._shard_numbers():
+            self._index_tail(shard, self.indexed_sizes.get(shard, 0))
+
+    def _index_tail(self, shard, start):
+        path = self._shard_path(shard)
+        offset = start
+        with open(path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Only the last line can lack its newline
+                    break
+                try:
+                    record_id = json.loads(line)["id"]
+                    self.index[record_id] = (shard, offset, len(line))
+                except (ValueError, KeyError, TypeError):
+                    # A damaged complete line is left in place, the records after it are still valid
+                    print(f"Skipping unreadable record at byte {offset} of {path}")
+                offset += len(line)
+
+        # A crash can leave a half-written last line: cut it off so appends stay aligned
+        if offset < os.path.getsize(path):
+            print(f"Truncating incomplete records at the end of {path}")
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        self.indexed_sizes[shard] = offset
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, record_id):
+        return record_id in self.index
+
+    def put(self, record):
+        """Append a record, replacing any earlier record with the same id; returns the shard file name"""
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+        with self.lock:
+            # Rotate to a new shard when this one is full
+            if self.shard_bytes > 0 and self.shard_bytes + len(line) > self.max_shard_bytes:
+                self._checkpoint()
+                self._save_index()
+                self.writer.close()
+                self.shard += 1
+                self.writer = open(self._shard_path(self.shard), 'ab', buffering=1024 * 1024)
+                self.shard_bytes = 0
+
+            self.writer.write(line)
+            self.index[record["id"]] = (self.shard, self.shard_bytes, len(line))
+            self.shard_bytes += len(line)
+            self.indexed_sizes[self.shard] = self.shard_bytes
+            self.pending += 1
+
+            if (self.pending >= self.commit_every
+                    or time.monotonic() - self.last_checkpoint >= self.commit_interval):
+                self._checkpoint()
+            return os.path.basename(self._shard_path(self.shard))
+
+    def get(self, record_id):
+        """Return the latest record for an id, or None"""
+        with self.lock:
+            entry = self.index.get(record_id)
+            if entry is None:
+                return None
+            shard, offset, length = entry
+
+            # The record may still sit in the write buffer
+            if shard == self.shard:
+                self.writer.flush()
+
+            reader = self.readers.get(shard)
+            if reader is None:
+                reader = self.readers[shard] = open(self._shard_path(shard), 'rb')
+            reader.seek(offset)
+            data = reader.read(length)
+        return json.loads(data)
+
+    def iter_records(self):
+        """Yield the latest version of every record, in shard order"""
+        with self.lock:
+            self.writer.flush()
+            live = {(shard, offset) for shard, offset, _ in self.index.values()}
+            shards = sorted(self.indexed_sizes)
+
+        # Sequential reads; overwritten records are skipped
+        for shard in shards:
+            offset = 0
+            with open(self._shard_path(shard), 'rb') as f:
+                for line in f:
+                    if (shard, offset) in live:
+                        yield json.loads(line)
+                    offset += len(line)
+
+    def flush(self):
+        """Hand buffered records to the OS, so they survive the process but not a power loss"""
+        with self.lock:
+            self.writer.flush()
+
+    def checkpoint(self):
+        """Make every record written so far durable"""
+        with self.lock:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        self.writer.flush()
+        os.fsync(self.writer.fileno())
+        self.pending = 0
+        self.last_checkpoint = time.monotonic()
+
+    def _save_index(self):
+        snapshot = {
+            "shards": {str(shard): size for shard, size in self.indexed_sizes.items()},
+            "records": self.index
+        }
+        index_path = os.path.join(self.folder, INDEX_FILE)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, index_path)
+
+    def export_files(self, output_folder):
+        """Write every record as <id>.json, the layout used before the store existed"""
+        os.makedirs(output_folder, exist_ok=True)
+        count = 0
+        for record in self.iter_records():
+            with open(os.path.join(output_folder, f"{record['id']}.json"), 'w', encoding='utf-8') as f:
+                json.dump(record, f, indent=2, ensure_ascii=False)
+            count += 1
+        return count
+
+    def close(self):
+        with self.lock:
+            self._checkpoint()
+            self._save_index()
+            self.writer.close()
+            for reader in self.readers.values():
+                reader.close()
+            self.readers.clear()
+            self.lock_file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a JSONL dataset store to one JSON file per image")
+    parser.add_argument("store", help="folder containing the JSONL shards")
+    parser.add_argument("output", help="folder for the exported JSON files")
+    args = parser.parse_args(argv)
+
+    store = DatasetStore(args.store)
+    start_time = time.perf_counter()
+    count = store.export_files(args.output)
+    store.close()
+    print(f"Exported {count} records to {args.output} in {time.perf_counter() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Size assumed for encodings we cannot measure (roughly one Moondream2 image embedding)
+DEFAULT_ENCODING_BYTES = 8 * 1024 * 1024
+
+
+def encoding_nbytes(encoding):
+    """Estimate the memory held by an encoded image"""
+    if hasattr(encoding, "element_size") and hasattr(encoding, "nelement"):
+        return encoding.element_size() * encoding.nelement()
+    if hasattr(encoding, "nbytes"):
+        return int(encoding.nbytes)
+    return DEFAULT_ENCODING_BYTES
+
+
+class EncodingCache:
+    """Memoizes vision-encoder outputs so a new question only re-runs the text decoder.
+
+    Keeps a size-bounded LRU in memory. When spill_folder is set, tensor
+    encodings are also written as .npy files named after the image content
+    hash and the model revision, and memory-mapped back in on a memory miss,
+    so they survive evictions and restarts.
+    """
+
+    def __init__(self, max_bytes, spill_folder=None):
+        self.max_bytes = max_bytes
+        self.spill_folder = spill_folder
+        self.entries = OrderedDict()  # (content_hash, model_revision) -> (encoding, nbytes)
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.spill_folder:
+            os.makedirs(self.spill_folder, exist_ok=True)
+
+    def get(self, content_hash, model_revision, device=None):
+        """Return the cached encoding or None; spilled tensors are moved to device"""
+        key = (content_hash, model_revision)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        encoding = self._load_spilled(key, device)
+        with self.lock:
+            if encoding is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, encoding)
+        return encoding
+
+    def put(self, content_hash, model_revision, encoding):
+        """Store an encoding in memory and, when enabled, on disk"""
+        key = (content_hash, model_revision)
+        self._remember(key, encoding)
+        self._spill(key, encoding)
+
+    def _remember(self, key, encoding):
+        nbytes = encoding_nbytes(encoding)
+        if nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.current_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (encoding, nbytes)
+            self.current_bytes += nbytes
+
+            # Evict least recently used encodings over budget
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_bytes
+
+    def _spill_path(self, key):
+        content_hash, model_revision = key
+        safe_revision = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(model_revision))
+        return os.path.join(self.spill_folder, f"{content_hash}_{safe_revision}.npy")
+
+    def _spill(self, key, encoding):
+        # Only plain tensors can be stored; other encoding objects stay memory-only
+        if not self.spill_folder or not hasattr(encoding, "detach"):
+            return
+
+        path = self._spill_path(key)
+        if os.path.exists(path):
+            return
+
+        try:
+            array = encoding.detach().cpu().numpy()
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Could not spill encoding to disk: {e}")
+
+    def _load_spilled(self, key, device):
+        if not self.spill_folder:
+            return None
+
+        path = self._spill_path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            import torch
+
+            # Copy-on-write mapping: pages are read lazily and the array stays writable for torch
+            array = np.load(path, mmap_mode='c')
+            encoding = torch.from_numpy(array)
+            return encoding.to(device) if device is not None else encoding
+        except Exception as e:
+            print(f"Could not load spilled encoding: {e}")
+            return None
+
+    def stats(self):
+        """Summary of the hit/miss counters and memory use"""
+        return (f"Encoding cache: {self.hits} hits, {self.disk_hits} disk hits, {self.misses} misses, "
+                f"{len(self.entries)} in memory, {self.current_bytes / 1e6:.1f} MB")
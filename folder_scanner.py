@@ -0,0 +1,94 @@
+import os
+import threading
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class FolderScanner:
+    """Lists a folder on a background thread and keeps watching it for new images.
+
+    Names are handed out in the order os.scandir finds them, so the first
+    image can be shown long before a huge folder is fully listed. After the
+    first pass the folder is polled every watch_interval seconds; a rescan
+    only happens when the folder's mtime changed (which adding a file does).
+    Every pass that completes also leaves the full listing with the size and
+    mtime of each image for take_listing(), and becomes the set of names
+    already reported, so an image that is removed and added again is
+    reported again.
+    """
+
+    def __init__(self, folder, extensions=IMAGE_EXTENSIONS, watch_interval=5.0):
+        self.folder = folder
+        self.extensions = extensions
+        self.watch_interval = watch_interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.seen = set()
+        self.pending = []
+        self.listing = None  # name -> (size, mtime_ns) of the last complete pass, until taken
+        self.scanning = True
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def take_new(self):
+        """Return the names found since the last call"""
+        with self.lock:
+            new_files, self.pending = self.pending, []
+        return new_files
+
+    def take_listing(self):
+        """Return the listing of the last complete pass if it was not taken yet, else None"""
+        with self.lock:
+            listing, self.listing = self.listing, None
+        return listing
+
+    def _scan(self):
+        listing = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if self.stop_event.is_set():
+                    return
+                name = entry.name
+                if not name.lower().endswith(self.extensions):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                listing[name] = (stat.st_size, stat.st_mtime_ns)
+                if name in self.seen:
+                    continue
+                self.seen.add(name)
+                with self.lock:
+                    self.pending.append(name)
+
+        # Names missing from this pass are forgotten, so they are new again when they come back
+        self.seen = set(listing)
+        with self.lock:
+            self.listing = listing
+
+    def _run(self):
+        last_mtime = None
+        while not self.stop_event.is_set():
+            try:
+                mtime = os.stat(self.folder).st_mtime_ns
+                if mtime != last_mtime:
+                    self._scan()
+                    last_mtime = mtime
+                self.error = None
+            except OSError as e:
+                # Folder missing or share unreachable: report it and keep polling
+                self.error = e
+            self.scanning = False
+
+            if self.watch_interval <= 0:
+                return
+            self.stop_event.wait(self.watch_interval)
+
+    def stop(self):
+        self.stop_event.set()
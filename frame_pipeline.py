@@ -0,0 +1,375 @@
+import os
+import threading
+import cv2
+from PIL import Image, ImageTk
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import METRICS
+
+# Fraction of the canvas that a displayed image fills
+DISPLAY_FILL = 0.9
+
+# JPEG decode flags that let libjpeg scale down in the DCT domain, largest reduction first
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+
+def get_canvas_size(canvas):
+    """Return the canvas size, with a 600x600 fallback before the window is drawn"""
+    return canvas.winfo_width() or 600, canvas.winfo_height() or 600
+
+
+def fit_to_canvas(width, height, canvas_size):
+    """Calculate the scale and size of an image fitted centered on the canvas"""
+    canvas_width, canvas_height = canvas_size
+    scale = min(canvas_width / width, canvas_height / height) * DISPLAY_FILL
+    return scale, max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def scale_to_canvas(cv_img, canvas_size):
+    """Resize an RGB array so it fits the canvas"""
+    height, width = cv_img.shape[:2]
+    scale, new_width, new_height = fit_to_canvas(width, height, canvas_size)
+
+    if scale != 1.0:
+        with METRICS.timer("resize"):
+            cv_img = cv2.resize(cv_img, (new_width, new_height))
+    return cv_img
+
+
+def choose_decode_flag(img_path, canvas_size, min_size=0):
+    """Pick the cv2.imread flag that decodes just enough pixels to fill the canvas.
+
+    The longer side is also kept at least min_size pixels, so other users of
+    the decoded frame (e.g. the model input) get enough resolution; with
+    canvas_size=None only min_size counts. Only JPEGs can be decoded at reduced
+    size; other formats and images that are already small get a full decode.
+    """
+    try:
+        with Image.open(img_path) as img:
+            # Only reads the header, the pixel data is not decoded here
+            image_format = img.format
+            width, height = img.size
+    except Exception:
+        return cv2.IMREAD_COLOR
+
+    if image_format != "JPEG":
+        return cv2.IMREAD_COLOR
+
+    if canvas_size is None:
+        target_width = target_height = 0
+    else:
+        _, target_width, target_height = fit_to_canvas(width, height, canvas_size)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        # The reduced decoder rounds the size up
+        reduced_width, reduced_height = -(-width // factor), -(-height // factor)
+        if (reduced_width >= target_width and reduced_height >= target_height
+                and max(reduced_width, reduced_height) >= min_size):
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image(img_path, canvas_size=None, min_size=0):
+    """Decode an image to RGB, at reduced resolution when it only has to fill canvas_size.
+
+    Pass canvas_size=None to get the full resolution image (e.g. for 1:1 zoom).
+    Returns None if the image cannot be read.
+    """
+    flag = cv2.IMREAD_COLOR if canvas_size is None else choose_decode_flag(img_path, canvas_size, min_size)
+    return decode_with_flag(img_path, flag)
+
+
+def decode_with_flag(img_path, flag):
+    """Decode an image to RGB with a cv2.imread flag (EXIF orientation applied), None if unreadable"""
+    with METRICS.timer("decode"):
+        img = cv2.imread(img_path, flag)
+        if img is None:
+            return None
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+class DecodedFrame:
+    """One decoded image, shared by the display and the model.
+
+    Holds the RGB array and derives each resized variant from it once: the
+    display frame per canvas size and the model input per size, a PIL image
+    made with Image.frombuffer over the array instead of a copy. The pixels
+    are never modified, so a frame can be used from any thread. content_hash
+    is the hash of the file when the decoding thread computed one, and
+    decode_flag the cv2.imread flag the pixels were decoded with.
+    """
+
+    def __init__(self, img_path, rgb, content_hash=None, decode_flag=cv2.IMREAD_COLOR):
+        self.img_path = img_path
+        self.rgb = rgb
+        self.content_hash = content_hash
+        self.decode_flag = decode_flag
+        self.lock = threading.Lock()
+        self.display_frames = {}  # canvas_size -> RGB array scaled for the canvas
+        self.model_inputs = {}  # size -> PIL image that fits a size x size square
+
+    def display(self, canvas_size):
+        """The frame scaled to fit the canvas"""
+        with self.lock:
+            display_img = self.display_frames.get(canvas_size)
+        if display_img is None:
+            display_img = scale_to_canvas(self.rgb, canvas_size)
+            with self.lock:
+                self.display_frames[canvas_size] = display_img
+        return display_img
+
+    def model_input(self, size):
+        """The frame as a PIL image shrunk (LANCZOS) to fit size x size, like Image.thumbnail"""
+        with self.lock:
+            image = self.model_inputs.get(size)
+        if image is None:
+            height, width = self.rgb.shape[:2]
+            # A PIL view of the decoded pixels, without copying them
+            image = Image.frombuffer("RGB", (width, height), self.rgb, "raw", "RGB", 0, 1)
+            if width > size or height > size:
+                scale = size / max(width, height)
+                image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))),
+                                     Image.Resampling.LANCZOS)
+            with self.lock:
+                self.model_inputs[size] = image
+        return image
+
+    def encoder_input(self, size):
+        """model_input(size) if this frame was decoded like load_encoder_frame(size) decodes the file, else None"""
+        # A finer decode shrinks to slightly different pixels, which must not be cached under the same hash
+        if self.decode_flag != choose_decode_flag(self.img_path, None, size):
+            return None
+        return self.model_input(size)
+
+
+def load_frame(img_path, canvas_size, fast_decode=True, min_size=0, hash_file=None):
+    """Decode an image into a DecodedFrame with its display frame ready, returns None if unreadable"""
+    flag = choose_decode_flag(img_path, canvas_size, min_size) if fast_decode else cv2.IMREAD_COLOR
+    img = decode_with_flag(img_path, flag)
+    if img is None:
+        return None
+    content_hash = None
+    if hash_file is not None:
+        try:
+            content_hash = hash_file(img_path)
+        except OSError:
+            pass
+    frame = DecodedFrame(img_path, img, content_hash, flag)
+    frame.display(canvas_size)
+    return frame
+
+
+def load_encoder_frame(img_path, size):
+    """Decode an image for the model at the largest DCT reduction that keeps the longer side at least size"""
+    flag = choose_decode_flag(img_path, None, size)
+    img = decode_with_flag(img_path, flag)
+    if img is None:
+        return None
+    return DecodedFrame(img_path, img, decode_flag=flag)
+
+
+def load_display_frame(img_path, canvas_size, fast_decode=True):
+    """Decode an image to RGB and scale it for display, returns None if unreadable"""
+    frame = load_frame(img_path, canvas_size, fast_decode)
+    return None if frame is None else frame.display(canvas_size)
+
+
+class ImagePrefetcher:
+    """Decodes and pre-scales the images around the current one on a thread pool.
+
+    All methods are meant to be called from the Tk main thread, except
+    frame(), which lets other threads (the model) reuse the decoded frames.
+    Decodes keep the longer side at least min_size pixels for those users.
+    With hash_file, prefetched frames also carry the content hash of the file,
+    so the Tk thread can look up cached answers without reading it.
+    """
+
+    def __init__(self, lookahead, lookbehind=1, max_workers=2, fast_decode=True, min_size=0, hash_file=None):
+        self.lookahead = lookahead
+        self.lookbehind = lookbehind
+        self.fast_decode = fast_decode
+        self.min_size = min_size
+        self.hash_file = hash_file
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        # (img_path, canvas_size) -> Future resolving to the DecodedFrame
+        self.frames = {}
+
+    def schedule(self, folder, image_files, current_index, canvas_size):
+        """Prefetch the window around current_index and cancel everything outside it"""
+        window = [current_index]
+        window += [current_index + offset for offset in range(1, self.lookahead + 1)]
+        window += [current_index - offset for offset in range(1, self.lookbehind + 1)]
+        wanted = [(os.path.join(folder, image_files[i]), canvas_size)
+                  for i in window if 0 <= i < len(image_files)]
+
+        # Drop prefetches that are no longer needed after a jump or resize
+        for key in list(self.frames):
+            if key not in wanted:
+                self.frames.pop(key).cancel()
+
+        # Queue the missing ones, nearest upcoming image first
+        for key in wanted:
+            if key not in self.frames:
+                self.frames[key] = self.executor.submit(load_frame, *key, self.fast_decode, self.min_size,
+                                                        self.hash_file)
+
+    def get(self, img_path, canvas_size):
+        """Return the DecodedFrame, waiting on a running prefetch or decoding it directly"""
+        key = (img_path, canvas_size)
+        future = self.frames.get(key)
+
+        if future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception as e:
+                print(f"Error prefetching {img_path}: {e}")
+
+        # Not prefetched (first image, jump or resize): decode on this thread
+        frame = load_frame(img_path, canvas_size, self.fast_decode, self.min_size)
+        future = Future()
+        future.set_result(frame)
+        self.frames[key] = future
+        return frame
+
+    def frame(self, img_path):
+        """The DecodedFrame of an image in the prefetch window, or None; safe from any thread"""
+        # Copying the items is atomic, the Tk thread may change the dict meanwhile
+        for (path, _), future in list(self.frames.items()):
+            if path != img_path:
+                continue
+            try:
+                frame = future.result()
+            except Exception:
+                # Cancelled or failed to decode
+                continue
+            if frame is not None:
+                return frame
+        return None
+
+    def content_hash(self, img_path):
+        """Content hash from a finished prefetch of an image, or None; never waits"""
+        for (path, _), future in list(self.frames.items()):
+            if path != img_path or not future.done() or future.cancelled() or future.exception() is not None:
+                continue
+            frame = future.result()
+            if frame is not None and frame.content_hash is not None:
+                return frame.content_hash
+        return None
+
+    def cancel_all(self):
+        """Cancel all pending prefetches and forget the prepared frames"""
+        for future in self.frames.values():
+            future.cancel()
+        self.frames.clear()
+
+    def shutdown(self):
+        """Stop the worker threads without waiting for queued prefetches"""
+        self.cancel_all()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class FrameCache:
+    """LRU cache of display-ready frames with a memory budget.
+
+    Entries are keyed by image path, file mtime and canvas size, so an edited
+    file or a resized canvas never returns a stale frame. Each entry holds the
+    Tk image together with the scaled RGB array it was made from.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (tk_img, display_img, nbytes)
+        self.current_bytes = 0
+        self.canvas_size = None
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, img_path, canvas_size):
+        """Build the cache key for an image, returns None if the file is gone"""
+        try:
+            mtime = os.stat(img_path).st_mtime_ns
+        except OSError:
+            return None
+
+        # Frames scaled for another canvas size can never hit again
+        if canvas_size != self.canvas_size:
+            self.clear()
+            self.canvas_size = canvas_size
+
+        return (img_path, mtime, canvas_size)
+
+    def get(self, key):
+        """Return (tk_img, display_img) for the key or None, updating the counters"""
+        entry = self.entries.get(key) if key is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def put(self, key, tk_img, display_img):
+        """Store a frame and evict the least recently used ones over budget"""
+        if key is None:
+            return
+
+        # Drop older versions of the same file (it was modified since)
+        for old_key in [k for k in self.entries if k[0] == key[0] and k != key]:
+            self._remove(old_key)
+        if key in self.entries:
+            self._remove(key)
+
+        # Tk keeps 4 bytes per pixel, plus the RGB array we hold on to
+        height, width = display_img.shape[:2]
+        nbytes = width * height * 4 + display_img.nbytes
+        if nbytes > self.max_bytes:
+            return
+
+        self.entries[key] = (tk_img, display_img, nbytes)
+        self.current_bytes += nbytes
+        while self.current_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        _, _, nbytes = self.entries.pop(key)
+        self.current_bytes -= nbytes
+
+    def clear(self):
+        """Remove all frames"""
+        self.entries.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        """Summary of the hit/miss counters and memory use"""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return (f"Frame cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%}), "
+                f"{len(self.entries)} frames, {self.current_bytes / 1e6:.1f} MB")
+
+
+def get_display_photo(img_path, canvas_size, frame_cache, prefetcher):
+    """Return (tk_img, display_img) for an image, from the cache, a prefetch or a fresh decode.
+
+    Must be called from the Tk main thread. Both values are None when the
+    image cannot be read.
+    """
+    cache_key = frame_cache.key_for(img_path, canvas_size)
+    cached = frame_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Take the prefetched frame (already decoded and scaled) or decode it now
+    frame = prefetcher.get(img_path, canvas_size)
+    if frame is None:
+        return None, None
+    display_img = frame.display(canvas_size)
+
+    with METRICS.timer("photoimage"):
+        tk_img = ImageTk.PhotoImage(Image.fromarray(display_img))
+    frame_cache.put(cache_key, tk_img, display_img)
+    return tk_img, display_img
@@ -0,0 +1,101 @@
+import errno
+import os
+import shutil
+
+from answer_cache import hash_file_contents
+from metrics import METRICS
+
+# ioctl number of FICLONE on Linux (copy-on-write clone on Btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+def reflink(source_path, dest_path):
+    """Clone a file without copying its data; raises OSError where unsupported"""
+    import fcntl
+
+    with open(source_path, 'rb') as src, open(dest_path, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def link_or_copy(source_path, dest_path):
+    """Materialize source_path at dest_path as cheaply as the filesystem allows.
+
+    Tries a hardlink, then a reflink, then falls back to a full copy. The file
+    appears at dest_path atomically (replacing any existing one). Returns the
+    method used: "link", "reflink" or "copy", or "existing" when dest_path
+    already is a hardlink of source_path.
+    """
+    with METRICS.timer("image_copy"):
+        # Renaming a link over another link of the same file is a no-op that would leave the .tmp behind
+        if os.path.exists(dest_path) and os.path.samefile(source_path, dest_path):
+            return "existing"
+
+        tmp_path = dest_path + ".tmp"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+        method = "link"
+        try:
+            os.link(source_path, tmp_path)
+        except (OSError, AttributeError, NotImplementedError):
+            method = "reflink"
+            try:
+                reflink(source_path, tmp_path)
+                shutil.copystat(source_path, tmp_path)
+            except (OSError, ImportError):
+                method = "copy"
+                shutil.copy2(source_path, tmp_path)
+
+        os.replace(tmp_path, dest_path)
+        return method
+
+
+def move_file(source_path, dest_path):
+    """Move a file with a single rename, copying only across filesystems"""
+    with METRICS.timer("image_move"):
+        try:
+            os.replace(source_path, dest_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            shutil.move(source_path, dest_path)
+
+
+class ImageStore:
+    """Folder of annotated images, filled with hardlinks/reflinks instead of copies.
+
+    With content_addressed=True images are stored as <sha256><ext> blobs
+    (in subfolders named after the first two hex digits), so identical
+    frames are stored once no matter what they are called.
+    """
+
+    def __init__(self, folder, content_addressed=False, hash_file=hash_file_contents):
+        self.folder = folder
+        self.content_addressed = content_addressed
+        self.hash_file = hash_file
+        self.counts = {"link": 0, "reflink": 0, "copy": 0, "existing": 0}
+        os.makedirs(self.folder, exist_ok=True)
+
+    def path_for(self, source_path, img_filename):
+        """Path inside the store for an image"""
+        if not self.content_addressed:
+            return os.path.join(self.folder, img_filename)
+        content_hash = self.hash_file(source_path)
+        extension = os.path.splitext(img_filename)[1].lower()
+        return os.path.join(self.folder, content_hash[:2], f"{content_hash}{extension}")
+
+    def add(self, source_path, img_filename):
+        """Put an image in the store and return its path there"""
+        dest_path = self.path_for(source_path, img_filename)
+        if self.content_addressed:
+            if os.path.exists(dest_path):
+                # Same content is already stored
+                self.counts["existing"] += 1
+                return dest_path
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+
+        self.counts[link_or_copy(source_path, dest_path)] += 1
+        return dest_path
+
+    def stats(self):
+        return "Image store: " + ", ".join(f"{count} {method}" for method, count in self.counts.items())
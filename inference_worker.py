@@ -0,0 +1,174 @@
+import itertools
+import queue
+import threading
+import time
+
+
+class InferenceRequest:
+    """One question about one image, queued for the inference worker"""
+
+    def __init__(self, request_id, image_path, question, on_done=None, on_progress=None, speculative=False):
+        self.request_id = request_id
+        self.image_path = image_path
+        self.question = question
+        self.on_done = on_done
+        self.on_progress = on_progress
+        # Speculative requests only warm the answer cache and run when nothing else is queued
+        self.speculative = speculative
+        # queued -> running -> done, or cancelled at any point
+        self.status = "queued"
+        self.cancelled = False
+        self.submitted_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+        self.answer = None
+        self.confidence = 0.0
+
+    def elapsed(self):
+        """Seconds since the request started running (or was queued)"""
+        start = self.started_at or self.submitted_at
+        end = self.finished_at or time.perf_counter()
+        return end - start
+
+
+class InferenceWorker:
+    """Runs model inference on a dedicated thread and hands results back to the Tk thread.
+
+    run_inference(image_path, question) is called on the worker thread and
+    must return (answer, confidence). Results and progress updates are
+    delivered on the Tk thread through a root.after polling loop, and only
+    for requests that were not cancelled in the meantime. Foreground requests
+    always run before speculative ones.
+    """
+
+    def __init__(self, root, run_inference, poll_interval_ms=100):
+        self.root = root
+        self.run_inference = run_inference
+        self.poll_interval_ms = poll_interval_ms
+        self.pending = []  # Requests waiting for the worker, guarded by self.condition
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.results = queue.Queue()
+        self.active = []  # Requests submitted and not yet delivered
+        self.request_ids = itertools.count(1)
+        self.poll_job = None
+        self.thread = threading.Thread(target=self._run, name="inference", daemon=True)
+        self.thread.start()
+
+    def submit(self, image_path, question, on_done=None, on_progress=None, supersede=True, speculative=False):
+        """Queue a request; with supersede=True earlier foreground requests are cancelled"""
+        if supersede and not speculative:
+            self.cancel_foreground()
+
+        with self.condition:
+            # Reuse a speculative request for the same image and question instead of running it twice
+            for request in self.active:
+                if (request.speculative and not request.cancelled
+                        and (request.image_path, request.question) == (image_path, question)):
+                    if not speculative:
+                        request.speculative = False
+                        request.on_done = on_done
+                        request.on_progress = on_progress
+                        self._start_polling()
+                    return request
+
+            request = InferenceRequest(next(self.request_ids), image_path, question,
+                                       on_done, on_progress, speculative)
+            self.active.append(request)
+            self.pending.append(request)
+            self.condition.notify()
+
+        self._start_polling()
+        return request
+
+    def cancel_foreground(self):
+        """Cancel the queued or running foreground requests, their results will be dropped"""
+        self._cancel([r for r in self.active if not r.speculative])
+
+    def cancel_speculative(self, keep=()):
+        """Cancel speculative requests except those whose (image_path, question) is in keep"""
+        self._cancel([r for r in self.active
+                      if r.speculative and (r.image_path, r.question) not in keep])
+
+    def cancel_all(self):
+        """Cancel every queued or running request"""
+        self._cancel(list(self.active))
+
+    def _cancel(self, requests):
+        with self.condition:
+            for request in requests:
+                request.cancelled = True
+                request.status = "cancelled"
+                self.active.remove(request)
+                if request in self.pending:
+                    self.pending.remove(request)
+
+    def speculative_keys(self):
+        """The (image_path, question) pairs of the speculative requests still outstanding"""
+        return {(r.image_path, r.question) for r in self.active if r.speculative}
+
+    def stop(self):
+        """Cancel outstanding work and let the worker thread exit"""
+        self.cancel_all()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.poll_job is not None:
+            self.root.after_cancel(self.poll_job)
+            self.poll_job = None
+
+    def _next_request(self):
+        with self.condition:
+            while not self.stopped:
+                if self.pending:
+                    foreground = [r for r in self.pending if not r.speculative]
+                    request = (foreground or self.pending)[0]
+                    self.pending.remove(request)
+                    request.status = "running"
+                    request.started_at = time.perf_counter()
+                    return request
+                self.condition.wait()
+            return None
+
+    def _run(self):
+        while True:
+            request = self._next_request()
+            if request is None:
+                break
+
+            try:
+                request.answer, request.confidence = self.run_inference(request.image_path, request.question)
+            except Exception as e:
+                print(f"Error in inference request {request.request_id}: {e}")
+                request.answer, request.confidence = f"Error: {str(e)}", 0.0
+            request.finished_at = time.perf_counter()
+            self.results.put(request)
+
+    def _start_polling(self):
+        if self.poll_job is None:
+            self.poll_job = self.root.after(self.poll_interval_ms, self._poll)
+
+    def _poll(self):
+        self.poll_job = None
+
+        # Deliver finished requests, dropping the ones cancelled while running
+        while True:
+            try:
+                request = self.results.get_nowait()
+            except queue.Empty:
+                break
+            with self.condition:
+                if request.cancelled or request not in self.active:
+                    continue
+                self.active.remove(request)
+            request.status = "done"
+            if request.on_done is not None:
+                request.on_done(request)
+
+        # Let the UI show how long the remaining requests have been waiting
+        for request in list(self.active):
+            if request.on_progress is not None:
+                request.on_progress(request)
+
+        if self.active:
+            self._start_polling()
@@ -1,13 +1,19 @@
 import os
-import sys
-import cv2
-import numpy as np
+import time
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox, scrolledtext
+from tkinter import ttk, messagebox, scrolledtext
 from PIL import Image, ImageTk
-import shutil
-from pathlib import Path
 import json
+from dataset_store import DatasetStore
+from image_store import ImageStore, move_file
+from concurrent.futures import ThreadPoolExecutor
+from annotation_state import AnnotationState, SAVED, SKIPPED
+from folder_scanner import FolderScanner
+from phash_index import PerceptualHashIndex
+from metrics import METRICS
+from frame_pipeline import FrameCache, ImagePrefetcher, get_canvas_size, get_display_photo, scale_to_canvas
+from tile_viewer import TiledImageViewer
+from annotation_server import LeaseClient
 
 # Configuration - adjust these paths to match your project structure
 input_folder = "annotate"  # Folder containing images to be annotated
@@ -15,6 +21,26 @@ output_folder_labels = "annotated_labels"  # Folder for JSON files
 output_folder_images = "annotated_images"  # Folder for annotated images
 delete_folder = "Delete"  # Folder for storing deleted/transferred images
 enable_delete_mode = True  # Set to either False or True to enable image deletion functionality from start-up
+PREFETCH_DEPTH = 3  # Number of upcoming images decoded in the background (0 disables look-ahead)
+PREFETCH_WORKERS = 2  # Number of threads used for background decoding
+FRAME_CACHE_MB = 256  # Memory budget for display-ready frames kept for going back and forth
+FAST_PREVIEW_DECODE = True  # Decode JPEGs at reduced resolution when the canvas is smaller than the image
+LABEL_FORMAT = "jsonl"  # "jsonl" appends records to shards in the labels folder, "files" writes one JSON per image
+CONTENT_ADDRESSED_IMAGES = False  # Name annotated images by content hash, so duplicate frames are stored once
+WATCH_INTERVAL_S = 5  # Seconds between checks of the input folder for new images (0 disables watching)
+DUPLICATE_MAX_DISTANCE = 6  # Frames whose 64-bit perceptual hashes differ in at most this many bits are near-duplicates (0 disables)
+PHASH_INDEX_FILE = "cache/phash_index.npz"  # Perceptual hashes of the input images, kept between runs
+STATE_DB_FILE = "cache/annotation_state.sqlite"  # Saved/skipped/pending status per image, used to resume
+SHOW_LATENCY_OVERLAY = False  # Show per-stage timings (last and p95) in the status bar
+METRICS_CSV_FILE = None  # CSV log of per-stage timings, e.g. "cache/metrics.csv" (None disables)
+METRICS_PROM_FILE = None  # Prometheus textfile-collector output, e.g. "/var/lib/node_exporter/textfile_collector/vlm.prom"
+ZOOM_TILE_CACHE_MB = 64  # Memory budget for rendered tiles while zoomed in
+ZOOM_LEVEL_CACHE_MB = 256  # Memory budget for decoded zoom levels; larger levels are memory-mapped from disk
+ZOOM_SPILL_FOLDER = "cache/zoom"  # Scratch folder for those memory-mapped levels
+SERVER_URL = None  # Annotate images leased from annotation_server.py, e.g. "http://127.0.0.1:8765" (None uses input_folder)
+ANNOTATOR_NAME = None  # Name this annotator is known by on the server (None uses user@host)
+LEASE_BATCH = 8  # Images leased per request; the next batch is downloaded while this one is annotated
+LEASE_CACHE_FOLDER = "cache/leased"  # Where leased images are downloaded to
 
 # Predefined text blocks configuration
 PREDEFINED_QUESTIONS = [
@@ -54,15 +80,50 @@ class VLMAnnotationApp:
         self.delete_folder = delete_folder
         self.delete_mode_enabled = enable_delete_mode
         
+        # Server mode: leased images are downloaded to a local folder, saves go to the server
+        self.lease_client = None
+        if SERVER_URL:
+            self.lease_client = LeaseClient(SERVER_URL, ANNOTATOR_NAME, LEASE_CACHE_FOLDER, LEASE_BATCH)
+            self.input_folder = self.lease_client.cache_folder
+            self.delete_mode_enabled = False
+        
+        # Saves and skips in flight to the server, sent one at a time in order
+        self.server_executor = ThreadPoolExecutor(max_workers=1)
+        self.in_flight = set()
+        
         # Create output folders if they don't exist
         os.makedirs(self.output_folder_labels, exist_ok=True)
         os.makedirs(self.output_folder_images, exist_ok=True)
         os.makedirs(self.delete_folder, exist_ok=True)
         
-        # Get all images
-        self.image_files = [f for f in os.listdir(self.input_folder) 
-                            if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-        self.current_index = 0
+        # Annotations go to JSONL shards; export_files recreates the per-image layout
+        # (in server mode the server owns the store)
+        use_store = LABEL_FORMAT == "jsonl" and self.lease_client is None
+        self.label_store = DatasetStore(self.output_folder_labels) if use_store else None
+        self.image_store = ImageStore(self.output_folder_images, CONTENT_ADDRESSED_IMAGES)
+        
+        # Per-stage timings for the latency overlay and the metrics export
+        METRICS.configure(METRICS_CSV_FILE, METRICS_PROM_FILE, app="annotation_app")
+        
+        # Progress is kept per image, so the queue and the resume position are known before any scanning
+        self.annotation_state = AnnotationState(STATE_DB_FILE, self.input_folder)
+        self.image_files = []
+        self.image_index = {}  # filename -> position in image_files
+        if self.lease_client is None:
+            self.add_to_queue(self.annotation_state.queue())
+        self.current_index = self.image_index.get(self.annotation_state.first_pending(), 0)
+        self.current_status = None
+        
+        # Images are listed in the background and new ones appended as they are found (or leased)
+        self.scanner = self.lease_client or FolderScanner(self.input_folder, ('.png', '.jpg', '.jpeg'), WATCH_INTERVAL_S)
+        
+        # Perceptual hashes for grouping near-duplicate frames, computed in the background as images are found;
+        # leased images are not grouped, their near-duplicates may be leased to someone else
+        use_phash = DUPLICATE_MAX_DISTANCE > 0 and self.lease_client is None
+        self.phash_index = PerceptualHashIndex(PHASH_INDEX_FILE) if use_phash else None
+        self.phash_executor = ThreadPoolExecutor(max_workers=1)
+        self.current_duplicates = []
+        self.propagated = set()  # Images annotated through a near-duplicate
         
         # Variables for annotation
         self.current_question = PREDEFINED_QUESTIONS[0]
@@ -71,13 +132,86 @@ class VLMAnnotationApp:
         self.current_img = None
         self.current_image_info = {}
         
+        # Background decoding of the images around the current one
+        self.prefetcher = ImagePrefetcher(PREFETCH_DEPTH, lookbehind=1, max_workers=PREFETCH_WORKERS,
+                                          fast_decode=FAST_PREVIEW_DECODE)
+        self.frame_cache = FrameCache(FRAME_CACHE_MB * 1024 * 1024)
+        
         # UI setup
         self.setup_ui()
         
-        # Load the first image
+        # Resume at the first pending image of the previous session straight away
         if self.image_files:
-            self.root.update_idletasks()
             self.root.after(100, self.load_current_image)
+        
+        # Start listing the input folder, the first image is shown as soon as it is found
+        self.scanner.start()
+        self.root.after(100, self.poll_scanner)
+    
+    def update_metrics(self):
+        """Refresh the latency overlay and export the metrics, once per second"""
+        if SHOW_LATENCY_OVERLAY:
+            stages = ("load_image", "decode", "resize", "photoimage", "json_write", "image_copy", "image_move",
+                      "tile_render")
+            self.latency_label.config(text=METRICS.overlay_text(stages))
+        METRICS.export()
+        self.root.after(1000, self.update_metrics)
+    
+    def add_to_queue(self, names):
+        """Append the images that are not queued yet and return them"""
+        new_names = [name for name in names if name not in self.image_index]
+        for name in new_names:
+            self.image_index[name] = len(self.image_files)
+            self.image_files.append(name)
+        return new_names
+    
+    def drop_from_queue(self, names):
+        """Forget images that left the input folder, except the one on screen"""
+        if not self.image_files:
+            return
+        current = self.image_files[self.current_index]
+        gone = set(names) - {current}
+        if not gone:
+            return
+        if self.phash_index is not None:
+            self.phash_index.remove_files(self.input_folder, gone)
+        self.image_files = [name for name in self.image_files if name not in gone]
+        self.image_index = {name: i for i, name in enumerate(self.image_files)}
+        self.current_index = self.image_index[current]
+    
+    def poll_scanner(self):
+        """Append images found by the scanner and show the first one immediately"""
+        found_files = self.scanner.take_new()
+        if found_files and self.phash_index is not None:
+            self.phash_executor.submit(self.phash_index.add_files, self.input_folder, found_files)
+        
+        # A complete listing takes deleted images out of the queue and resets the ones that were replaced
+        listing = self.scanner.take_listing()
+        if listing is not None:
+            self.drop_from_queue(self.annotation_state.sync(listing))
+        
+        was_empty = not self.image_files
+        new_files = self.add_to_queue(found_files)
+        if new_files:
+            self.annotation_state.add_images(new_files)
+            if was_empty:
+                self.root.update_idletasks()
+                self.load_current_image()
+            else:
+                self.status_label.config(text=self.get_status_text())
+        elif not self.image_files:
+            if self.scanner.error is not None:
+                source = "annotation server" if self.lease_client is not None else "input folder"
+                self.status_label.config(text=f"Could not read {source}: {self.scanner.error}")
+            elif self.scanner.scanning:
+                self.status_label.config(text="Scanning input folder...")
+            else:
+                self.status_label.config(text="No images found!")
+        elif not self.scanner.scanning and self.status_label.cget("text").endswith("(scanning...)"):
+            # The listing just finished: drop the scanning note
+            self.status_label.config(text=self.get_status_text())
+        
+        self.root.after(250, self.poll_scanner)
     
     def setup_ui(self):
         # Main container
@@ -91,6 +225,10 @@ class VLMAnnotationApp:
         self.image_canvas = tk.Canvas(image_frame, highlightthickness=0, bg='white')
         self.image_canvas.pack(fill=tk.BOTH, expand=True)
         
+        # Mouse-wheel zoom and drag to pan, drawing only the visible tiles
+        self.viewer = TiledImageViewer(self.image_canvas, self.draw_fit_frame, ZOOM_TILE_CACHE_MB * 1024 * 1024,
+                                       ZOOM_LEVEL_CACHE_MB * 1024 * 1024, ZOOM_SPILL_FOLDER)
+        
         # Right side: Annotation panel
         annotation_frame = ttk.LabelFrame(main_frame, text="Annotation")
         annotation_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(10, 0))
@@ -154,6 +292,11 @@ class VLMAnnotationApp:
         )
         self.delete_mode_checkbox.pack(pady=5)
         
+        # Save the same annotation for all near-duplicates of the current frame
+        self.propagate_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(button_frame, text="Apply to near-duplicates", 
+                       variable=self.propagate_var).pack(pady=(0, 5))
+        
         # Navigation buttons
         nav_frame = ttk.Frame(button_frame)
         nav_frame.pack(fill=tk.X)
@@ -163,6 +306,13 @@ class VLMAnnotationApp:
         ttk.Button(nav_frame, text="Save (S)", command=self.save_annotation).pack(side=tk.LEFT, padx=2)
         ttk.Button(nav_frame, text="Skip (O)", command=self.skip_current).pack(side=tk.LEFT, padx=2)
         
+        # Queue buttons, answered from the annotation state index
+        queue_frame = ttk.Frame(button_frame)
+        queue_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        ttk.Button(queue_frame, text="Next unlabeled (N)", command=self.jump_to_next_pending).pack(side=tk.LEFT, padx=2)
+        ttk.Button(queue_frame, text="Skipped images (K)", command=self.show_skipped).pack(side=tk.LEFT, padx=2)
+        
         # Status bar
         self.status_frame = ttk.Frame(self.root)
         self.status_frame.pack(fill=tk.X, side=tk.BOTTOM)
@@ -170,6 +320,12 @@ class VLMAnnotationApp:
         self.status_label = ttk.Label(self.status_frame, text="")
         self.status_label.pack(side=tk.LEFT, padx=10, pady=5)
         
+        # Optional latency overlay, refreshed together with the metrics export
+        self.latency_label = ttk.Label(self.status_frame, text="", foreground="gray")
+        if SHOW_LATENCY_OVERLAY:
+            self.latency_label.pack(side=tk.RIGHT, padx=10, pady=5)
+        self.root.after(1000, self.update_metrics)
+        
         # Keyboard shortcuts
         self.setup_keyboard_shortcuts()
         
@@ -192,6 +348,12 @@ class VLMAnnotationApp:
         self.root.bind("<o>", lambda event: self.skip_current())
         self.root.bind("<O>", lambda event: self.skip_current())
         
+        self.root.bind("<n>", lambda event: self.jump_to_next_pending())
+        self.root.bind("<N>", lambda event: self.jump_to_next_pending())
+        
+        self.root.bind("<k>", lambda event: self.show_skipped())
+        self.root.bind("<K>", lambda event: self.show_skipped())
+        
         # Viewpoint selection
         for key in PREDEFINED_VIEWPOINTS.keys():
             self.root.bind(f"<{key}>", lambda event, k=key: self.select_viewpoint_by_key(k))
@@ -217,26 +379,51 @@ class VLMAnnotationApp:
     
     def toggle_delete_mode(self):
         """Toggle delete mode on/off"""
-        self.delete_mode_enabled = self.delete_mode_var.get()
+        # The server owns the images in server mode
+        self.delete_mode_enabled = self.delete_mode_var.get() and self.lease_client is None
         
         # Update the current status display
         if self.image_files:
-            status_text = f"Image {self.current_index + 1} of {len(self.image_files)}: {self.image_files[self.current_index]}"
-            if self.delete_mode_enabled:
-                status_text += " | Delete mode: ON - processed images will be moved"
-            self.status_label.config(text=status_text)
+            self.status_label.config(text=self.get_status_text())
+    
+    def get_status_text(self):
+        """Status bar text for the current image, with the number of images found so far"""
+        status_text = f"Image {self.current_index + 1} of {len(self.image_files)}: {self.image_files[self.current_index]}"
+        if self.delete_mode_enabled:
+            status_text += " | Delete mode: ON - processed images will be moved"
+        if self.image_files[self.current_index] in self.propagated:
+            status_text += " | Annotated through a near-duplicate"
+        elif self.current_status in (SAVED, SKIPPED):
+            status_text += f" | Already {self.current_status}"
+        if self.current_duplicates:
+            status_text += f" | {len(self.current_duplicates)} near-duplicates"
+        if self.scanner.scanning:
+            status_text += " (scanning...)"
+        return status_text
+    
+    def get_near_duplicates(self, img_filename):
+        """Other images in the input folder that look nearly the same as this one"""
+        if self.phash_index is None:
+            return []
+        # The index only reports files that are still in the input folder
+        return [name for name in self.phash_index.near_duplicates(self.input_folder, img_filename,
+                                                                  DUPLICATE_MAX_DISTANCE)
+                if name not in self.propagated]
     
     def move_to_delete_if_enabled(self, img_filename):
         """Move image to DELETE folder if delete mode is enabled"""
-        if not self.delete_mode_enabled:
+        if not self.delete_mode_enabled or self.lease_client is not None:
             return False
             
         source_path = os.path.join(self.input_folder, img_filename)
         dest_path = os.path.join(self.delete_folder, img_filename)
         
         try:
-            # Move the image to the DELETE folder
-            shutil.move(source_path, dest_path)
+            # Move the image to the DELETE folder (a single rename on the same drive)
+            move_file(source_path, dest_path)
+            self.annotation_state.mark_moved(img_filename)
+            if self.phash_index is not None:
+                self.phash_index.remove_files(self.input_folder, [img_filename])
             print(f"Image moved to DELETE: {img_filename}")
             return True
         except Exception as e:
@@ -244,73 +431,87 @@ class VLMAnnotationApp:
             return False
     
     def copy_image_to_annotated(self, img_filename):
-        """Copy image to annotated_images folder"""
+        """Link or copy image into the annotated_images store, returns its path there or None"""
         source_path = os.path.join(self.input_folder, img_filename)
-        dest_path = os.path.join(self.output_folder_images, img_filename)
         
         try:
-            # Copy the image to the annotated_images folder
-            shutil.copy2(source_path, dest_path)
-            print(f"Image copied to annotated_images: {img_filename}")
-            return True
+            # Hardlink/reflink when possible, so the image data is not copied
+            dest_path = self.image_store.add(source_path, img_filename)
+            print(f"Image stored in annotated_images: {img_filename}")
+            return dest_path
         except Exception as e:
             print(f"Error copying to annotated_images: {e}")
-            return False
+            return None
     
     def load_current_image(self):
         if not self.image_files:
             self.status_label.config(text="No images found!")
             return
         
+        start_time = time.perf_counter()
+        
         # Update status
-        status_text = f"Image {self.current_index + 1} of {len(self.image_files)}: {self.image_files[self.current_index]}"
-        if self.delete_mode_enabled:
-            status_text += " | Delete mode: ON - processed images will be moved"
-        self.status_label.config(text=status_text)
+        img_filename = self.image_files[self.current_index]
+        self.current_status = self.annotation_state.get_status(img_filename)
+        self.annotation_state.mark_viewed(img_filename)
+        self.current_duplicates = self.get_near_duplicates(img_filename)
+        self.status_label.config(text=self.get_status_text())
         
         # Load image
         img_path = os.path.join(self.input_folder, self.image_files[self.current_index])
         self.current_img_path = img_path
         
-        # Load and display image
-        original_img = cv2.imread(img_path)
-        original_img = cv2.cvtColor(original_img, cv2.COLOR_BGR2RGB)
-        self.current_img = original_img
+        # Reuse the display-ready frame when this image was shown before at this canvas size
+        canvas_size = get_canvas_size(self.image_canvas)
+        tk_img, display_img = get_display_photo(img_path, canvas_size, self.frame_cache, self.prefetcher)
+        
+        # Start decoding the neighbouring images while the user annotates this one
+        self.prefetcher.schedule(self.input_folder, self.image_files, self.current_index, canvas_size)
         
-        self.display_image(original_img, self.image_canvas)
+        self.current_img = display_img
+        
+        # Zooming in starts from this frame while sharper tiles load in the background
+        self.viewer.set_image(img_path, display_img)
+        if tk_img is None:
+            self.image_canvas.delete("all")
+            self.status_label.config(text=f"Could not load image: {self.image_files[self.current_index]}")
+        else:
+            self.draw_frame(tk_img, self.image_canvas)
+            METRICS.observe("load_image", time.perf_counter() - start_time)
         
         # Reset selections for new image
         self.reset_selections()
     
     def display_image(self, cv_img, canvas):
         """Displays an image centered on the canvas"""
-        canvas_width = canvas.winfo_width() or 600
-        canvas_height = canvas.winfo_height() or 600
-        
-        height, width = cv_img.shape[:2]
-        
-        # Calculate scale factor
-        scale = min(canvas_width / width, canvas_height / height) * 0.9
-        
-        new_width = int(width * scale)
-        new_height = int(height * scale)
-        
-        if scale != 1.0:
-            cv_img = cv2.resize(cv_img, (new_width, new_height))
+        display_img = scale_to_canvas(cv_img, get_canvas_size(canvas))
         
         # Convert to PIL and then to Tkinter format
-        pil_img = Image.fromarray(cv_img)
+        pil_img = Image.fromarray(display_img)
         tk_img = ImageTk.PhotoImage(pil_img)
         
+        self.draw_frame(tk_img, canvas)
+    
+    def draw_frame(self, tk_img, canvas):
+        """Draws a Tk image that is already scaled for the canvas, centered"""
+        canvas_width, canvas_height = get_canvas_size(canvas)
+        
         # Clear canvas and add image
         canvas.delete("all")
         
-        x_offset = (canvas_width - new_width) // 2
-        y_offset = (canvas_height - new_height) // 2
+        x_offset = (canvas_width - tk_img.width()) // 2
+        y_offset = (canvas_height - tk_img.height()) // 2
         
         canvas.create_image(x_offset, y_offset, anchor=tk.NW, image=tk_img)
         canvas.image = tk_img
     
+    def draw_fit_frame(self):
+        """Draw the current image fitted to the canvas again, after zooming out"""
+        img_path = os.path.join(self.input_folder, self.image_files[self.current_index])
+        tk_img, _ = get_display_photo(img_path, get_canvas_size(self.image_canvas), self.frame_cache, self.prefetcher)
+        if tk_img is not None:
+            self.draw_frame(tk_img, self.image_canvas)
+    
     def reset_selections(self):
         """Reset all selections for a new image"""
         self.viewpoint_var.set("")
@@ -366,7 +567,7 @@ class VLMAnnotationApp:
         self.preview_text.delete(1.0, tk.END)
         self.preview_text.insert(1.0, full_answer)
     
-    def generate_json_data(self):
+    def generate_json_data(self, image_path=None):
         """Generate the JSON data structure for the current annotation"""
         img_filename = self.image_files[self.current_index]
         base_name = os.path.splitext(img_filename)[0]
@@ -377,7 +578,7 @@ class VLMAnnotationApp:
         # Create the JSON structure with relative path to annotated_images
         json_data = {
             "id": base_name,
-            "image": os.path.join(self.output_folder_images, img_filename),
+            "image": image_path or os.path.join(self.output_folder_images, img_filename),
             "conversations": [
                 {
                     "from": "human", 
@@ -403,35 +604,84 @@ class VLMAnnotationApp:
             messagebox.showwarning("Warning", "Please select some details before saving.")
             return
         
-        # Generate JSON data
-        json_data = self.generate_json_data()
-        
         # Get filenames
         img_filename = self.image_files[self.current_index]
         base_name = os.path.splitext(img_filename)[0]
         json_filename = f"{base_name}.json"
         json_path = os.path.join(self.output_folder_labels, json_filename)
         
+        if self.lease_client is not None:
+            # The server stores the image and merges the record into its dataset
+            self.send_to_server(img_filename, SAVED, self.generate_json_data(), self.current_question, answer)
+            self.next_image()
+            return
+        
         try:
-            # Save JSON file to annotated_label folder
-            with open(json_path, 'w', encoding='utf-8') as f:
-                json.dump(json_data, f, indent=2, ensure_ascii=False)
+            # Put the image in the annotated_images store first, the record points at it
+            image_path = self.copy_image_to_annotated(img_filename)
+            
+            # Generate JSON data
+            json_data = self.generate_json_data(image_path)
             
-            # Copy image to annotated_images folder
-            self.copy_image_to_annotated(img_filename)
+            saved_to = self.write_record(json_data, json_path)
+            self.annotation_state.set_status(img_filename, SAVED, self.current_question, answer)
             
             # Move to DELETE folder if delete mode is enabled
             self.move_to_delete_if_enabled(img_filename)
             
-            self.status_label.config(text=f"Annotation saved: {json_filename} | Image copied to annotated_images")
+            status_text = f"Annotation saved: {saved_to} | Image copied to annotated_images"
+            
+            # Give the near-duplicates of this frame the same annotation
+            if self.propagate_var.get():
+                count = self.propagate_annotation(json_data, img_filename)
+                status_text += f" | Also saved for {count} near-duplicates"
+                print(f"Annotation of {img_filename} applied to {count} near-duplicates")
+            
+            self.status_label.config(text=status_text)
             self.next_image()
             
         except Exception as e:
             messagebox.showerror("Error", f"Could not save annotation: {str(e)}")
     
+    def write_record(self, json_data, json_path):
+        """Save a record to the label store, or as a JSON file in the annotated_label folder; returns where"""
+        with METRICS.timer("json_write"):
+            if self.label_store is not None:
+                shard_name = self.label_store.put(json_data)
+                self.label_store.flush()
+                return f"record {json_data['id']} in {shard_name}"
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(json_data, f, indent=2, ensure_ascii=False)
+            return os.path.basename(json_path)
+    
+    def propagate_annotation(self, json_data, img_filename):
+        """Save a copy of an annotation for every near-duplicate of an image, returns how many"""
+        count = 0
+        for dup_filename in self.get_near_duplicates(img_filename):
+            image_path = self.copy_image_to_annotated(dup_filename)
+            if image_path is None:
+                continue
+            
+            base_name = os.path.splitext(dup_filename)[0]
+            dup_data = dict(json_data, id=base_name, image=image_path)
+            dup_data["metadata"] = dict(json_data.get("metadata", {}), propagated_from=json_data["id"])
+            self.write_record(dup_data, os.path.join(self.output_folder_labels, f"{base_name}.json"))
+            self.annotation_state.set_status(dup_filename, SAVED, self.current_question,
+                                             json_data["conversations"][1]["value"])
+            
+            self.move_to_delete_if_enabled(dup_filename)
+            self.propagated.add(dup_filename)
+            count += 1
+        return count
+    
     def skip_current(self):
         """Skip the current image"""
         img_filename = self.image_files[self.current_index]
+        if self.lease_client is not None:
+            self.send_to_server(img_filename, SKIPPED)
+            self.next_image()
+            return
+        self.annotation_state.set_status(img_filename, SKIPPED)
         
         # Move to DELETE folder if delete mode is enabled
         self.move_to_delete_if_enabled(img_filename)
@@ -439,13 +689,79 @@ class VLMAnnotationApp:
         self.status_label.config(text=f"Image skipped: {img_filename}")
         self.next_image()
     
+    def send_to_server(self, img_filename, status, json_data=None, question=None, answer=None):
+        """Send a save or skip to the server on a worker thread, so a slow server does not freeze the window"""
+        self.in_flight.add(img_filename)
+        future = self.server_executor.submit(self.lease_client.finish, img_filename, status, json_data)
+        self.status_label.config(text=f"Sending {img_filename} to the server...")
+        self.root.after(50, self.check_server_result, future, img_filename, status, question, answer)
+    
+    def check_server_result(self, future, img_filename, status, question, answer):
+        """Record a finished server request, or report why the server refused it"""
+        if not future.done():
+            self.root.after(50, self.check_server_result, future, img_filename, status, question, answer)
+            return
+        
+        self.in_flight.discard(img_filename)
+        try:
+            future.result()
+        except Exception as e:
+            messagebox.showerror("Error", f"The server did not accept {img_filename}: {str(e)}")
+            return
+        self.annotation_state.set_status(img_filename, status, question, answer)
+        print(f"Image {status} on the server: {img_filename}")
+    
     def next_image(self):
-        if self.current_index < len(self.image_files) - 1:
-            self.current_index += 1
+        # Images that were annotated through a near-duplicate are skipped
+        next_index = self.current_index + 1
+        while next_index < len(self.image_files) and self.image_files[next_index] in self.propagated:
+            next_index += 1
+        
+        if next_index < len(self.image_files):
+            self.current_index = next_index
             self.load_current_image()
         else:
             messagebox.showinfo("Complete", "All images have been processed!")
     
+    def jump_to_next_pending(self):
+        """Go to the next image that was neither saved nor skipped"""
+        if not self.image_files:
+            return
+        
+        if self.lease_client is not None:
+            # Leased images are pending until the server accepted them; the local database also
+            # holds images of earlier sessions that are no longer leased
+            order = self.image_files[self.current_index + 1:] + self.image_files[:self.current_index + 1]
+            name = next((name for name in order
+                         if self.lease_client.is_held(name) and name not in self.in_flight), None)
+        else:
+            name = (self.annotation_state.next_pending(self.image_files[self.current_index])
+                    or self.annotation_state.first_pending())
+        if name not in self.image_index:
+            messagebox.showinfo("Complete", "There are no unlabeled images left!")
+            return
+        
+        self.current_index = self.image_index[name]
+        self.load_current_image()
+    
+    def show_skipped(self):
+        """List the skipped images; double-click one to go back to it"""
+        skipped = self.annotation_state.names_with_status(SKIPPED)
+        
+        window = tk.Toplevel(self.root)
+        window.title(f"Skipped images ({len(skipped)})")
+        listbox = tk.Listbox(window, width=60, height=25)
+        listbox.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        listbox.insert(tk.END, *skipped)
+        
+        def open_selected(event):
+            selection = listbox.curselection()
+            if selection and skipped[selection[0]] in self.image_index:
+                self.current_index = self.image_index[skipped[selection[0]]]
+                self.load_current_image()
+        
+        listbox.bind("<Double-Button-1>", open_selected)
+    
     def prev_image(self):
         if self.current_index > 0:
             self.current_index -= 1
@@ -456,6 +772,21 @@ def main():
     root = tk.Tk()
     app = VLMAnnotationApp(root, input_folder, output_folder_labels, output_folder_images, delete_folder, enable_delete_mode)
     root.mainloop()
+    # Send the saves still in flight before the remaining leases are released
+    app.server_executor.shutdown(wait=True)
+    app.scanner.stop()
+    app.phash_executor.shutdown(wait=False, cancel_futures=True)
+    if app.phash_index is not None:
+        app.phash_index.save()
+    app.annotation_state.close()
+    print(f"Stage timings:\n{METRICS.summary()}")
+    METRICS.close()
+    app.prefetcher.shutdown()
+    app.viewer.close()
+    if app.label_store is not None:
+        app.label_store.close()
+    print(app.frame_cache.stats())
+    print(app.viewer.tile_cache.stats())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond to model inference
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Bucketed latency histogram plus the most recent samples for on-screen display"""
+
+    def __init__(self, recent=256):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=recent)
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+
+    def percentile(self, q):
+        """Percentile of the recent samples in seconds"""
+        if not self.recent:
+            return 0.0
+        samples = sorted(self.recent)
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+class Metrics:
+    """Per-stage timers and histograms, shared by every module of the process.
+
+    Stages are timed with `with METRICS.timer("decode"):` or observe().
+    Observations can be logged to a CSV file (timestamp, app, stage, seconds) and
+    the histograms exported in the Prometheus text format, for the
+    node_exporter textfile collector; the program is the "app" label, since
+    Prometheus reserves "job" for the scrape target. Safe to use from any thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.csv_file = None
+        self.prometheus_path = None
+        self.app = "vlm_annotation"
+
+    def configure(self, csv_path=None, prometheus_path=None, app=None):
+        """Enable the CSV log and/or the Prometheus textfile export"""
+        with self.lock:
+            if csv_path:
+                folder = os.path.dirname(csv_path)
+                if folder:
+                    os.makedirs(folder, exist_ok=True)
+                is_new = not os.path.exists(csv_path)
+                self.csv_file = open(csv_path, 'a', encoding='utf-8', buffering=64 * 1024)
+                if is_new:
+                    self.csv_file.write("timestamp,app,stage,seconds\n")
+            self.prometheus_path = prometheus_path
+            if app:
+                self.app = app
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+            if self.csv_file is not None:
+                self.csv_file.write(f"{time.time():.3f},{self.app},{stage},{seconds:.6f}\n")
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def overlay_text(self, stages):
+        """Compact 'stage last (p95)' line in milliseconds for the status bar"""
+        parts = []
+        with self.lock:
+            for stage in stages:
+                histogram = self.histograms.get(stage)
+                if histogram is None or not histogram.recent:
+                    continue
+                parts.append(f"{stage} {histogram.recent[-1] * 1000:.0f}ms (p95 {histogram.percentile(95) * 1000:.0f})")
+        return " | ".join(parts)
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP vlm_stage_seconds Time spent per processing stage",
+            "# TYPE vlm_stage_seconds histogram"
+        ]
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                labels = f'app="{self.app}",stage="{stage}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'vlm_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'vlm_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"vlm_stage_seconds_sum{{{labels}}} {histogram.total:.6f}")
+                lines.append(f"vlm_stage_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """Flush the CSV log and rewrite the Prometheus textfile"""
+        with self.lock:
+            if self.csv_file is not None:
+                self.csv_file.flush()
+        if self.prometheus_path:
+            folder = os.path.dirname(self.prometheus_path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            # The collector may read at any moment, so replace the file atomically
+            tmp_path = self.prometheus_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, self.prometheus_path)
+
+    def summary(self):
+        """One line per stage: count, mean, p50 and p95 of the recent samples"""
+        lines = []
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                mean = histogram.total / histogram.count * 1000
+                lines.append(f"  • {stage}: {histogram.count}x, mean {mean:.1f}ms, "
+                             f"p50 {histogram.percentile(50) * 1000:.1f}ms, p95 {histogram.percentile(95) * 1000:.1f}ms")
+        return "\n".join(lines)
+
+    def close(self):
+        self.export()
+        with self.lock:
+            if self.csv_file is not None:
+                self.csv_file.close()
+                self.csv_file = None
+
+
+def timed_iter(stage, iterable):
+    """Yield from a lazy iterable (e.g. a streaming model), timing the work behind each item"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        METRICS.observe(stage, time.perf_counter() - start)
+        yield item
+
+
+# One registry per process, so every module reports into the same histograms
+METRICS = Metrics()
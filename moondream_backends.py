@@ -0,0 +1,183 @@
+import os
+import time
+
+import numpy as np
+
+
+def available_cpus():
+    """CPUs this process may run on (respects taskset and container limits where the OS reports them)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class HFBackend:
+    """The Hugging Face transformers model: float16 on the GPU, float32 on the CPU.
+
+    Every backend has the same interface: load(), encode_image(image or list
+    of images) and answer_question(encoding, question), plus cache_name (the
+    key of its answers in the answer cache), revision (the key of its
+    encodings), device and supports_batch_encode (whether encode_image takes a
+    list and returns one sliceable row per image). The heavy imports happen in
+    load().
+    """
+
+    name = "hf"
+    # Moondream returns an EncodedImage per call, which cannot be split per image
+    supports_batch_encode = False
+
+    def __init__(self, model_id, threads=None):
+        self.model_id = model_id
+        self.threads = threads
+        self.model = None
+        self.tokenizer = None
+        self.revision = model_id
+        self.device = None
+
+    @property
+    def cache_name(self):
+        return self.model_id
+
+    def set_threads(self, torch):
+        if self.threads:
+            torch.set_num_threads(self.threads)
+
+    def load(self):
+        """Load the model and tokenizer"""
+        # Heavy imports are only paid for when a model is actually loaded
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        self.set_threads(torch)
+        self.model = AutoModelForCausalLM.from_pretrained(
+            self.model_id,
+            trust_remote_code=True,
+            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32,
+            device_map="auto" if torch.cuda.is_available() else None
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        self.set_model_info()
+
+        # Check GPU availability
+        if torch.cuda.is_available():
+            print(f"CUDA available: {torch.cuda.get_device_name()}")
+        else:
+            print(f"Running on CPU (slower), {torch.get_num_threads()} threads")
+
+    def set_model_info(self):
+        # Encodings are only reusable with the exact same weights
+        config = getattr(self.model, "config", None)
+        self.revision = getattr(config, "_commit_hash", None) or self.model_id
+        self.device = getattr(self.model, "device", None)
+
+    def encode_image(self, image):
+        return self.model.encode_image(image)
+
+    def answer_question(self, encoding, question):
+        return self.model.answer_question(encoding, question, self.tokenizer)
+
+
+class QuantizedCPUBackend(HFBackend):
+    """The model on the CPU with int8 dynamic quantization of its Linear layers.
+
+    Linear weights are stored as int8 and activations are quantized on the
+    fly, which cuts the memory traffic of the matrix multiplies that dominate
+    CPU inference. Intra-op threads default to every available CPU and
+    inter-op parallelism is switched off, since the model runs one request at
+    a time. Answers can differ slightly from the float model, so they are
+    cached under their own name and encodings under their own revision.
+    """
+
+    name = "cpu-int8"
+
+    def __init__(self, model_id, threads=None):
+        super().__init__(model_id, threads or available_cpus())
+
+    @property
+    def cache_name(self):
+        return f"{self.model_id}+int8"
+
+    def set_threads(self, torch):
+        torch.set_num_threads(self.threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set before the first parallel work of the process
+            pass
+
+    def load(self):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForCausalLM
+
+        self.set_threads(torch)
+        model = AutoModelForCausalLM.from_pretrained(self.model_id, trust_remote_code=True,
+                                                     torch_dtype=torch.float32)
+        model.eval()
+        # In place, so the float weights are not held twice while quantizing
+        self.model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8,
+                                                            inplace=True)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+        self.set_model_info()
+        self.revision = f"{self.revision}+int8"
+        print(f"Running on CPU with int8 weights, {torch.get_num_threads()} threads")
+
+    def encode_image(self, image):
+        import torch
+
+        with torch.inference_mode():
+            return self.model.encode_image(image)
+
+    def answer_question(self, encoding, question):
+        import torch
+
+        with torch.inference_mode():
+            return self.model.answer_question(encoding, question, self.tokenizer)
+
+
+class StubBackend:
+    """Model-free backend for tests and benchmarks; answers only depend on the image and question.
+
+    The encoding is the 27x27 grayscale thumbnail of the image spread over
+    729 patches, like the real encoder's output shape. Optional delays
+    simulate the encoder and decoder; a batched encode costs one delay.
+    """
+
+    name = "stub"
+    supports_batch_encode = True
+
+    def __init__(self, model_id="stub", threads=None, encode_delay_ms=0, answer_delay_ms=0):
+        self.model_id = model_id
+        self.encode_delay = encode_delay_ms / 1000
+        self.answer_delay = answer_delay_ms / 1000
+        self.cache_name = f"{model_id}+stub"
+        self.revision = self.cache_name
+        self.device = None
+
+    def load(self):
+        pass
+
+    def _encode_one(self, image):
+        patches = np.asarray(image.convert('L').resize((27, 27)), dtype=np.float16).reshape(1, 729, 1) / 255
+        return np.repeat(patches, 720, axis=2)
+
+    def encode_image(self, image):
+        time.sleep(self.encode_delay)
+        if isinstance(image, list):
+            return np.concatenate([self._encode_one(one) for one in image])
+        return self._encode_one(image)
+
+    def answer_question(self, encoding, question):
+        time.sleep(self.answer_delay)
+        brightness = float(encoding[0, :, 0].astype(np.float32).mean())
+        return f"A stub answer to '{question}' for an image of brightness {brightness:.3f}."
+
+
+BACKENDS = {backend.name: backend for backend in (HFBackend, QuantizedCPUBackend, StubBackend)}
+
+
+def create_backend(name, model_id, threads=None):
+    """Backend by name ("hf", "cpu-int8" or "stub"), not loaded yet"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown Moondream backend '{name}', choose from: {', '.join(BACKENDS)}")
+    return BACKENDS[name](model_id, threads)
@@ -0,0 +1,268 @@
+import os
+from PIL import Image, ImageOps
+
+from answer_cache import hash_file_contents
+from frame_pipeline import load_encoder_frame
+from metrics import METRICS
+from moondream_backends import create_backend
+
+# Images are shrunk to fit this size before they go through the vision encoder
+ENCODE_SIZE = 512
+
+
+def estimate_confidence(answer):
+    """Calculate a simple confidence score based on response length and content"""
+    confidence = min(1.0, len(answer) / 50.0)  # Simple length-based confidence
+    if "yes" in answer.lower() or "no" in answer.lower():
+        confidence = min(confidence + 0.2, 1.0)  # Boost for definitive answers
+    return confidence
+
+
+def load_encoder_input(image_path):
+    """Decode an image like the app's frames (EXIF orientation applied) and shrink it to the encoder size"""
+    # The app reuses its prefetched frames only when they hold exactly these pixels, so both paths
+    # can share encodings and answers under one content hash
+    frame = load_encoder_frame(image_path, ENCODE_SIZE)
+    if frame is not None:
+        return frame.model_input(ENCODE_SIZE)
+
+    # Formats OpenCV cannot read
+    image = ImageOps.exif_transpose(Image.open(image_path)).convert('RGB')
+
+    # Resize image if too large (for speed)
+    if image.size[0] > ENCODE_SIZE or image.size[1] > ENCODE_SIZE:
+        image.thumbnail((ENCODE_SIZE, ENCODE_SIZE), Image.Resampling.LANCZOS)
+    return image
+
+
+def build_json_data(img_filename, output_folder_images, question, answer, confidence, model_name="moondream",
+                    image_path=None):
+    """Build an annotation record in the VLM training format used by the apps"""
+    return {
+        "id": os.path.splitext(img_filename)[0],
+        "image": image_path or os.path.join(output_folder_images, img_filename),
+        "conversations": [
+            {
+                "from": "human",
+                "value": f"<image>\n{question}"
+            },
+            {
+                "from": "gpt",
+                "value": answer
+            }
+        ],
+        "metadata": {
+            "ai_generated": True,
+            "confidence": confidence,
+            "model": model_name,
+            "question": question
+        }
+    }
+
+
+def build_conversation_json_data(img_filename, output_folder_images, turns, model_name="moondream",
+                                 image_path=None):
+    """Build a multi-turn annotation record from (question, answer, confidence) turns"""
+    conversations = []
+    for i, (question, answer, _) in enumerate(turns):
+        # Only the first human turn carries the image token
+        conversations.append({"from": "human", "value": f"<image>\n{question}" if i == 0 else question})
+        conversations.append({"from": "gpt", "value": answer})
+
+    return {
+        "id": os.path.splitext(img_filename)[0],
+        "image": image_path or os.path.join(output_folder_images, img_filename),
+        "conversations": conversations,
+        "metadata": {
+            "ai_generated": True,
+            "confidence": min((confidence for _, _, confidence in turns), default=0.0),
+            "model": model_name,
+            "questions": [question for question, _, _ in turns],
+            "turn_confidence": [confidence for _, _, confidence in turns]
+        }
+    }
+
+
+def format_turns(turns):
+    """Editable text of (question, answer) turns, one "Q: ... / A: ..." block per question"""
+    return "\n\n".join(f"Q: {question}\nA: {answer}" for question, answer in turns)
+
+
+def parse_turns(text):
+    """Read (question, answer) turns back from format_turns text, keeping the user's edits"""
+    turns = []
+    for line in text.splitlines():
+        if line.startswith("Q: "):
+            turns.append((line[3:].strip(), []))
+        elif turns:
+            answer_lines = turns[-1][1]
+            answer_lines.append(line[3:] if line.startswith("A: ") and not answer_lines else line)
+    return [(question, "\n".join(lines).strip()) for question, lines in turns]
+
+
+class MoondreamPredictor:
+    """Answers questions about image files with a loaded Moondream backend, without any UI.
+
+    The backend (see moondream_backends) runs the model; answers are cached
+    under its cache_name and encodings under its revision, so different
+    backends never share results. Answer and encoding caches are optional.
+    frame_source(image_path, size) may return the encoder input from an image
+    the caller already decoded (or None), so the file is not read and decoded
+    a second time; it must hold the same pixels load_encoder_input would.
+    """
+
+    def __init__(self, backend, answer_cache=None, encoding_cache=None, frame_source=None):
+        self.backend = backend
+        self.model_id = backend.cache_name
+        self.answer_cache = answer_cache
+        self.encoding_cache = encoding_cache
+        self.frame_source = frame_source
+        self.model_revision = backend.revision
+        self.device = backend.device
+
+    @classmethod
+    def load(cls, backend_name, model_id, threads=None, answer_cache=None, encoding_cache=None, frame_source=None):
+        """Create and load a backend by name, and wrap it in a predictor"""
+        backend = create_backend(backend_name, model_id, threads)
+        with METRICS.timer("model_load"):
+            backend.load()
+        return cls(backend, answer_cache, encoding_cache, frame_source)
+
+    def hash_file(self, image_path):
+        if self.answer_cache is not None:
+            return self.answer_cache.hash_file(image_path)
+        return hash_file_contents(image_path)
+
+    def cached_answer(self, content_hash, question):
+        if self.answer_cache is None:
+            return None
+        return self.answer_cache.get(content_hash, question, self.model_id)
+
+    def encode_images(self, image_paths, content_hashes):
+        """Return one encoding per image, running the vision encoder once for all cache misses"""
+        encodings = [None] * len(image_paths)
+        missing = []
+        for i, content_hash in enumerate(content_hashes):
+            if self.encoding_cache is not None:
+                encodings[i] = self.encoding_cache.get(content_hash, self.model_revision, device=self.device)
+            if encodings[i] is None:
+                missing.append(i)
+
+        if missing:
+            images = [self.encoder_input(image_paths[i]) for i in missing]
+            for i, encoding in zip(missing, self._encode(images)):
+                encodings[i] = encoding
+                if self.encoding_cache is not None:
+                    self.encoding_cache.put(content_hashes[i], self.model_revision, encoding)
+        return encodings
+
+    def encoder_input(self, image_path):
+        """The image shrunk for the encoder, from the caller's decoded frame when there is one"""
+        if self.frame_source is not None:
+            image = self.frame_source(image_path, ENCODE_SIZE)
+            if image is not None:
+                return image
+        return load_encoder_input(image_path)
+
+    def _encode(self, images):
+        with METRICS.timer("encode_image"):
+            return self._encode_untimed(images)
+
+    def _encode_untimed(self, images):
+        if len(images) > 1 and self.backend.supports_batch_encode:
+            # The vision encoder accepts a list and batches it; split the result per image
+            batch = self.backend.encode_image(images)
+            try:
+                if len(batch) == len(images):
+                    return [batch[i:i + 1] for i in range(len(images))]
+                print(f"Batched encoding returned {len(batch)} encodings for {len(images)} images, "
+                      f"encoding them one by one")
+            except TypeError as e:
+                print(f"Batched encoding returned an unsplittable result ({e}), encoding the images one by one")
+        return [self.backend.encode_image(image) for image in images]
+
+    def answer_encoded(self, encoding, question, content_hash=None):
+        """Run the text decoder on an encoded image and cache the answer"""
+        with METRICS.timer("answer_question"):
+            response = self.backend.answer_question(encoding, question)
+        answer = response.strip()
+        confidence = estimate_confidence(answer)
+
+        if self.answer_cache is not None and content_hash is not None:
+            self.answer_cache.put(content_hash, question, self.model_id, answer, confidence)
+        return answer, confidence
+
+    def describe_batch(self, image_paths, question):
+        """Answer one question for several images, returns a list of (answer, confidence)"""
+        results = [None] * len(image_paths)
+        todo = []
+        for i, image_path in enumerate(image_paths):
+            try:
+                content_hash = self.hash_file(image_path)
+            except Exception as e:
+                results[i] = (f"Error: {str(e)}", 0.0)
+                continue
+            cached = self.cached_answer(content_hash, question)
+            if cached is not None:
+                results[i] = cached
+            else:
+                todo.append((i, content_hash))
+
+        if todo:
+            try:
+                encodings = self.encode_images([image_paths[i] for i, _ in todo],
+                                               [content_hash for _, content_hash in todo])
+            except Exception as e:
+                # One bad file should not fail the whole batch: retry the images one by one
+                if len(todo) == 1:
+                    i, _ = todo[0]
+                    results[i] = (f"Error: {str(e)}", 0.0)
+                    return results
+                for i, _ in todo:
+                    results[i] = self.describe_batch([image_paths[i]], question)[0]
+                return results
+
+            for (i, content_hash), encoding in zip(todo, encodings):
+                try:
+                    results[i] = self.answer_encoded(encoding, question, content_hash)
+                except Exception as e:
+                    results[i] = (f"Error: {str(e)}", 0.0)
+        return results
+
+    def describe_questions(self, image_path, questions):
+        """Answer several questions about one image, returns a list of (answer, confidence).
+
+        The image is hashed and run through the vision encoder at most once;
+        every question that is not cached is answered from that encoding.
+        """
+        try:
+            content_hash = self.hash_file(image_path)
+        except Exception as e:
+            return [(f"Error: {str(e)}", 0.0)] * len(questions)
+
+        results = [self.cached_answer(content_hash, question) for question in questions]
+        todo = [i for i, result in enumerate(results) if result is None]
+        if not todo:
+            return results
+
+        try:
+            encoding = self.encode_images([image_path], [content_hash])[0]
+        except Exception as e:
+            for i in todo:
+                results[i] = (f"Error: {str(e)}", 0.0)
+            return results
+
+        # The text decoder takes one prompt per call, so the questions run back to back on the shared encoding
+        for i in todo:
+            try:
+                results[i] = self.answer_encoded(encoding, questions[i], content_hash)
+            except Exception as e:
+                results[i] = (f"Error: {str(e)}", 0.0)
+        return results
+
+    def generate_ai_description(self, image_path, question):
+        """Generate a description for one image, returns (answer, confidence)"""
+        answer, confidence = self.describe_batch([image_path], question)[0]
+        if answer.startswith("Error: "):
+            print(f"Error generating AI description: {answer[len('Error: '):]}")
+        return answer, confidence
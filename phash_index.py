@@ -0,0 +1,212 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 8  # 8x8 difference hash = 64 bits = 8 packed bytes
+
+# Number of set bits for every byte value, for vectorized Hamming distances
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def compute_dhash(image_path, hash_size=HASH_SIZE):
+    """Difference hash of an image as packed bits, or None if it cannot be read"""
+    # The hash only needs a thumbnail, so let the JPEG decoder skip most of the work
+    img = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        return None
+    small = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits.ravel())
+
+
+class PerceptualHashIndex:
+    """Perceptual hashes of the input images, for finding near-duplicate frames.
+
+    Hashes are kept in one packed (N, 8) uint8 array, so the distance from one
+    frame to every other frame is a single XOR + popcount lookup. Entries are
+    keyed by absolute path, so one index can serve several input folders. The
+    index is persisted as .npz with the file size and mtime of every entry;
+    unchanged files are not hashed again. Only files that add_files found in
+    this session (and remove_files did not drop since) are reported, so the
+    callers never have to check that a duplicate still exists. Safe to update
+    from a background thread.
+    """
+
+    def __init__(self, index_path, workers=None):
+        self.index_path = index_path
+        self.workers = workers or os.cpu_count() or 1
+        self.lock = threading.Lock()
+        self.paths = []
+        self.positions = {}  # absolute path -> row in hashes
+        self.stamps = []  # (size, mtime_ns) per row
+        self.hashes = np.zeros((0, HASH_SIZE * HASH_SIZE // 8), dtype=np.uint8)
+        self.present = np.zeros(0, dtype=bool)  # Rows whose file is currently in its folder
+        self.unreadable = {}  # path -> (size, mtime_ns) of files that could not be decoded this session
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            data = np.load(self.index_path, allow_pickle=False)
+            self.paths = data["paths"].tolist()
+            self.stamps = [tuple(stamp) for stamp in data["stamps"].tolist()]
+            self.hashes = data["hashes"]
+            self.positions = {path: i for i, path in enumerate(self.paths)}
+            self.present = np.zeros(len(self.paths), dtype=bool)
+        except Exception as e:
+            print(f"Could not load perceptual hash index, rebuilding it: {e}")
+
+    def save(self):
+        """Write the index to disk if it changed"""
+        with self.lock:
+            if not self.dirty:
+                return
+            paths = np.array(self.paths, dtype=str)
+            stamps = np.array(self.stamps, dtype=np.int64).reshape(-1, 2)
+            hashes = self.hashes.copy()
+            self.dirty = False
+            self.last_save = time.monotonic()
+
+        folder = os.path.dirname(self.index_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = self.index_path + ".tmp.npz"
+        np.savez(tmp_path, paths=paths, stamps=stamps, hashes=hashes)
+        os.replace(tmp_path, self.index_path)
+
+    def add_files(self, folder, image_files, save_interval=60.0):
+        """Hash new or changed images in parallel and add them to the index, returns how many were hashed"""
+        folder = os.path.abspath(folder)
+        todo = []
+        for name in image_files:
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stamp = (stat.st_size, stat.st_mtime_ns)
+            with self.lock:
+                row = self.positions.get(path)
+                if row is not None and self.stamps[row] == stamp:
+                    self.present[row] = True
+                    continue
+                if self.unreadable.get(path) == stamp:
+                    continue
+            todo.append((path, stamp))
+
+        if todo:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                hashes = list(pool.map(lambda item: compute_dhash(item[0]), todo))
+
+            new_rows = []
+            with self.lock:
+                for (path, stamp), image_hash in zip(todo, hashes):
+                    if image_hash is None:
+                        # Not retried until the file changes
+                        self.unreadable[path] = stamp
+                        continue
+                    self.unreadable.pop(path, None)
+                    row = self.positions.get(path)
+                    if row is not None:
+                        self.hashes[row] = image_hash
+                        self.stamps[row] = stamp
+                        self.present[row] = True
+                    else:
+                        self.positions[path] = len(self.paths) + len(new_rows)
+                        new_rows.append((path, stamp, image_hash))
+                if new_rows:
+                    self.paths.extend(path for path, _, _ in new_rows)
+                    self.stamps.extend(stamp for _, stamp, _ in new_rows)
+                    self.hashes = np.vstack([self.hashes, np.stack([h for _, _, h in new_rows])])
+                    self.present = np.concatenate([self.present, np.ones(len(new_rows), dtype=bool)])
+                self.dirty = True
+
+        if time.monotonic() - self.last_save >= save_interval:
+            self.save()
+        return sum(image_hash is not None for image_hash in hashes) if todo else 0
+
+    def remove_files(self, folder, image_files):
+        """Stop reporting images that left the folder; their hashes stay in case they come back"""
+        folder = os.path.abspath(folder)
+        with self.lock:
+            for name in image_files:
+                row = self.positions.get(os.path.join(folder, name))
+                if row is not None:
+                    self.present[row] = False
+
+    def near_duplicates(self, folder, name, max_distance):
+        """Names of the other images in the folder within max_distance bits of this one"""
+        folder = os.path.abspath(folder)
+        path = os.path.join(folder, name)
+        with self.lock:
+            row = self.positions.get(path)
+            if row is None:
+                return []
+            # add_files and remove_files change rows in place, so the one vectorized pass runs under the lock
+            distances = POPCOUNT[np.bitwise_xor(self.hashes, self.hashes[row])].sum(axis=1, dtype=np.uint16)
+            rows = np.flatnonzero(self.present & (distances <= max_distance))
+            paths = [self.paths[i] for i in rows if i != row]
+        return [os.path.basename(dup_path) for dup_path in paths if os.path.dirname(dup_path) == folder]
+
+    def clusters(self, max_distance, folder, image_files):
+        """Group the images of a folder into clusters of near-duplicates, returns a list of name lists.
+
+        Greedy leader clustering in image_files order: each image that is not
+        yet assigned starts a cluster with every unassigned image within
+        max_distance of it. Cost is O(N * clusters), vectorized per cluster.
+        """
+        folder = os.path.abspath(folder)
+        with self.lock:
+            paths = [os.path.join(folder, name) for name in image_files]
+            rows = np.array([self.positions[path] for path in paths if path in self.positions], dtype=np.int64)
+            # A copy, since add_files updates changed rows in place
+            subset = self.hashes[rows]
+            paths = self.paths
+
+        unassigned = np.ones(len(rows), dtype=bool)
+        clusters = []
+        for i in range(len(rows)):
+            if not unassigned[i]:
+                continue
+            distances = POPCOUNT[np.bitwise_xor(subset, subset[i])].sum(axis=1, dtype=np.uint16)
+            members = np.flatnonzero(unassigned & (distances <= max_distance))
+            unassigned[members] = False
+            clusters.append([os.path.basename(paths[rows[j]]) for j in members])
+        return clusters
+
+    def __len__(self):
+        return len(self.paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a perceptual hash index and report near-duplicate clusters")
+    parser.add_argument("folder", help="folder with images")
+    parser.add_argument("--index", default="cache/phash_index.npz", help="index file to create or update")
+    parser.add_argument("--max-distance", type=int, default=6, help="bits that may differ for a near-duplicate")
+    args = parser.parse_args()
+
+    index = PerceptualHashIndex(args.index)
+    image_files = [entry.name for entry in os.scandir(args.folder)
+                   if entry.name.lower().endswith(('.png', '.jpg', '.jpeg'))]
+
+    start_time = time.perf_counter()
+    hashed = index.add_files(args.folder, image_files)
+    index.save()
+    print(f"Hashed {hashed} new images in {time.perf_counter() - start_time:.1f}s ({len(index)} in index)")
+
+    start_time = time.perf_counter()
+    clusters = index.clusters(args.max_distance, args.folder, image_files)
+    print(f"{len(image_files)} images form {len(clusters)} clusters of near-duplicates "
+          f"({time.perf_counter() - start_time:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
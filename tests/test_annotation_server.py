@@ -0,0 +1,141 @@
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+from PIL import Image
+
+from annotation_server import AnnotationQueue, LeaseClient, make_server
+from annotation_state import PENDING, SAVED
+
+IMAGE_COUNT = 12
+
+
+def record(name):
+    return {"id": name, "image": name, "conversations": [
+        {"from": "human", "value": "<image>\nWhat do you see?"},
+        {"from": "gpt", "value": f"An answer for {name}"}
+    ]}
+
+
+@pytest.fixture
+def server(tmp_path, request):
+    """Queue over a folder of small images, served on a free port"""
+    lease_seconds = getattr(request, "param", 30)
+    folder = tmp_path / "annotate"
+    folder.mkdir()
+    for i in range(IMAGE_COUNT):
+        Image.new('RGB', (32, 24), (i * 20, 0, 0)).save(folder / f"img{i:02d}.jpg")
+
+    queue = AnnotationQueue(str(folder), str(tmp_path / "labels"), str(tmp_path / "images"),
+                            str(tmp_path / "state.sqlite"), lease_seconds)
+    http_server = make_server(queue, port=0)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    while queue.scanner.scanning:
+        time.sleep(0.01)
+    yield queue, f"http://127.0.0.1:{http_server.server_address[1]}"
+    http_server.shutdown()
+    http_server.server_close()
+    queue.close()
+
+
+def client(tmp_path, url, name, **options):
+    return LeaseClient(url, name, str(tmp_path / name), **options)
+
+
+def test_clients_never_get_the_same_image(server, tmp_path):
+    queue, url = server
+    clients = [client(tmp_path, url, f"annotator{i}", batch_size=2, poll_interval=0.1) for i in range(3)]
+    saved = {c.annotator: [] for c in clients}
+
+    def annotate(c):
+        c.start()
+        while True:
+            names = c.take_new()
+            for name in names:
+                c.save(name, record(name))
+                saved[c.annotator].append(name)
+            if not names:
+                if queue.status()["images"].get(PENDING, 0) == 0:
+                    break
+                time.sleep(0.01)
+        c.stop()
+
+    threads = [threading.Thread(target=annotate, args=(c,)) for c in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    all_saved = [name for names in saved.values() for name in names]
+    assert len(all_saved) == len(set(all_saved)) == IMAGE_COUNT
+    assert queue.status()["images"] == {SAVED: IMAGE_COUNT}
+    assert len(queue.label_store) == IMAGE_COUNT
+
+
+@pytest.mark.parametrize("server", [0.3], indirect=True)
+def test_abandoned_lease_expires_and_is_leased_again(server, tmp_path):
+    queue, url = server
+    abandoned = client(tmp_path, url, "abandoned")
+    other = client(tmp_path, url, "other")
+
+    first = abandoned.request("/lease", {"annotator": "abandoned", "count": 3})
+    # While the lease runs nobody else gets its images
+    second = other.request("/lease", {"annotator": "other", "count": IMAGE_COUNT})
+    assert not set(first["images"]) & set(second["images"])
+    other.request("/release", {"lease_id": second["lease_id"]})
+
+    time.sleep(0.5)
+    third = other.request("/lease", {"annotator": "other", "count": 3})
+    assert third["images"] == first["images"]
+    assert queue.status()["totals"]["expired"] == 3
+
+    # The abandoned annotator can no longer save an image that was leased to someone else
+    with pytest.raises(RuntimeError):
+        abandoned.request("/finish", {"lease_id": first["lease_id"], "name": first["images"][0],
+                                      "status": SAVED, "record": record(first["images"][0])})
+
+
+def test_images_outside_the_lease_are_refused(server, tmp_path):
+    queue, url = server
+    c = client(tmp_path, url, "annotator")
+    lease = c.request("/lease", {"annotator": "annotator", "count": 1})
+    leased = lease["images"][0]
+    other = next(f"img{i:02d}.jpg" for i in range(IMAGE_COUNT) if f"img{i:02d}.jpg" != leased)
+
+    with urllib.request.urlopen(f"{url}/images/{leased}?lease={lease['lease_id']}") as response:
+        assert response.read()[:2] == b"\xff\xd8"
+    for name in (other, "..%2Fstate.sqlite", "%2Fetc%2Fpasswd"):
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{url}/images/{name}?lease={lease['lease_id']}")
+        assert error.value.code == 409
+
+
+def test_image_that_fails_to_download_goes_back_to_the_queue(server, tmp_path):
+    queue, url = server
+    image_path = queue.image_path
+    failures = []
+
+    def fail_once(lease_id, name):
+        if not failures:
+            failures.append(name)
+            raise OSError("disk hiccup")
+        return image_path(lease_id, name)
+
+    queue.image_path = fail_once
+    c = client(tmp_path, url, "annotator", batch_size=4, poll_interval=0.1)
+    c.start()
+    saved = []
+    deadline = time.monotonic() + 20
+    while len(saved) < IMAGE_COUNT and time.monotonic() < deadline:
+        for name in c.take_new():
+            c.save(name, record(name))
+            saved.append(name)
+        time.sleep(0.01)
+    c.stop()
+
+    # The image that failed was released, leased again and saved like the others
+    assert failures[0] in saved
+    assert sorted(saved) == sorted(set(saved)) and len(saved) == IMAGE_COUNT
+    assert queue.status()["images"] == {SAVED: IMAGE_COUNT}
@@ -0,0 +1,34 @@
+import os
+
+from annotation_state import PENDING, SAVED, AnnotationState
+from folder_scanner import FolderScanner
+
+
+def listing_of(folder):
+    """One complete pass of the scanner over the folder"""
+    scanner = FolderScanner(folder, watch_interval=0)
+    scanner.start()
+    scanner.thread.join()
+    return scanner.take_listing()
+
+
+def test_sync_follows_deleted_and_replaced_images(tmp_path):
+    folder = tmp_path / "input"
+    folder.mkdir()
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        (folder / name).write_bytes(b"image " + name.encode())
+
+    state = AnnotationState(str(tmp_path / "state.sqlite"), str(folder))
+    assert state.sync(listing_of(str(folder))) == []
+    assert sorted(state.queue()) == ["a.jpg", "b.jpg", "c.jpg"]
+    state.set_status("a.jpg", SAVED, "question", "answer")
+    state.set_status("b.jpg", SAVED, "question", "answer")
+
+    # b.jpg is deleted, a.jpg is replaced by another image under the same name
+    os.remove(folder / "b.jpg")
+    (folder / "a.jpg").write_bytes(b"another, longer image")
+    assert state.sync(listing_of(str(folder))) == ["b.jpg"]
+    assert sorted(state.queue()) == ["a.jpg", "c.jpg"]
+    assert state.get_status("a.jpg") == PENDING
+    assert state.counts() == {PENDING: 2}
+    state.close()
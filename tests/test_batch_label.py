@@ -0,0 +1,71 @@
+import json
+import os
+
+from PIL import Image
+
+import batch_label
+from moondream_backends import StubBackend
+from moondream_model import MoondreamPredictor
+
+QUESTION = "Is the cow standing?"
+
+
+class ConfidenceStub(StubBackend):
+    """Long (confident) answers for bright images, short ones for dark images"""
+
+    def answer_question(self, encoding, question):
+        answer = super().answer_question(encoding, question)
+        return answer if float(encoding.mean()) > 0.5 else "Unclear"
+
+
+def make_images(folder):
+    os.makedirs(folder)
+    for i in range(3):
+        Image.new('RGB', (64, 48), (240, 240, 240)).save(os.path.join(folder, f"bright{i}.jpg"))
+        Image.new('RGB', (64, 48), (10, 10, 10)).save(os.path.join(folder, f"dark{i}.jpg"))
+
+
+def run(tmp_path, backend):
+    predictor = MoondreamPredictor(backend)
+    return batch_label.run_batch(predictor, str(tmp_path / "annotate"), str(tmp_path / "labels"),
+                                 str(tmp_path / "images"), str(tmp_path / "review.jsonl"),
+                                 str(tmp_path / "state.jsonl"), QUESTION, batch_size=4, threshold=0.9)
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_threshold_splits_saved_and_review(tmp_path):
+    make_images(str(tmp_path / "annotate"))
+    stats = run(tmp_path, ConfidenceStub())
+
+    assert (stats["saved"], stats["review"], stats["failed"]) == (3, 3, 0)
+    assert sorted(os.listdir(tmp_path / "labels")) == ["bright0.json", "bright1.json", "bright2.json"]
+    assert sorted(record["id"] for record in read_jsonl(tmp_path / "review.jsonl")) == ["dark0", "dark1", "dark2"]
+
+
+def test_second_run_resumes_from_journal(tmp_path):
+    make_images(str(tmp_path / "annotate"))
+    run(tmp_path, ConfidenceStub())
+
+    class FailingBackend(StubBackend):
+        def encode_image(self, image):
+            raise AssertionError("finished images must not be labeled again")
+
+    stats = run(tmp_path, FailingBackend())
+    assert (stats["saved"], stats["review"], stats["skipped"]) == (0, 0, 6)
+    assert len(read_jsonl(tmp_path / "review.jsonl")) == 3
+
+
+def test_review_records_are_not_duplicated_after_a_crash(tmp_path):
+    make_images(str(tmp_path / "annotate"))
+    run(tmp_path, ConfidenceStub())
+
+    # Crash after the review records were written but before the journal was
+    os.remove(tmp_path / "state.jsonl")
+    stats = run(tmp_path, ConfidenceStub())
+
+    assert stats["review"] == 3
+    assert len(read_jsonl(tmp_path / "review.jsonl")) == 3
@@ -0,0 +1,21 @@
+import pytest
+
+import Crop_prediction
+from crop_manifest import CropManifest
+
+
+def test_output_folder_keeps_its_shard_count(tmp_path, monkeypatch):
+    monkeypatch.setattr(Crop_prediction, "OUTPUT_FOLDER", str(tmp_path))
+    monkeypatch.setattr(Crop_prediction, "MANIFEST_PATH", str(tmp_path / "manifest.sqlite"))
+    assert Crop_prediction.recorded_shard_count() is None
+
+    # A run with 4 local shards leaves one manifest per shard
+    for shard_index in range(4):
+        CropManifest(str(tmp_path / f"manifest.{Crop_prediction.shard_suffix(shard_index, 4)}.sqlite")).close()
+    assert Crop_prediction.recorded_shard_count() == 4
+    Crop_prediction.check_shard_count(4)
+
+    # On a machine with another core count, --workers -1 must not silently pick a new split
+    for shard_count in (1, 8):
+        with pytest.raises(ValueError, match="processed with 4 shard"):
+            Crop_prediction.check_shard_count(shard_count)
@@ -0,0 +1,39 @@
+import os
+
+from crop_manifest import CropManifest
+from crop_shards import CropShardIndex, CropShardWriter, iter_samples, sample_key
+
+
+def write_image(writer, manifest, folder, image_path, crop_ids):
+    """Write one sample per crop id into group "0.90-0.95" and record them like Crop_prediction does"""
+    crops = []
+    for crop_id in crop_ids:
+        key = sample_key("img", crop_id)
+        writer.add("0.90-0.95", crop_id, key, b"jpeg" + bytes([crop_id]), "jpg", {"crop_id": crop_id})
+        crops.append((crop_id, f"{os.path.join(folder, '0.90-0.95')}#{key}", "0.90-0.95", 0.9, 0, 0, 0, 1, 1))
+    writer.flush()
+    manifest.record_images([{"path": image_path, "size": 1, "mtime_ns": 1, "model_hash": "m",
+                             "status": "cropped", "crops": crops}])
+
+
+def test_reprocessed_image_leaves_no_stale_samples(tmp_path):
+    folder = str(tmp_path / "shards")
+    manifest = CropManifest(str(tmp_path / "manifest.sqlite"))
+
+    writer = CropShardWriter(folder, 1024 * 1024)
+    write_image(writer, manifest, folder, "/images/a.jpg", [0, 1, 2])
+    write_image(writer, manifest, folder, "/images/b.jpg", [3])
+    writer.close()
+
+    # The next run processes a.jpg again and finds other boxes
+    writer = CropShardWriter(folder, 1024 * 1024)
+    write_image(writer, manifest, folder, "/images/a.jpg", [4, 5])
+    writer.close()
+    manifest.close()
+
+    keys = sorted(key for key, _ in iter_samples(folder))
+    assert keys == [sample_key("img", crop_id) for crop_id in (3, 4, 5)]
+
+    index = CropShardIndex(folder)
+    assert sorted(index.locations) == [3, 4, 5]
+    assert index.get(4) == (b"jpeg\x04", {"crop_id": 4})
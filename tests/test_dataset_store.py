@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from dataset_store import DatasetStore, StoreLockedError
+
+
+def record(record_id):
+    return {"id": record_id, "image": f"{record_id}.jpg", "conversations": []}
+
+
+def shard_path(folder):
+    return os.path.join(folder, "shard-00000.jsonl")
+
+
+def test_damaged_line_in_the_middle_keeps_later_records(tmp_path):
+    folder = str(tmp_path)
+    store = DatasetStore(folder)
+    for record_id in ("a", "b", "c"):
+        store.put(record(record_id))
+    store.close()
+    os.remove(os.path.join(folder, "index.json"))
+
+    # Damage the middle record without changing its length
+    with open(shard_path(folder), 'rb') as f:
+        lines = f.readlines()
+    lines[1] = b"#" * (len(lines[1]) - 1) + b"\n"
+    with open(shard_path(folder), 'wb') as f:
+        f.writelines(lines)
+
+    store = DatasetStore(folder)
+    assert "a" in store and "c" in store and "b" not in store
+    assert store.get("c")["image"] == "c.jpg"
+    store.close()
+    assert os.path.getsize(shard_path(folder)) == sum(len(line) for line in lines)
+
+
+def test_half_written_last_line_is_truncated(tmp_path):
+    folder = str(tmp_path)
+    store = DatasetStore(folder)
+    store.put(record("a"))
+    store.close()
+    size = os.path.getsize(shard_path(folder))
+    with open(shard_path(folder), 'ab') as f:
+        f.write(b'{"id": "b", "ima')
+
+    store = DatasetStore(folder)
+    assert len(store) == 1
+    store.put(record("c"))
+    store.close()
+    assert os.path.getsize(shard_path(folder)) > size
+    store = DatasetStore(folder)
+    assert [r["id"] for r in store.iter_records()] == ["a", "c"]
+    store.close()
+
+
+def test_store_held_by_another_opener_is_refused(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    with pytest.raises(StoreLockedError):
+        DatasetStore(str(tmp_path))
+    store.close()
+    DatasetStore(str(tmp_path)).close()
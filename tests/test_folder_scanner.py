@@ -0,0 +1,24 @@
+import os
+
+from folder_scanner import FolderScanner
+
+
+def test_rescan_reports_removed_and_readded_images(tmp_path):
+    for name in ("a.jpg", "b.jpg", "notes.txt"):
+        (tmp_path / name).write_bytes(b"data")
+
+    scanner = FolderScanner(str(tmp_path), watch_interval=0)
+    scanner._scan()
+    assert sorted(scanner.take_new()) == ["a.jpg", "b.jpg"]
+
+    # b.jpg leaves the folder, c.jpg arrives
+    os.remove(tmp_path / "b.jpg")
+    (tmp_path / "c.jpg").write_bytes(b"data")
+    scanner._scan()
+    assert scanner.take_new() == ["c.jpg"]
+    assert sorted(scanner.take_listing()) == ["a.jpg", "c.jpg"]
+
+    # b.jpg comes back and is reported like any new image
+    (tmp_path / "b.jpg").write_bytes(b"data")
+    scanner._scan()
+    assert scanner.take_new() == ["b.jpg"]
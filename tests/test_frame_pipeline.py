@@ -0,0 +1,25 @@
+import numpy as np
+from PIL import Image
+
+from frame_pipeline import load_frame
+from moondream_model import ENCODE_SIZE, load_encoder_input
+
+
+def test_app_frames_and_batch_share_the_encoder_input(tmp_path):
+    # A landscape JPEG stored rotated, like a phone photo taken upright
+    path = str(tmp_path / "rotated.jpg")
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    pixels = np.random.default_rng(0).integers(0, 256, (1600, 3000, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, exif=exif)
+
+    expected = load_encoder_input(path)
+    assert expected.size[0] < expected.size[1]
+
+    # A small canvas decodes at the encoder's DCT reduction, so the frame is reused as is
+    frame = load_frame(path, (300, 300), True, ENCODE_SIZE)
+    assert np.array_equal(np.asarray(frame.encoder_input(ENCODE_SIZE)), np.asarray(expected))
+
+    # A large canvas decodes finer, which would shrink to other pixels
+    frame = load_frame(path, (1500, 1500), True, ENCODE_SIZE)
+    assert frame.encoder_input(ENCODE_SIZE) is None
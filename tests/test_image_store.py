@@ -0,0 +1,18 @@
+import os
+
+from image_store import ImageStore
+
+
+def test_saving_an_image_twice_leaves_one_file(tmp_path):
+    source_folder = tmp_path / "in"
+    source_folder.mkdir()
+    (source_folder / "x.jpg").write_bytes(b"jpeg data")
+    store = ImageStore(str(tmp_path / "out"))
+
+    # Saved again after going back with prev_image
+    first = store.add(str(source_folder / "x.jpg"), "x.jpg")
+    second = store.add(str(source_folder / "x.jpg"), "x.jpg")
+
+    assert first == second
+    assert os.listdir(tmp_path / "out") == ["x.jpg"]
+    assert (tmp_path / "out" / "x.jpg").read_bytes() == b"jpeg data"
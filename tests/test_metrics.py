@@ -0,0 +1,29 @@
+from metrics import Metrics
+
+
+def test_csv_rows_and_prometheus_histogram(tmp_path):
+    csv_path = tmp_path / "metrics.csv"
+    prom_path = tmp_path / "textfile" / "metrics.prom"
+    metrics = Metrics()
+    metrics.configure(str(csv_path), str(prom_path), app="test_app")
+    metrics.observe("decode", 0.004)
+    metrics.observe("decode", 0.02)
+    metrics.observe("decode", 30.0)
+    metrics.close()
+
+    rows = [line.split(",") for line in csv_path.read_text().splitlines()]
+    assert rows[0] == ["timestamp", "app", "stage", "seconds"]
+    assert [row[1:] for row in rows[1:]] == [["test_app", "decode", "0.004000"], ["test_app", "decode", "0.020000"],
+                                            ["test_app", "decode", "30.000000"]]
+
+    lines = prom_path.read_text().splitlines()
+    labels = 'app="test_app",stage="decode"'
+    # Buckets are cumulative; the 30 s sample only lands in +Inf
+    assert f'vlm_stage_seconds_bucket{{{labels},le="0.001"}} 0' in lines
+    assert f'vlm_stage_seconds_bucket{{{labels},le="0.005"}} 1' in lines
+    assert f'vlm_stage_seconds_bucket{{{labels},le="0.025"}} 2' in lines
+    assert f'vlm_stage_seconds_bucket{{{labels},le="10.0"}} 2' in lines
+    assert f'vlm_stage_seconds_bucket{{{labels},le="+Inf"}} 3' in lines
+    assert f"vlm_stage_seconds_sum{{{labels}}} 30.024000" in lines
+    assert f"vlm_stage_seconds_count{{{labels}}} 3" in lines
+    assert not any("job=" in line for line in lines)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from answer_cache import AnswerCache
+from encoding_cache import EncodingCache
+from moondream_backends import create_backend
+from moondream_model import MoondreamPredictor
+
+QUESTIONS = ("Is the cow standing?", "How many cows are there?")
+
+
+class CountingCalls:
+    """Wraps a backend method and counts its calls"""
+
+    def __init__(self, method):
+        self.method = method
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.method(*args)
+
+
+def test_stub_backend_answers_all_questions_from_one_encoding(tmp_path):
+    image_path = str(tmp_path / "cow.jpg")
+    Image.new('RGB', (640, 480), (200, 180, 160)).save(image_path)
+
+    backend = create_backend("stub", "stub")
+    backend.load()
+    backend.encode_image = encode = CountingCalls(backend.encode_image)
+    backend.answer_question = answer = CountingCalls(backend.answer_question)
+    predictor = MoondreamPredictor(backend, AnswerCache(str(tmp_path / "answers.sqlite")), EncodingCache(1024 * 1024))
+
+    results = predictor.describe_questions(image_path, QUESTIONS)
+    assert [answer_text.startswith(f"A stub answer to '{question}'")
+            for (answer_text, _), question in zip(results, QUESTIONS)] == [True, True]
+    assert (encode.calls, answer.calls) == (1, 2)
+
+    # Asked again, every answer comes from the answer cache
+    assert predictor.describe_questions(image_path, QUESTIONS) == results
+    assert (encode.calls, answer.calls) == (1, 2)
+
+
+def test_int8_backend_quantizes_and_answers(tmp_path, monkeypatch):
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    class TinyModel(torch.nn.Module):
+        """Stands in for the downloaded model: one Linear layer behind the Moondream interface"""
+
+        def __init__(self):
+            super().__init__()
+            self.proj = torch.nn.Linear(27 * 27, 8)
+
+        def encode_image(self, image):
+            pixels = np.asarray(image.convert('L').resize((27, 27)), dtype=np.float32).reshape(1, -1) / 255
+            return self.proj(torch.from_numpy(pixels))
+
+        def answer_question(self, encoding, question, tokenizer):
+            return f" {question} {float(encoding.sum()):.2f} "
+
+    monkeypatch.setattr(transformers.AutoModelForCausalLM, "from_pretrained", lambda *args, **kwargs: TinyModel())
+    monkeypatch.setattr(transformers.AutoTokenizer, "from_pretrained", lambda *args, **kwargs: None)
+
+    backend = create_backend("cpu-int8", "tiny", threads=1)
+    backend.load()
+    assert isinstance(backend.model.proj, torch.ao.nn.quantized.dynamic.Linear)
+    assert backend.cache_name == "tiny+int8" and backend.revision.endswith("+int8")
+
+    image_path = str(tmp_path / "cow.jpg")
+    Image.new('RGB', (64, 48), (200, 180, 160)).save(image_path)
+    answer, confidence = MoondreamPredictor(backend).generate_ai_description(image_path, QUESTIONS[0])
+    assert answer.startswith(QUESTIONS[0]) and confidence > 0
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from phash_index import PerceptualHashIndex
+
+
+def write_gradient(folder, name, flip=False):
+    """A horizontal gradient; flipped, it hashes as far apart as possible"""
+    os.makedirs(folder, exist_ok=True)
+    row = np.linspace(0, 255, 64, dtype=np.uint8)
+    pixels = np.tile(row[::-1] if flip else row, (64, 1))
+    Image.fromarray(pixels).convert("RGB").save(os.path.join(folder, name))
+
+
+def test_folders_sharing_an_index_keep_their_own_duplicates(tmp_path):
+    first, second = str(tmp_path / "first"), str(tmp_path / "second")
+    write_gradient(first, "a.png")
+    write_gradient(first, "b.png")
+    # Same names in another folder, but different images
+    write_gradient(second, "a.png", flip=True)
+    write_gradient(second, "c.png")
+
+    index_path = str(tmp_path / "phash_index.npz")
+    index = PerceptualHashIndex(index_path, workers=2)
+    index.add_files(first, ["a.png", "b.png"])
+    index.add_files(second, ["a.png", "c.png"])
+    index.save()
+
+    assert index.near_duplicates(first, "a.png", 6) == ["b.png"]
+    assert index.near_duplicates(second, "a.png", 6) == []
+    assert index.near_duplicates(second, "c.png", 6) == []
+
+    # A moved file is no longer reported, and files are only reported once seen again after a restart
+    index.remove_files(first, ["b.png"])
+    assert index.near_duplicates(first, "a.png", 6) == []
+
+    index = PerceptualHashIndex(index_path)
+    assert len(index) == 4
+    assert index.add_files(first, ["a.png", "b.png"]) == 0
+    assert index.near_duplicates(first, "a.png", 6) == ["b.png"]
+    assert index.clusters(6, first, ["a.png", "b.png"]) == [["a.png", "b.png"]]
+
+
+def test_unreadable_images_are_not_counted_or_retried(tmp_path):
+    folder = str(tmp_path)
+    write_gradient(folder, "a.png")
+    with open(os.path.join(folder, "broken.jpg"), "wb") as f:
+        f.write(b"not a jpeg")
+
+    index = PerceptualHashIndex(str(tmp_path / "phash_index.npz"), workers=1)
+    assert index.add_files(folder, ["a.png", "broken.jpg"]) == 1
+    assert index.add_files(folder, ["a.png", "broken.jpg"]) == 0
+    assert len(index) == 1
@@ -0,0 +1,23 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from tile_viewer import ImagePyramid
+
+
+def test_level_built_after_close_leaves_no_scratch_file(tmp_path):
+    image_path = str(tmp_path / "large.png")
+    Image.fromarray(np.zeros((300, 400, 3), dtype=np.uint8)).save(image_path)
+    spill_folder = str(tmp_path / "spill")
+
+    # Every level is larger than the budget, so every level is spilled
+    pyramid = ImagePyramid(image_path, 1024, spill_folder)
+    assert pyramid.get(0).shape == (300, 400, 3)
+    assert len(os.listdir(spill_folder)) == 1
+    pyramid.close()
+    assert os.listdir(spill_folder) == []
+
+    # A background build that was already running finishes after close()
+    assert pyramid.get(0).shape == (300, 400, 3)
+    assert os.listdir(spill_folder) == []
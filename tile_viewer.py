@@ -0,0 +1,422 @@
+import math
+import os
+import tempfile
+import threading
+import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+from frame_pipeline import REDUCED_DECODE_FLAGS, fit_to_canvas, get_canvas_size
+from metrics import METRICS
+
+TILE_SIZE = 256  # Tile edge in pixels of a pyramid level
+MIN_TILE_SIZE = 16  # Smallest source tile when magnifying beyond 1:1
+ZOOM_STEP = 1.25  # Zoom factor per mouse-wheel notch
+MAX_ZOOM = 8.0  # Largest magnification, in screen pixels per image pixel
+FRAME_INTERVAL_MS = 16  # Redraws are coalesced to at most one per interval (about 60 fps)
+SHARPEN_POLL_MS = 50  # How often to check for a sharper level while it is being built
+
+
+class ImagePyramid:
+    """Power-of-two resolution levels of one image, built lazily.
+
+    Level k is the image scaled by 1 / 2**k; a preview can be added at a
+    fractional level. JPEG levels 1-3 come straight
+    from libjpeg's reduced decode, deeper levels are halved from the level
+    above, and level 0 is a full decode. Levels are kept in an LRU with a byte
+    budget; a level larger than the whole budget is written to a memory-mapped
+    scratch file, so only the pages that are actually viewed stay resident.
+    """
+
+    def __init__(self, img_path, max_bytes, spill_folder=None, executor=None):
+        self.img_path = img_path
+        self.max_bytes = max_bytes
+        self.spill_folder = spill_folder
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.levels = OrderedDict()  # level -> (array, bytes counted against the budget)
+        self.current_bytes = 0
+        self.building = {}  # level -> Future of a background build
+        self.spill_paths = []
+        self.closed = False
+
+        with Image.open(img_path) as img:
+            # Only reads the header
+            self.image_format = img.format
+            self.width, self.height = img.size
+            # cv2.imread applies the EXIF orientation, which swaps the sides of rotated photos
+            if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                self.width, self.height = self.height, self.width
+
+        # Levels down to the first one that fits in a single tile
+        self.level_count = 1
+        while max(self.width, self.height) / 2 ** (self.level_count - 1) > TILE_SIZE:
+            self.level_count += 1
+
+    def level_for_zoom(self, zoom):
+        """Coarsest level that still has at least one pixel per screen pixel at this zoom"""
+        level = 0
+        while level + 1 < self.level_count and 1 / 2 ** (level + 1) >= zoom:
+            level += 1
+        return level
+
+    def add_preview(self, array):
+        """Use an already decoded smaller copy (e.g. the fitted frame) as an in-between level"""
+        self._store(math.log2(self.width / array.shape[1]), array)
+
+    def get(self, level):
+        """Return the array of a level, building it on this thread if needed"""
+        with self.lock:
+            entry = self.levels.get(level)
+            if entry is not None:
+                self.levels.move_to_end(level)
+                return entry[0]
+
+        with METRICS.timer("pyramid_level"):
+            array = self._build(level)
+        return self._store(level, array)
+
+    def request(self, level):
+        """Return the level if it is ready, otherwise start building it in the background and return None"""
+        with self.lock:
+            entry = self.levels.get(level)
+            if entry is not None:
+                self.levels.move_to_end(level)
+                return entry[0]
+            future = self.building.get(level)
+            # Rebuild a level that was evicted, but do not retry one that failed
+            if future is None or future.cancelled() or (future.done() and future.exception() is None):
+                self.building[level] = self.executor.submit(self.get, level)
+        return None
+
+    def best_available(self, level):
+        """(level, array) of the ready level closest to the wanted one, preferring coarser levels"""
+        with self.lock:
+            candidates = sorted(self.levels, key=lambda k: (k < level, abs(k - level)))
+            if not candidates:
+                return None
+            return candidates[0], self.levels[candidates[0]][0]
+
+    def _build(self, level):
+        reduced_flags = dict(REDUCED_DECODE_FLAGS)
+        if level == 0 or (self.image_format == "JPEG" and 2 ** level in reduced_flags):
+            flag = cv2.IMREAD_COLOR if level == 0 else reduced_flags[2 ** level]
+            img = cv2.imread(self.img_path, flag)
+            if img is None:
+                raise ValueError(f"Could not read image: {self.img_path}")
+            return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+        # Halve the level above, which is cheap once that one exists
+        finer = self.get(level - 1)
+        height, width = finer.shape[:2]
+        return cv2.resize(finer, ((width + 1) // 2, (height + 1) // 2), interpolation=cv2.INTER_AREA)
+
+    def _store(self, level, array):
+        nbytes = array.nbytes
+        # A build that finishes after close() has no one to clean up its scratch file
+        if nbytes > self.max_bytes and self.spill_folder and not self.closed:
+            array = self._spill(array)
+            # The OS pages the file in and out, it does not count against the budget
+            nbytes = 0
+
+        with self.lock:
+            if self.closed:
+                return array
+            if level in self.levels:
+                return self.levels[level][0]
+            self.levels[level] = (array, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes and len(self.levels) > 1:
+                _, (_, old_nbytes) = self.levels.popitem(last=False)
+                self.current_bytes -= old_nbytes
+        return array
+
+    def _spill(self, array):
+        os.makedirs(self.spill_folder, exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix=".npy", dir=self.spill_folder)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        with self.lock:
+            if not self.closed:
+                self.spill_paths.append(path)
+                return np.load(path, mmap_mode='r')
+        # close() ran while the file was written, so it is not kept
+        os.remove(path)
+        return array
+
+    def close(self):
+        """Drop all levels and remove the scratch files"""
+        with self.lock:
+            self.closed = True
+            self.levels.clear()
+            self.current_bytes = 0
+            for future in self.building.values():
+                future.cancel()
+        for path in self.spill_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                # Still mapped on Windows, the scratch file is left behind
+                pass
+
+
+class TileCache:
+    """LRU cache of rendered tiles (Tk images) with a memory budget"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (tk_img, nbytes)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, tk_img, nbytes):
+        self.entries[key] = (tk_img, nbytes)
+        self.current_bytes += nbytes
+        while self.current_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, old_nbytes) = self.entries.popitem(last=False)
+            self.current_bytes -= old_nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        """Summary of the hit/miss counters and memory use"""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return (f"Tile cache: {self.hits} hits, {self.misses} misses ({hit_rate:.0%}), "
+                f"{len(self.entries)} tiles, {self.current_bytes / 1e6:.1f} MB")
+
+
+class TiledImageViewer:
+    """Zoom and pan on a Tk canvas, drawing only the visible tiles of an image pyramid.
+
+    At the fitted size the app keeps drawing its prefetched frame; the viewer
+    takes over when the user zooms in with the mouse wheel and calls on_fit
+    when zoomed back out. Drag to pan, double-click to fit. Redraws are
+    coalesced to one per FRAME_INTERVAL_MS and use whatever level is ready
+    while a sharper one is built in the background.
+    """
+
+    def __init__(self, canvas, on_fit, tile_cache_bytes, level_cache_bytes, spill_folder=None):
+        self.canvas = canvas
+        self.on_fit = on_fit
+        self.tile_cache = TileCache(tile_cache_bytes)
+        self.level_cache_bytes = level_cache_bytes
+        self.spill_folder = spill_folder
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyramid")
+
+        self.img_path = None
+        self.preview = None
+        self.pyramid = None
+        self.zoom = None  # Screen pixels per image pixel, None while the fitted frame is shown
+        self.center_x = 0.0  # Image coordinates shown in the middle of the canvas
+        self.center_y = 0.0
+        self.drag_start = None
+        self.render_job = None
+        self.drawn = []  # Tk images on the canvas, kept alive even if the cache evicts them
+
+        canvas.bind("<MouseWheel>", self.on_wheel)
+        canvas.bind("<Button-4>", self.on_wheel)
+        canvas.bind("<Button-5>", self.on_wheel)
+        canvas.bind("<ButtonPress-1>", self.start_drag)
+        canvas.bind("<B1-Motion>", self.drag)
+        canvas.bind("<Double-Button-1>", lambda event: self.reset())
+        canvas.bind("<Configure>", lambda event: self.schedule_render())
+
+    @property
+    def zoomed(self):
+        return self.zoom is not None
+
+    def set_image(self, img_path, preview=None):
+        """Show a new image at the fitted size; its pyramid is only built on the first zoom.
+
+        preview is the fitted frame the app already decoded, shown (upscaled)
+        while the first sharper level is built.
+        """
+        self.cancel_render()
+        if self.pyramid is not None:
+            self.pyramid.close()
+        self.img_path = img_path
+        self.preview = preview
+        self.pyramid = None
+        self.zoom = None
+        self.drawn = []
+
+    def reset(self):
+        """Go back to the fitted frame drawn by the app"""
+        if self.zoom is None:
+            return
+        self.cancel_render()
+        self.zoom = None
+        self.drawn = []
+        self.on_fit()
+
+    def fit_zoom(self):
+        return fit_to_canvas(self.pyramid.width, self.pyramid.height, get_canvas_size(self.canvas))[0]
+
+    def on_wheel(self, event):
+        # Linux reports the wheel as buttons 4 and 5, Windows and macOS as a delta
+        factor = ZOOM_STEP if event.num == 4 or event.delta > 0 else 1 / ZOOM_STEP
+        self.zoom_at(event.x, event.y, factor)
+
+    def zoom_at(self, x, y, factor):
+        """Zoom by factor, keeping the image point under (x, y) in place"""
+        if self.img_path is None:
+            return
+        if self.pyramid is None:
+            try:
+                self.pyramid = ImagePyramid(self.img_path, self.level_cache_bytes, self.spill_folder, self.executor)
+                if self.preview is not None:
+                    self.pyramid.add_preview(self.preview)
+            except Exception as e:
+                print(f"Cannot zoom into {self.img_path}: {e}")
+                return
+
+        fit_zoom = self.fit_zoom()
+        if self.zoom is None:
+            if factor <= 1:
+                return
+            self.zoom = fit_zoom
+            self.center_x, self.center_y = self.pyramid.width / 2, self.pyramid.height / 2
+
+        canvas_width, canvas_height = get_canvas_size(self.canvas)
+        image_x = self.center_x + (x - canvas_width / 2) / self.zoom
+        image_y = self.center_y + (y - canvas_height / 2) / self.zoom
+        new_zoom = min(self.zoom * factor, MAX_ZOOM)
+        if new_zoom <= fit_zoom * 1.001:
+            self.reset()
+            return
+
+        self.zoom = new_zoom
+        self.center_x = image_x - (x - canvas_width / 2) / new_zoom
+        self.center_y = image_y - (y - canvas_height / 2) / new_zoom
+        self.clamp_center()
+        self.schedule_render()
+
+    def start_drag(self, event):
+        self.drag_start = (event.x, event.y, self.center_x, self.center_y)
+
+    def drag(self, event):
+        if self.zoom is None or self.drag_start is None:
+            return
+        start_x, start_y, center_x, center_y = self.drag_start
+        self.center_x = center_x - (event.x - start_x) / self.zoom
+        self.center_y = center_y - (event.y - start_y) / self.zoom
+        self.clamp_center()
+        self.schedule_render()
+
+    def clamp_center(self):
+        """Keep the view on the image; an axis that fits on the canvas is centered"""
+        canvas_width, canvas_height = get_canvas_size(self.canvas)
+        half_width = canvas_width / 2 / self.zoom
+        half_height = canvas_height / 2 / self.zoom
+        if self.pyramid.width <= 2 * half_width:
+            self.center_x = self.pyramid.width / 2
+        else:
+            self.center_x = min(max(self.center_x, half_width), self.pyramid.width - half_width)
+        if self.pyramid.height <= 2 * half_height:
+            self.center_y = self.pyramid.height / 2
+        else:
+            self.center_y = min(max(self.center_y, half_height), self.pyramid.height - half_height)
+
+    def schedule_render(self, delay_ms=FRAME_INTERVAL_MS):
+        """Redraw soon, merging all pan and zoom events until then into one frame"""
+        if self.zoom is not None and self.render_job is None:
+            self.render_job = self.canvas.after(delay_ms, self.render)
+
+    def cancel_render(self):
+        if self.render_job is not None:
+            self.canvas.after_cancel(self.render_job)
+            self.render_job = None
+
+    def render(self):
+        self.render_job = None
+        if self.zoom is None:
+            return
+        with METRICS.timer("tile_render"):
+            sharp = self.draw_tiles()
+        if not sharp:
+            # Redraw once the wanted level is built
+            self.schedule_render(SHARPEN_POLL_MS)
+
+    def draw_tiles(self):
+        """Draw the visible tiles, returns False while a sharper level is still being built"""
+        level = self.pyramid.level_for_zoom(self.zoom)
+        array = self.pyramid.request(level)
+        used_level = level
+        if array is None:
+            available = self.pyramid.best_available(level)
+            if available is None:
+                # Nothing to show yet: build the wanted level on this thread once
+                try:
+                    array = self.pyramid.get(level)
+                except Exception as e:
+                    print(f"Cannot zoom into {self.img_path}: {e}")
+                    self.reset()
+                    return True
+            else:
+                used_level, array = available
+
+        # Screen pixels per level pixel, and the view in level pixels
+        level_scale = array.shape[1] / self.pyramid.width
+        factor = self.zoom / level_scale
+        canvas_width, canvas_height = get_canvas_size(self.canvas)
+        left = (self.center_x - canvas_width / 2 / self.zoom) * level_scale
+        top = (self.center_y - canvas_height / 2 / self.zoom) * level_scale
+        right = left + canvas_width / factor
+        bottom = top + canvas_height / factor
+
+        # Beyond 1:1 smaller source tiles keep every rendered tile around TILE_SIZE on screen
+        tile = TILE_SIZE if factor <= 1 else max(MIN_TILE_SIZE, TILE_SIZE >> int(math.log2(factor)))
+        height, width = array.shape[:2]
+        first_col, last_col = max(0, int(left // tile)), min((width - 1) // tile, int(right // tile))
+        first_row, last_row = max(0, int(top // tile)), min((height - 1) // tile, int(bottom // tile))
+        origin_x, origin_y = round(left * factor), round(top * factor)
+
+        self.canvas.delete("all")
+        drawn = []
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                # Tile edges are rounded from shared boundaries, so neighbours never leave a gap
+                x0, x1 = round(col * tile * factor), round(min((col + 1) * tile, width) * factor)
+                y0, y1 = round(row * tile * factor), round(min((row + 1) * tile, height) * factor)
+                size = (max(1, x1 - x0), max(1, y1 - y0))
+                key = (self.img_path, used_level, tile, col, row, size)
+                tk_img = self.tile_cache.get(key)
+                if tk_img is None:
+                    pixels = array[row * tile:(row + 1) * tile, col * tile:(col + 1) * tile]
+                    if size != (pixels.shape[1], pixels.shape[0]):
+                        interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR
+                        pixels = cv2.resize(pixels, size, interpolation=interpolation)
+                    tk_img = ImageTk.PhotoImage(Image.fromarray(np.ascontiguousarray(pixels)))
+                    self.tile_cache.put(key, tk_img, size[0] * size[1] * 4)
+                self.canvas.create_image(x0 - origin_x, y0 - origin_y, anchor=tk.NW, image=tk_img)
+                drawn.append(tk_img)
+        self.drawn = drawn
+
+        sharp = used_level == level
+        zoom_text = f"{self.zoom:.0%}" if sharp else f"{self.zoom:.0%} (sharpening...)"
+        self.canvas.create_text(8, 8, anchor=tk.NW, text=zoom_text, fill="gray20")
+        return sharp
+
+    def close(self):
+        self.cancel_render()
+        if self.pyramid is not None:
+            self.pyramid.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.tile_cache.clear()